@@ -1,281 +1,242 @@
 import os
+import sys
 import serial
-import sqlite3
 import time
-from threading import Thread
-from queue import Queue
-import psutil
-import wave
+from threading import Thread, Lock
+from queue import Queue, Empty
 import pyaudio
 from mutagen import File
 from mutagen.mp4 import MP4
-import subprocess
+from audio_metadata import backfill_in_background
+from schema import migrate
+from playback_engine import PlaybackEngine, PyAudioSink
+from category_prefetch import CategoryPrefetcher
+from mic_capture import MicrophoneCapture
+from metrics import start_exporters, debug
 
 DB_PATH = r"mypath"
 RAW_WAV_FOLDER = r"mypath"
+SERIAL_PORT = os.getenv("AGORA_SERIAL_PORT", "COM8")
+# Counts arriving closer together than this are one spin of the dial; only the last one plays.
+ROTATION_SETTLE_SECONDS = 0.25
 
 rotation_counts = Queue()
-recording_active = False
-recording_stream = None
-recording_frames = []  
+arduino_events = Queue()
+playback_lock = Lock()
+playback_mode = "topic"
+current_playlist = []
 audio = pyaudio.PyAudio()
+# Finished recordings are renamed into RAW_WAV_FOLDER, where the watch daemon ingests them.
+microphone = MicrophoneCapture(audio, RAW_WAV_FOLDER)
 
-def stop_current_audio():
-    for process in psutil.process_iter(attrs=["pid", "name"]):
-        if process.info["name"] in ["Microsoft.Media.Player.exe"]:  
-            print(f"Stopping audio player process with PID: {process.info['pid']}")
-            process.terminate()
-            try:
-                process.wait(timeout=1)
-                print("Audio playback stopped.")
-            except psutil.TimeoutExpired:
-                print("Failed to stop playback within timeout.")
-            return
-    print("No audio player process found to stop.")
-
-def get_audio_duration(file_path):
-    try:
-        command = [
-            "ffprobe",
-            "-v", "error",
-            "-select_streams", "a:0",
-            "-show_entries", "stream=duration",
-            "-of", "csv=p=0",
-            file_path
-        ]
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        if result.returncode == 0:
-            duration = float(result.stdout.strip())
-            print(f"Duration of {file_path}: {duration} seconds")
-            return duration
-        else:
-            print(f"ffprobe error for file {file_path}: {result.stderr.strip()}")
-            return None
-    except Exception as e:
-        print(f"Error retrieving duration for {file_path}: {e}")
-        return None
-
-def play_category_name_audio(category_id, db_path):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT name_audio_path FROM categories WHERE id = ?", (category_id,))
-    result = cursor.fetchone()
-    conn.close()
+player = PlaybackEngine(PyAudioSink(audio))
+player.on_track_start = lambda file_path: print(f"Now playing: {file_path}")
+prefetcher = CategoryPrefetcher(DB_PATH)
 
-    if not result or not result[0]:
-        print(f"Category ID {category_id} has no name audio. Skipping.")
-        return
+def stop_current_audio():
+    if player.is_active():
+        player.stop()
+        print("Audio playback stopped.")
+    else:
+        print("No audio is playing.")
+
+def start_playback(file_path, then=()):
+    """
+    Start playing unless a newer dial position is already waiting. The rotation handler
+    queues the count and stops the player under the same lock, so a rotation can never
+    slip in between this check and play().
+    """
+    with playback_lock:
+        if not rotation_counts.empty():
+            return False
+        player.play(file_path, then=then)
+        return True
 
-    name_audio_path = result[0]
-    if not os.path.exists(name_audio_path):
-        print(f"Category name audio file does not exist: {name_audio_path}. Skipping.")
+def play_category_name_audio(plan, db_path):
+    if plan.name_audio_path is None:
+        print(f"Category ID {plan.category_id} has no name audio. Skipping.")
         return
 
-    print(f"Playing category name audio: {name_audio_path}")
-    try:
-        os.startfile(name_audio_path)
-
-        duration = get_audio_duration(name_audio_path)
-        if duration:
-            print(f"Category name audio duration: {duration:.2f} seconds")
-            time.sleep(duration)  
-        else:
-            print("Could not determine the duration of the category name audio.")
-    except Exception as e:
-        print(f"Error playing category name audio: {e}")
+    print(f"Playing category name audio: {plan.name_audio_path}")
+    if plan.name_audio_duration is None:
+        backfill_in_background(db_path, "categories", plan.category_id, plan.name_audio_path)
+    else:
+        print(f"Category name audio duration: {plan.name_audio_duration:.2f} seconds")
+    if start_playback(plan.name_audio_path):
+        player.wait()
 
 def start_recording():
-    global recording_stream, recording_frames, recording_active
-
     print("Starting recording...")
-    recording_frames = []  
-    recording_active = True  
     try:
-        recording_stream = audio.open(format=pyaudio.paInt16,
-                                       channels=1,
-                                       rate=8000,
-                                       input=True,
-                                       frames_per_buffer=1024)
-        print("Recording stream opened successfully.")
+        microphone.start()
     except Exception as e:
         print(f"Failed to open recording stream: {e}")
-        recording_active = False 
-
-    def record():
-        print("Recording thread started.")
-        while recording_active:
-            try:
-                data = recording_stream.read(1024, exception_on_overflow=False)
-                recording_frames.append(data)
-                print(f"Captured {len(data)} bytes of audio data.")
-            except Exception as e:
-                print(f"Error during recording: {e}")
-                break
-        print("Recording thread ended.")
-
-    Thread(target=record, daemon=True).start()
 
 def stop_recording():
-    global recording_stream, recording_frames, recording_active
-
     print("Stopping recording...")
-    print(f"Recording active state before stopping: {recording_active}")
-    recording_active = False  
-
-    if recording_stream:
-        print("Stopping recording stream...")
-        recording_stream.stop_stream()
-        recording_stream.close()
-        recording_stream = None
-
-        
-        recording_file = os.path.join(RAW_WAV_FOLDER, "temp_recording.wav")
-        if recording_frames:
-            try:
-                with wave.open(recording_file, 'wb') as wf:
-                    wf.setnchannels(1)
-                    wf.setsampwidth(audio.get_sample_size(pyaudio.paInt16))
-                    wf.setframerate(8000)
-                    wf.writeframes(b''.join(recording_frames))
-                print(f"Recording saved to {recording_file}. Total frames: {len(recording_frames)}")
-            except Exception as e:
-                print(f"Error saving recording: {e}")
-        else:
-            print("No frames were captured. Recording was empty.")
-    else:
+    if not microphone.active:
         print("Recording stream was not active.")
+        return
+    try:
+        microphone.stop()
+    except Exception as e:
+        print(f"Error saving recording: {e}")
 
 def playback_audio_with_navigation(category_id, mode, db_path):
-    play_category_name_audio(category_id, db_path)
-
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    if mode == "topic":
-        cursor.execute("SELECT id, file_path FROM recordings WHERE category_id = ?", (category_id,))
-    elif mode == "time":
-        cursor.execute("""
-            SELECT id, file_path 
-            FROM recordings 
-            WHERE strftime('%Y', creation_date) = ?
-        """, (str(category_id),))
-    else:
-        print("Invalid mode. Please select 'topic' or 'time'.")
-        conn.close()
+    try:
+        plan = prefetcher.get(category_id, mode)
+    except ValueError as e:
+        print(e)
         return
 
-    audio_files = cursor.fetchall()
-    conn.close()
+    if mode == "topic":
+        play_category_name_audio(plan, db_path)
 
-    if not audio_files:
+    for file_path in plan.missing:
+        print(f"File not found: {file_path}. Skipping.")
+    if not plan.tracks:
         print(f"No audio files found for category ID {category_id} in mode {mode}.")
         return
 
-    print(f"Playing {len(audio_files)} files in {mode} mode.")
-    for track_id, file_path in audio_files:
-        if not rotation_counts.empty():
-            print("New rotation detected during playback. Stopping current category.")
-            break
-
-        if not os.path.exists(file_path):
-            print(f"File not found: {file_path}. Skipping.")
-            continue
-
-        try:
-            print(f"Now playing: {file_path} (Track ID: {track_id})")
-
-            duration = get_audio_duration(file_path)
-            if duration is None:
-                print(f"Skipping {file_path} due to missing duration.")
-                continue
-
-            os.startfile(file_path)
+    for track_id, file_path, duration in plan.tracks:
+        if duration is None:
+            # Legacy row from before ingest recorded metadata: store it for next time.
+            backfill_in_background(db_path, "recordings", track_id, file_path)
+    playlist = plan.playlist
 
-            start_time = time.time()
-            while time.time() - start_time < duration:
-                if not rotation_counts.empty():
-                    print("New rotation detected during playback. Interrupting current audio.")
-                    return  
-
-                time.sleep(0.1)  
-
-            time.sleep(0.5)
+    if not playlist:
+        return
 
-        except Exception as e:
-            print(f"Error playing audio file {file_path}: {e}")
-            continue
+    print(f"Playing {len(playlist)} files in {mode} mode.")
+    current_playlist[:] = playlist
+    if not start_playback(playlist[0], then=playlist[1:]):
+        print("New rotation detected during playback. Stopping current category.")
+        return
+    # Blocks without polling; a rotation stops the player, which wakes this up.
+    player.wait()
+    if not rotation_counts.empty():
+        print("New rotation detected during playback. Interrupting current audio.")
+        return
 
     print("Finished playing all files in the current category.")
 
-def serial_worker(serial_port, baud_rate=9600):
-    global recording_active, recording_frames
+def parse_arduino_message(message):
+    """Turn one line from the Arduino into an (event, value) pair, or None if it is not a command."""
+    if message == "Microphone Activated":
+        return ("microphone", True)
+    if message == "Microphone Deactivated":
+        return ("microphone", False)
+    if message in ("next", "previous"):
+        return (message, None)
+    if message in ("topic", "time"):
+        return ("mode", message)
+    if message.startswith("Rotation Count:"):
+        try:
+            return ("rotation", int(message.split(":")[1].strip()))
+        except (ValueError, IndexError):
+            print(f"Error parsing rotation count: {message}")
+    return None
 
+def serial_worker(serial_port, baud_rate=9600):
     try:
-        with serial.Serial(serial_port, baud_rate, timeout=1) as arduino:
+        # timeout=None makes readline block in the driver until a full line arrives.
+        with serial.Serial(serial_port, baud_rate, timeout=None) as arduino:
             print("Connected to Arduino successfully.")
             while True:
-                if arduino.in_waiting > 0:
-                    message = arduino.readline().decode('utf-8').strip()
-                    print(f"Received from Arduino: {message}")
-
-                    if message == "Microphone Activated":
-                        if not recording_active:
-                            print("Starting recording...")
-                            stop_current_audio()  
-                            start_recording()  
-                            recording_active = True
-
-                    elif message == "Microphone Deactivated":
-                        if recording_active:
-                            print("Stopping recording...")
-                            stop_recording()  
-                            recording_active = False
-
-                    elif message.startswith("Rotation Count:"):
-                        try:
-                            count = int(message.split(":")[1].strip())
-                            print(f"Queueing rotation count: {count}")
-                            rotation_counts.put(count)  
-                        except (ValueError, IndexError):
-                            print(f"Error parsing rotation count: {message}")
+                line = arduino.readline()
+                if not line:
+                    continue
+                message = line.decode('utf-8', errors='replace').strip()
+                debug("Received from Arduino: %s", message)
+                event = parse_arduino_message(message)
+                if event is not None:
+                    arduino_events.put(event)
 
     except serial.SerialException as e:
         print(f"Error communicating with Arduino: {e}")
 
+def handle_microphone(activated):
+    if activated and not microphone.active:
+        stop_current_audio()
+        start_recording()
+    elif not activated and microphone.active:
+        stop_recording()
+
+def handle_rotation(count):
+    debug("Queueing rotation count: %d", count)
+    prefetcher.prefetch(count, playback_mode)
+    with playback_lock:
+        rotation_counts.put(count)
+        if player.is_active():
+            print("Interrupting current playback to switch category.")
+            player.stop()
+
+def handle_mode(mode):
+    global playback_mode
+    playback_mode = mode
+    print(f"Playback mode set to: {mode}")
+
+def skip_track(step):
+    with playback_lock:
+        if player.current_track not in current_playlist:
+            print("No track is playing.")
+            return
+        index = current_playlist.index(player.current_track) + step
+        if not 0 <= index < len(current_playlist):
+            print("No more tracks in this direction.")
+            return
+        player.play(current_playlist[index], then=current_playlist[index + 1:])
+
+def event_dispatcher():
+    handlers = {
+        "microphone": handle_microphone,
+        "rotation": handle_rotation,
+        "mode": handle_mode,
+        "next": lambda _: skip_track(1),
+        "previous": lambda _: skip_track(-1),
+    }
+    while True:
+        event, value = arduino_events.get()
+        try:
+            handlers[event](value)
+        except Exception as e:
+            print(f"Error handling {event} event: {e}")
+
 def playback_worker():
-    current_category_id = None
     last_rotation_count = None
-    is_playing = False
 
     while True:
-        if not rotation_counts.empty():
-            new_category_id = rotation_counts.get()
+        new_category_id = rotation_counts.get()
+        # Latest wins: keep taking counts until the dial has been still for the settle window.
+        while True:
+            try:
+                new_category_id = rotation_counts.get(timeout=ROTATION_SETTLE_SECONDS)
+            except Empty:
+                break
 
-            if new_category_id == last_rotation_count:
-                continue
-            last_rotation_count = new_category_id
+        if new_category_id == last_rotation_count and player.is_active():
+            continue
+        last_rotation_count = new_category_id
 
-            if new_category_id != current_category_id:
-                if is_playing:
-                    print("Interrupting current playback to switch category.")
-                    stop_current_audio()
-                    is_playing = False
+        print(f"Switching to category: {new_category_id}")
+        playback_audio_with_navigation(new_category_id, playback_mode, DB_PATH)
 
-                current_category_id = new_category_id
-                print(f"Switching to category: {current_category_id}")
-                playback_audio_with_navigation(current_category_id, "topic", DB_PATH)
-                is_playing = True
+if __name__ == "__main__":
+    migrate(DB_PATH)
 
-serial_thread = Thread(target=serial_worker, args=("COM8 ",), daemon=True)
-playback_thread = Thread(target=playback_worker, daemon=True)
+    start_exporters()
+    serial_port = sys.argv[1] if len(sys.argv) > 1 else SERIAL_PORT
+    serial_thread = Thread(target=serial_worker, args=(serial_port,), daemon=True)
+    dispatcher_thread = Thread(target=event_dispatcher, daemon=True)
+    playback_thread = Thread(target=playback_worker, daemon=True)
 
-serial_thread.start()
-playback_thread.start()
+    serial_thread.start()
+    dispatcher_thread.start()
+    playback_thread.start()
 
-try:
-    print("Playback Bridge is running. Press Ctrl+C to exit.")
-    while True:
-        time.sleep(1)
-except KeyboardInterrupt:
-    print("Exiting Playback Bridge.")
+    try:
+        print("Playback Bridge is running. Press Ctrl+C to exit.")
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Exiting Playback Bridge.")
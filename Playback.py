@@ -1,15 +1,179 @@
-from pydub import AudioSegment
-import sqlite3
-from datetime import datetime
+import threading
 import time
 import os
+from db import get_read_connection
+from schema import PLAYBACK_ORDER
+from playback_engine import PlaybackEngine
+from seek_table import load_seek_tables, seek_point
+from metrics import debug
+from remix_engine import create_remix
 
 BASE_DIR = r"mypath"
 DB_PATH = os.path.join(BASE_DIR, "MemoriaFM.db")
 CATEGORY_AUDIO_PATH = os.path.join(BASE_DIR, "CategoryAudio")
 AUDIO_FOLDER_PATH = os.path.join(BASE_DIR, "AudioRecordings")
+SEEK_STEP_SECONDS = 5.0
+# Previous track restarts the current one instead when more than this much of it has played.
+RESTART_THRESHOLD_SECONDS = 3.0
+NAVIGATION_TICK_SECONDS = 0.05
 
-def playback_audio_with_full_navigation_and_recording(category_id, mode, db_path):
+
+class PlaybackClock:
+    """Track position from time.monotonic(), so it stays accurate however often it is read."""
+
+    def __init__(self):
+        self._offset = 0.0
+        self._started_at = None
+
+    def start(self, offset=0.0):
+        self._offset = offset
+        self._started_at = time.monotonic()
+
+    def pause(self):
+        if self._started_at is not None:
+            self._offset = self.position()
+            self._started_at = None
+
+    def resume(self):
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+
+    def position(self):
+        if self._started_at is None:
+            return self._offset
+        return self._offset + time.monotonic() - self._started_at
+
+
+class NavigationController:
+    """
+    Track and in-track navigation over a playlist of (recording_id, file_path) on a
+    PlaybackEngine.
+
+    Seeks snap to the recording's seek table and start ffmpeg at that packet, so rewind,
+    fast-forward and resuming after a recording never decode from the start of the file.
+    The position clock restarts when the engine reports that a track's audio has begun.
+    """
+
+    def __init__(self, engine, tracks, seek_tables=None):
+        self.engine = engine
+        self.tracks = list(tracks)
+        self.seek_tables = seek_tables or {}
+        self.index = 0
+        self.clock = PlaybackClock()
+        # (file_path, start) of the last play() until the engine reports that track starting.
+        self._pending = None
+        self._lock = threading.Lock()
+        engine.on_track_start = self._on_track_start
+
+    @property
+    def current_track(self):
+        return self.tracks[self.index] if self.tracks else None
+
+    def duration(self, index=None):
+        recording_id = self.tracks[self.index if index is None else index][0]
+        return self.seek_tables.get(recording_id, (None, None))[1]
+
+    def position(self):
+        with self._lock:
+            if self._pending is not None:
+                return self._pending[1]
+            return self.clock.position()
+
+    def play(self, index=0, position=0.0):
+        """Start tracks[index] at position seconds, with the rest of the playlist queued behind it."""
+        recording_id, file_path = self.tracks[index]
+        table, duration = self.seek_tables.get(recording_id, (None, None))
+        if duration:
+            position = min(position, duration)
+        start = seek_point(table, position)
+        with self._lock:
+            self.index = index
+            self._pending = (file_path, start)
+            self.clock.pause()
+        self.engine.play(file_path, start=start, then=[path for _, path in self.tracks[index + 1:]])
+        return start
+
+    def seek(self, position):
+        return self.play(self.index, max(0.0, position))
+
+    def rewind(self, seconds=SEEK_STEP_SECONDS):
+        return self.seek(self.position() - seconds)
+
+    def fast_forward(self, seconds=SEEK_STEP_SECONDS):
+        """Jump ahead within the track; past its end moves on to the next one. Returns False at the end."""
+        target = self.position() + seconds
+        duration = self.duration()
+        if duration and target >= duration:
+            return self.next_track()
+        self.seek(target)
+        return True
+
+    def next_track(self):
+        if self.index >= len(self.tracks) - 1:
+            return False
+        self.play(self.index + 1)
+        return True
+
+    def previous_track(self):
+        if self.index > 0 and self.position() <= RESTART_THRESHOLD_SECONDS:
+            self.play(self.index - 1)
+        else:
+            self.play(self.index)
+        return True
+
+    def pause(self):
+        self.engine.pause()
+        with self._lock:
+            self.clock.pause()
+
+    def resume(self):
+        with self._lock:
+            self.clock.resume()
+        self.engine.resume()
+
+    def suspend(self):
+        """Stop for a recording and return (index, position) to hand back to resume_at()."""
+        saved = (self.index, self.position())
+        self.engine.stop()
+        with self._lock:
+            self._pending = None
+            self.clock.pause()
+        return saved
+
+    def resume_at(self, saved):
+        index, position = saved
+        return self.play(index, position)
+
+    def is_active(self):
+        return self.engine.is_active()
+
+    def _on_track_start(self, file_path):
+        with self._lock:
+            if self._pending is not None:
+                # Ignore a queued track from before the last play() that started in the meantime.
+                if file_path == self._pending[0]:
+                    self.clock.start(self._pending[1])
+                    self._pending = None
+            else:
+                # The engine moved on to the next queued track by itself.
+                self.index = min(self.index + 1, len(self.tracks) - 1)
+                self.clock.start(0.0)
+
+
+def load_playlist(db_path, category_id, mode):
+    cursor = get_read_connection(db_path).cursor()
+    if mode == "topic":
+        cursor.execute(f"SELECT id, file_path FROM recordings WHERE category_id = ? ORDER BY {PLAYBACK_ORDER}",
+                       (category_id,))
+    elif mode == "time":
+        cursor.execute(f"SELECT id, file_path FROM recordings WHERE creation_year = ? ORDER BY {PLAYBACK_ORDER}",
+                       (int(category_id),))
+    else:
+        raise ValueError("Invalid mode. Please select 'topic' or 'time'.")
+    return cursor.fetchall()
+
+
+def playback_audio_with_full_navigation_and_recording(category_id, mode, db_path, engine=None):
     """
     Play audio dynamically with track navigation, in-track seek, and recording/remix functionality.
 
@@ -17,139 +181,124 @@ def playback_audio_with_full_navigation_and_recording(category_id, mode, db_path
         category_id (int): The ID of the selected category (either topic ID or year).
         mode (str): Playback mode, either 'topic' or 'time'.
         db_path (str): Path to the SQLite database.
+        engine (PlaybackEngine): Player to use; one on the default output device when omitted.
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    if mode == "topic":
-        cursor.execute("SELECT id, file_path FROM recordings WHERE category_id = ?", (category_id,))
-    elif mode == "time":
-        cursor.execute("""
-            SELECT id, file_path
-            FROM recordings
-            WHERE strftime('%Y', creation_date) = ?
-        """, (str(category_id),))
-    else:
-        print("Invalid mode. Please select 'topic' or 'time'.")
-        conn.close()
+    try:
+        audio_files = load_playlist(db_path, category_id, mode)
+    except ValueError as e:
+        print(e)
         return
 
-    audio_files = cursor.fetchall()
-    conn.close()
-
     if not audio_files:
         print("No audio files found for the selected category.")
         return
 
     print(f"Playing {len(audio_files)} audio files in category ID {category_id}.")
 
-    current_track_index = 0
-    current_position = 0  
-    is_playing = True
+    owns_engine = engine is None
+    if owns_engine:
+        from playback_engine import PyAudioSink
+        engine = PlaybackEngine(PyAudioSink())
+    navigation = NavigationController(engine, audio_files, load_seek_tables(db_path, [i for i, _ in audio_files]))
+    navigation.play(0)
+
     is_recording = False
-    recording_mode = None  
-
-    while is_playing:
-        track_id, current_audio_file = audio_files[current_track_index]
-        current_audio = AudioSegment.from_file(current_audio_file)
-        audio_duration = len(current_audio) / 1000  
-
-        print(f"Now playing: {current_audio_file} (Track {current_track_index + 1} of {len(audio_files)})")
-
-        while current_position < audio_duration:
-            print(f"Current playback position: {current_position:.2f} seconds")
-            current_position += 1  
-            time.sleep(1)
-
-            forward_button_pressed = False
-            backward_button_pressed = False
-            rewind = False
-            fast_forward = False
-            remix_button_pressed = False
-            standard_recording_button_pressed = False
-            recording_start_button_pressed = False
-            recording_cancel_button_pressed = False
-
-            if forward_button_pressed:
-                if current_track_index < len(audio_files) - 1:
-                    current_track_index += 1
-                    current_position = 0  
-                    print("Skipping to the next track...")
-                    break
-                else:
-                    print("End of playlist reached.")
-                    is_playing = False
-                    break
-
-            if backward_button_pressed:
-                if current_track_index > 0:
-                    current_track_index -= 1
-                    current_position = 0  
-                    print("Returning to the previous track...")
-                    break
-                else:
-                    print("Already at the first track.")
-                    current_position = 0  
-                    continue
-
-            if rewind:
-                current_position = max(0, current_position - 5)  
-                print(f"Rewinding to: {current_position:.2f} seconds")
-                continue
-
-            if fast_forward:
-                current_position = min(audio_duration, current_position + 5)  
-                print(f"Fast-forwarding to: {current_position:.2f} seconds")
-                continue
-
-            if remix_button_pressed:
-                recording_mode = "remix"
-                print("Remix mode activated. Press the recording start button to begin.")
-                continue
-
-            if standard_recording_button_pressed:
-                recording_mode = "standard"
-                print("Standard recording mode activated. Press the recording start button to begin.")
-                continue
-
-            if recording_start_button_pressed and recording_mode:
-                print(f"Starting {recording_mode} recording. Pausing playback...")
-                is_recording = True
-                current_position_at_pause = current_position
-
-                if recording_mode == "remix":
-                    remix_file = "/path/to/recorded_remix_file.mp3"  
-                    mix_audio_with_remix_and_save(
-                        original_file=current_audio_file,
-                        remix_file=remix_file,
-                        pause_time=current_position,
-                        db_path=db_path,
-                        original_id=track_id,
-                        category_id=category_id
-                    )
-                elif recording_mode == "standard":
-                    simulate_standard_recording()  
-                print(f"{recording_mode.capitalize()} recording complete. Resuming playback...")
-                is_recording = False
-                recording_mode = None
-                current_position = current_position_at_pause
-                continue
-
-            if recording_cancel_button_pressed and is_recording:
-                print("Recording canceled. Resuming playback...")
-                is_recording = False
-                recording_mode = None
-                current_position = current_position_at_pause
-                continue
-
-            if current_position >= audio_duration:
-                if current_track_index < len(audio_files) - 1:
-                    current_track_index += 1
-                    current_position = 0
-                else:
-                    print("All tracks in the category have been played.")
-                    is_playing = False
+    recording_mode = None
+    saved_position = None
+    last_reported = None
+    last_track = None
+
+    while navigation.is_active() or is_recording:
+        time.sleep(NAVIGATION_TICK_SECONDS)
+        track_id, current_audio_file = navigation.current_track
+        current_position = navigation.position()
+        if navigation.index != last_track:
+            last_track = navigation.index
+            print(f"Now playing: {current_audio_file} (Track {navigation.index + 1} of {len(audio_files)})")
+        if int(current_position) != last_reported:
+            last_reported = int(current_position)
+            debug("Current playback position: %.2f seconds", current_position)
+
+        forward_button_pressed = False
+        backward_button_pressed = False
+        rewind = False
+        fast_forward = False
+        remix_button_pressed = False
+        standard_recording_button_pressed = False
+        recording_start_button_pressed = False
+        recording_cancel_button_pressed = False
+
+        if forward_button_pressed:
+            if navigation.next_track():
+                print("Skipping to the next track...")
+            else:
+                print("End of playlist reached.")
+                break
+            continue
+
+        if backward_button_pressed:
+            navigation.previous_track()
+            print("Returning to the previous track...")
+            continue
+
+        if rewind:
+            print(f"Rewinding to: {navigation.rewind():.2f} seconds")
+            continue
+
+        if fast_forward:
+            if not navigation.fast_forward():
+                print("End of playlist reached.")
+                break
+            print(f"Fast-forwarding to: {navigation.position():.2f} seconds")
+            continue
 
+        if remix_button_pressed:
+            recording_mode = "remix"
+            print("Remix mode activated. Press the recording start button to begin.")
+            continue
+
+        if standard_recording_button_pressed:
+            recording_mode = "standard"
+            print("Standard recording mode activated. Press the recording start button to begin.")
+            continue
+
+        if recording_start_button_pressed and recording_mode:
+            print(f"Starting {recording_mode} recording. Pausing playback...")
+            is_recording = True
+            saved_position = navigation.suspend()
+
+            if recording_mode == "remix":
+                remix_file = "/path/to/recorded_remix_file.mp3"  
+                mix_audio_with_remix_and_save(
+                    original_file=current_audio_file,
+                    remix_file=remix_file,
+                    pause_time=saved_position[1],
+                    db_path=db_path,
+                    original_id=track_id
+                )
+            elif recording_mode == "standard":
+                simulate_standard_recording()  
+            print(f"{recording_mode.capitalize()} recording complete. Resuming playback...")
+            is_recording = False
+            recording_mode = None
+            navigation.resume_at(saved_position)
+            continue
+
+        if recording_cancel_button_pressed and is_recording:
+            print("Recording canceled. Resuming playback...")
+            is_recording = False
+            recording_mode = None
+            navigation.resume_at(saved_position)
+            continue
+
+    engine.stop()
+    stats = engine.stats()
+    print(f"Track opens: {stats['opens']} (mean {stats['mean_open_seconds'] * 1000:.0f} ms), "
+          f"seeks: {stats['seeks']} (mean {stats['mean_seek_seconds'] * 1000:.0f} ms), "
+          f"next track pre-opened: {stats['preopen_hit_rate']:.0%}")
+    if owns_engine:
+        engine.close()
+    print("All tracks in the category have been played.")
     print("Playback complete.")
 
 def simulate_standard_recording():
@@ -160,7 +309,15 @@ def simulate_standard_recording():
     time.sleep(3)  
     print("Standard recording complete.")
 
-    Placeholder for mixing audio with remix functionality.
+def mix_audio_with_remix_and_save(original_file, remix_file, pause_time, db_path, original_id, mode="insert"):
+    """
+    Insert (or with mode="overlay", lay) remix_file into original_file at pause_time and
+    save the result next to the original with its lineage. It is ingested in the background,
+    so playback resumes as soon as the file is written. Returns the remix path.
     """
-    print(f"Mixing audio: {original_file} + {remix_file} at {pause_time} seconds.")
-    print(f"Saving remix to database under category {category_id} with reference to original ID {original_id}.")
+    print(f"Mixing audio: {original_file} + {remix_file} at {pause_time:.2f} seconds.")
+    try:
+        return create_remix(db_path, original_id, remix_file, pause_time, mode)
+    except Exception as e:
+        print(f"Could not create remix of recording ID {original_id}: {e}")
+        return None
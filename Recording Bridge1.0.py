@@ -1,36 +1,107 @@
 import os
 import time
-from pydub import AudioSegment
+import wave
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from metrics import span, debug, info, error
 
 
 RAW_WAV_FOLDER = r"mypath"
 AUDIO_RECORDINGS_FOLDER = r"mypath"
+AAC_BITRATE = "64k"
+DURATION_TOLERANCE = 0.5
+MAX_WORKERS = os.cpu_count() or 1
 
 
-def convert_wav_to_m4a():
-    if not os.path.exists(AUDIO_RECORDINGS_FOLDER):
-        os.makedirs(AUDIO_RECORDINGS_FOLDER, exist_ok=True)
+def get_wav_duration(wav_file_path):
+    """Duration from the WAV header alone, without reading the samples."""
+    try:
+        with wave.open(wav_file_path, "rb") as wf:
+            return wf.getnframes() / float(wf.getframerate())
+    except (wave.Error, EOFError):
+        return None
+
+
+def get_audio_duration(file_path):
+    command = [
+        "ffprobe",
+        "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "csv=p=0",
+        file_path
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        return None
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        return None
+
+
+def convert_wav_file(wav_file_path):
+    """
+    Convert one WAV from RAW_WAV_FOLDER to M4A in AUDIO_RECORDINGS_FOLDER and delete the WAV.
 
-    for file_name in os.listdir(RAW_WAV_FOLDER):
-        if file_name.endswith(".wav"):
-            wav_file_path = os.path.join(RAW_WAV_FOLDER, file_name)
+    ffmpeg streams the file from disk to a temporary .part file, which is renamed to .m4a
+    only after its duration has been checked against the WAV, so the ingest side never sees
+    a half-written file. The WAV is deleted only after that check passes.
+    Returns the path of the new M4A file, or None if the conversion failed.
+    """
+    base_name = os.path.splitext(os.path.basename(wav_file_path))[0]
+    m4a_file_name = f"{base_name}_{int(time.time())}.m4a"
+    m4a_file_path = os.path.join(AUDIO_RECORDINGS_FOLDER, m4a_file_name)
+    temp_file_path = m4a_file_path + ".part"
 
-            try:
-                print(f"Processing file: {wav_file_path}")
-                audio = AudioSegment.from_wav(wav_file_path)
+    try:
+        debug("Processing file: %s", wav_file_path)
+        command = [
+            "ffmpeg", "-nostdin", "-v", "error", "-y",
+            "-i", wav_file_path,
+            "-vn", "-c:a", "aac", "-b:a", AAC_BITRATE,
+            "-f", "mp4", temp_file_path
+        ]
+        with span("transcode"):
+            result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {result.stderr.strip()}")
 
-                base_name = os.path.splitext(file_name)[0]
-                m4a_file_name = f"{base_name}_{int(time.time())}.m4a"
-                m4a_file_path = os.path.join(AUDIO_RECORDINGS_FOLDER, m4a_file_name)
+        expected = get_wav_duration(wav_file_path)
+        actual = get_audio_duration(temp_file_path)
+        if not actual:
+            raise RuntimeError("converted file has no readable duration")
+        if expected is not None and abs(actual - expected) > max(DURATION_TOLERANCE, expected * 0.02):
+            raise RuntimeError(f"converted duration {actual:.2f}s does not match WAV duration {expected:.2f}s")
 
-                audio.export(m4a_file_path, format="mp4")
-                print(f"Converted and saved: {m4a_file_path}")
+        os.replace(temp_file_path, m4a_file_path)
+        info("Converted and saved: %s", m4a_file_path)
 
-                os.remove(wav_file_path)
-                print(f"Deleted original WAV file: {wav_file_path}")
+        os.remove(wav_file_path)
+        debug("Deleted original WAV file: %s", wav_file_path)
+        return m4a_file_path
+
+    except Exception as e:
+        error("Error processing file %s: %s", wav_file_path, e)
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+        return None
+
+
+def convert_wav_to_m4a(max_workers=MAX_WORKERS):
+    """
+    Convert every WAV in RAW_WAV_FOLDER. Each conversion runs in its own ffmpeg process,
+    so a small thread pool driving them keeps all cores busy.
+    """
+    if not os.path.exists(AUDIO_RECORDINGS_FOLDER):
+        os.makedirs(AUDIO_RECORDINGS_FOLDER, exist_ok=True)
 
-            except Exception as e:
-                print(f"Error processing file {wav_file_path}: {e}")
+    wav_files = [os.path.join(RAW_WAV_FOLDER, file_name)
+                 for file_name in os.listdir(RAW_WAV_FOLDER) if file_name.endswith(".wav")]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(convert_wav_file, wav_files))
+    converted = [path for path in results if path]
+    print(f"Converted {len(converted)} of {len(wav_files)} WAV files.")
+    return converted
 
 
 if __name__ == "__main__":
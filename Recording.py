@@ -1,5 +1,7 @@
 import os
 import time
+import threading
+import subprocess
 import requests
 import numpy as np
 from io import BytesIO
@@ -8,73 +10,190 @@ from openai import OpenAI
 from datetime import datetime
 import sqlite3
 from dotenv import load_dotenv
+from category_index import CategoryIndex
+from recording_index import RecordingIndex
+from db import get_connection, transaction
+from processed_ledger import ProcessedLedger, mark_fingerprint
+from http_client import post
+from embedding_batcher import EmbeddingBatcher, estimate_tokens
+from embedding_cache import EmbeddingCache
+from audio_metadata import safe_probe_audio, update_recording_metadata, update_category_metadata
+from schema import migrate
+from tts_cache import TTSCache
+from retry_queue import schedule_retry, clear_retry, due_retries, pending_paths
+from seek_table import safe_build_seek_table, store_seek_table
+from embedding_codec import encode_embedding, decode_embedding
+from metrics import span, timed, log_enabled, debug, info, warning, error
 load_dotenv()
 
 OPENAI_API_KEY = "key"
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
 ELEVENLABS_API_KEY = "key"
+ELEVENLABS_BASE_URL = os.getenv("ELEVENLABS_BASE_URL")
 
 
 
 DB_PATH = r"C:mypath"
 AUDIO_FOLDER_PATH = r"C:\mypath"
+RECORDING_INDEX_PATH = os.path.join(os.path.dirname(DB_PATH), "recording_index")
+EMBEDDING_CACHE_PATH = os.path.join(os.path.dirname(DB_PATH), "embedding_cache.db")
+EMBEDDING_MODEL = "text-embedding-3-large"
+EMBEDDING_DIMENSIONS = None
+# How embeddings are stored in the database: "float32", "float16" or "int8", optionally truncated
+# to the first EMBEDDING_STORAGE_DIMENSIONS. Convert existing rows with embedding_codec.py.
+EMBEDDING_STORAGE_FORMAT = "float32"
+EMBEDDING_STORAGE_DIMENSIONS = None
+# Keep a float32 copy of compactly stored category embeddings and re-rank matches with it.
+CATEGORY_RERANK = True
+UPLOAD_ENCODING_ENABLED = True
+UPLOAD_SAMPLE_RATE = 16000
+UPLOAD_BITRATE = "24k"
 VOICE_ID = "EXAVITQu4vr4xnSDxMaL"   
 MODEL_ID = "eleven_multilingual_v2"
+CATEGORY_AUDIO_DIR = r"C:\Users\relle\OneDrive\Desktop\Agora\CategoryAudio"
+
+_category_indexes = {}
+_recording_indexes = {}
+_recording_indexes_lock = threading.Lock()
+_category_lock = threading.Lock()
+# Default for store_processed_audio's probe results, so None can mean "probed and failed".
+_NOT_PROBED = object()
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+upload_stats = {"files": 0, "original_bytes": 0, "uploaded_bytes": 0, "fallbacks": 0}
+_upload_stats_lock = threading.Lock()
+_elevenlabs_client = None
+_tts_cache = None
+_tts_lock = threading.Lock()
 
 def normalize_file_name(file_name):
     return file_name.lower()
 
 
+def category_version(db_path):
+    return get_connection(db_path).execute("SELECT version FROM category_version WHERE id = 1").fetchone()[0]
+
+
+def get_category_index(db_path):
+    """
+    The in-memory CategoryIndex for db_path, reloaded when category_version shows that the
+    categories were changed elsewhere (recluster.py, --drop-empty) since it was built.
+    """
+    version = category_version(db_path)
+    index = _category_indexes.get(db_path)
+    if index is None or index.version != version:
+        index = CategoryIndex.from_db(db_path)
+        index.version = version
+        _category_indexes[db_path] = index
+    return index
+
+
+def recording_index_path(db_path):
+    """RECORDING_INDEX_PATH for DB_PATH; any other database keeps its index next to itself."""
+    if os.path.abspath(db_path) == os.path.abspath(DB_PATH):
+        return RECORDING_INDEX_PATH
+    return os.path.splitext(db_path)[0] + "_recording_index"
+
+
+def get_recording_index(db_path):
+    with _recording_indexes_lock:
+        index = _recording_indexes.get(db_path)
+        if index is None:
+            index = _recording_indexes[db_path] = RecordingIndex(recording_index_path(db_path))
+            index.sync(db_path)
+    return index
+
 
 def connect_to_db(db_path):
-    conn = sqlite3.connect(db_path)
-    return conn
+    return get_connection(db_path)
+
+def init_db(db_path):
+    """Create or migrate the schema, then queue any category name audio still missing."""
+    migrate(db_path)
+    resume_pending_category_audio(db_path)
 
 def process_audio_folder(folder_path, db_path):
-    print(f"process_audio_folder called with folder_path: {folder_path}")
-    ...
-    print(f"Contents of folder {folder_path}: {os.listdir(folder_path)}")
-    ...
-    def normalize_file_name(file_name):
-        return file_name.lower()
-
-    print(f"Scanning folder: {folder_path}")
+    info("Scanning folder: %s", folder_path)
     if not os.path.exists(folder_path):
-        print(f"Error: Path does not exist: {folder_path}")
+        error("Path does not exist: %s", folder_path)
         return
     if not os.path.isdir(folder_path):
-        print(f"Error: Path is not a directory: {folder_path}")
+        error("Path is not a directory: %s", folder_path)
         return
-    for file_name in os.listdir(folder_path):
-        if file_name.endswith(".m4a"):
-            normalized_name = normalize_file_name(file_name)
-            print(f"Checking processed status for: {normalized_name}")
-            if is_file_processed(db_path, normalized_name):
-                print(f"Skipping processed file: {normalized_name}")
+
+    init_db(db_path)
+    ledger = ProcessedLedger.load(db_path)
+    skipped = 0
+    processed = 0
+    for file_path, processed_name, fingerprint in due_retries(db_path):
+        if not os.path.exists(file_path):
+            clear_retry(db_path, file_path)
+            continue
+        if not process_audio_and_store_with_category(file_path, db_path, processed_name, fingerprint):
+            defer_failed_file(db_path, file_path, processed_name, fingerprint, "Ingest failed again.")
+        processed += 1
+
+    waiting = pending_paths(db_path)
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".m4a") or not entry.is_file() or entry.path in waiting:
+                continue
+            normalized_name = normalize_file_name(entry.name)
+            is_processed, fingerprint = ledger.check(normalized_name, entry.path, entry.stat())
+            if is_processed:
+                skipped += 1
                 continue
-            print(f"File is new and will be processed: {normalized_name}")
-            file_path = os.path.join(folder_path, file_name)
-            process_audio_and_store_with_category(file_path, db_path)
-            mark_file_as_processed(db_path, normalized_name)
+            debug("File is new and will be processed: %s", normalized_name)
+            if not process_audio_and_store_with_category(entry.path, db_path, processed_name=normalized_name,
+                                                         fingerprint=fingerprint):
+                defer_failed_file(db_path, entry.path, normalized_name, fingerprint, "Ingest failed.")
+            ledger.add(normalized_name, fingerprint)
+            processed += 1
+
+    info("Scan complete: %d processed, %d already ingested, %d files hashed.", processed, skipped, ledger.hashed_files)
 
 def is_file_processed(db_path, file_name):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    cursor = get_connection(db_path).cursor()
     cursor.execute("SELECT 1 FROM processed_files WHERE file_name = ?", (file_name,))
     result = cursor.fetchone()
-    conn.close()
-    print(f"Checked file: {file_name}, Processed: {result is not None}")
+    debug("Checked file: %s, Processed: %s", file_name, result is not None)
     return result is not None
 
-def mark_file_as_processed(db_path, file_name):
+def mark_file_as_processed(db_path, file_name, fingerprint=None):
     normalized_name = normalize_file_name(file_name) 
-    print(f"Marking file as processed: {normalized_name}")
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    debug("Marking file as processed: %s", normalized_name)
+    if fingerprint is not None:
+        mark_fingerprint(db_path, normalized_name, fingerprint)
+        return
+    cursor = get_connection(db_path).cursor()
     cursor.execute("INSERT INTO processed_files (file_name) VALUES (?)", (normalized_name,))
-    conn.commit()
-    conn.close()
 
 
+def defer_failed_file(db_path, file_path, processed_name=None, fingerprint=None, reason=None):
+    """
+    Put a file whose ingest failed on the retry queue. Once it has used up its attempts it
+    is marked as processed, as failed files always were, so scans stop picking it up.
+    """
+    if schedule_retry(db_path, file_path, processed_name, fingerprint, reason):
+        warning("Will retry %s later: %s", file_path, reason)
+        return True
+    error("Giving up on %s: %s", file_path, reason)
+    if processed_name is not None:
+        mark_file_as_processed(db_path, processed_name, fingerprint)
+    return False
+
+def serialize_embedding(embedding):
+    blob, storage_format = encode_embedding(embedding, EMBEDDING_STORAGE_FORMAT, EMBEDDING_STORAGE_DIMENSIONS)
+    return sqlite3.Binary(blob), storage_format
+
+def serialize_category_embedding(embedding):
+    """(blob, format, full-precision blob or None) for a categories row."""
+    blob, storage_format = serialize_embedding(embedding)
+    full = None
+    if CATEGORY_RERANK and (storage_format != "float32" or EMBEDDING_STORAGE_DIMENSIONS):
+        full = sqlite3.Binary(np.asarray(embedding, dtype=np.float32).tobytes())
+    return blob, storage_format, full
+
 def cosine_similarity(vec1, vec2):
     dot_product = np.dot(vec1, vec2)
     norm_vec1 = np.linalg.norm(vec1)
@@ -82,32 +201,128 @@ def cosine_similarity(vec1, vec2):
     return dot_product / (norm_vec1 * norm_vec2)
 
 
-def generate_embedding(text, model="text-embedding-ada-002"):
-    """
-    Generate an embedding for the given text using OpenAI's embedding endpoint via HTTPS.
-    """
-    url = "https://api.openai.com/v1/embeddings"
+def get_embedding_cache():
+    global _embedding_cache
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH)
+    return _embedding_cache
+
+
+@timed("embed")
+def _request_embeddings(texts, model, dimensions):
+    url = f"{OPENAI_BASE_URL}/embeddings"
     headers = {
         "Authorization": f"Bearer {OPENAI_API_KEY}",
         "Content-Type": "application/json"
     }
     data = {
-        "input": text,
-        "model": "text-embedding-3-large"
+        "input": texts,
+        "model": model
     }
+    if dimensions:
+        data["dimensions"] = dimensions
+
+    batch = [texts] if isinstance(texts, str) else texts
+    response = post(url, limit="embeddings", tokens=sum(estimate_tokens(text) for text in batch),
+                    headers=headers, json=data)
+    response.raise_for_status()
+    items = sorted(response.json()["data"], key=lambda item: item["index"])
+    return [np.array(item["embedding"], dtype=np.float32) for item in items]
+
+
+def generate_embedding(text, model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS):
+    """
+    Generate an embedding for the given text using OpenAI's embedding endpoint via HTTPS.
+    The embedding cache is checked first and filled on a miss.
+    """
+    cache = get_embedding_cache()
+    embedding = cache.get(text, model, dimensions)
+    if embedding is not None:
+        return embedding
 
     try:
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()  
-        embedding = response.json()["data"][0]["embedding"]
-        print(f"Generated embedding for text: {text[:50]}...")
-        return np.array(embedding, dtype=np.float32)
+        embedding = _request_embeddings(text, model, dimensions)[0]
+        debug("Generated embedding for text: %s...", text[:50])
+    except requests.exceptions.RequestException as e:
+        error("HTTP error occurred while generating embedding: %s", e)
+        return None
+    except (KeyError, IndexError, TypeError):
+        error("Unexpected response format from OpenAI.")
+        return None
+
+    cache.put(text, model, dimensions, embedding)
+    return embedding
+
+def generate_embeddings(texts, model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS):
+    """
+    Generate embeddings for a list of texts with a single request to the embedding endpoint,
+    sending only the texts that are not already in the embedding cache.
+    Returns a list of float32 arrays in input order, or None if the request failed.
+    """
+    cache = get_embedding_cache()
+    texts = list(texts)
+    embeddings = [cache.get(text, model, dimensions) for text in texts]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if not missing:
+        return embeddings
+
+    try:
+        fetched = _request_embeddings([texts[i] for i in missing], model, dimensions)
+        debug("Generated %d embeddings in one request (%d cached).", len(fetched), len(texts) - len(missing))
     except requests.exceptions.RequestException as e:
-        print(f"HTTP error occurred while generating embedding: {e}")
+        error("HTTP error occurred while generating embeddings: %s", e)
+        return None
+    except (KeyError, TypeError):
+        error("Unexpected response format from OpenAI.")
+        return None
+    if len(fetched) != len(missing):
+        error("Unexpected response format from OpenAI.")
+        return None
+
+    for i, embedding in zip(missing, fetched):
+        embeddings[i] = embedding
+        cache.put(texts[i], model, dimensions, embedding)
+    return embeddings
+
+@timed("upload_encode")
+def encode_for_upload(file_path):
+    """
+    Re-encode audio as mono 16 kHz Opus in memory for transcription, which needs far fewer
+    bytes than the archival file. Returns (file_name, data, content_type), or None when
+    encoding fails or would not make the upload smaller.
+    """
+    command = [
+        "ffmpeg", "-nostdin", "-v", "error",
+        "-i", file_path,
+        "-vn", "-ac", "1", "-ar", str(UPLOAD_SAMPLE_RATE),
+        "-c:a", "libopus", "-b:a", UPLOAD_BITRATE, "-application", "voip",
+        "-f", "ogg", "pipe:1"
+    ]
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=300)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        warning("Could not encode %s for upload: %s", file_path, e)
+        return None
+    if result.returncode != 0 or not result.stdout:
+        warning("Could not encode %s for upload: %s", file_path, result.stderr.decode(errors="replace").strip())
         return None
+    if len(result.stdout) >= os.path.getsize(file_path):
+        return None
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    return f"{base_name}.ogg", result.stdout, "audio/ogg"
+
+
+def _record_upload(original_bytes, uploaded_bytes, fell_back):
+    with _upload_stats_lock:
+        upload_stats["files"] += 1
+        upload_stats["original_bytes"] += original_bytes
+        upload_stats["uploaded_bytes"] += uploaded_bytes
+        upload_stats["fallbacks"] += 1 if fell_back else 0
+
 
 def transcribe_audio(file_path):
-    url = "https://api.openai.com/v1/audio/transcriptions"
+    url = f"{OPENAI_BASE_URL}/audio/transcriptions"
     headers = {
         "Authorization": f"Bearer {OPENAI_API_KEY}"
     }
@@ -115,24 +330,39 @@ def transcribe_audio(file_path):
         "model": "whisper-1"
     }
 
+    original_size = os.path.getsize(file_path)
+    encoded = encode_for_upload(file_path) if UPLOAD_ENCODING_ENABLED else None
+
     try:
-        with open(file_path, "rb") as audio_file:
-            response = requests.post(url, headers=headers, data=data, files={"file": audio_file})
-            response.raise_for_status()  
+        if encoded is not None:
+            file_name, payload, content_type = encoded
+            debug("Uploading %d bytes instead of %d (%d bytes saved).",
+                  len(payload), original_size, original_size - len(payload))
+            with span("transcribe"):
+                response = post(url, limit="transcriptions", headers=headers, data=data,
+                                files={"file": (file_name, BytesIO(payload), content_type)})
+            _record_upload(original_size, len(payload), False)
+        else:
+            with open(file_path, "rb") as audio_file, span("transcribe"):
+                response = post(url, limit="transcriptions", headers=headers, data=data, files={"file": audio_file})
+            _record_upload(original_size, original_size, UPLOAD_ENCODING_ENABLED)
+        response.raise_for_status()  
 
-            transcription = response.json()["text"]
-            print(f"Transcription: {transcription[:50]}...")
-            return transcription
+        transcription = response.json()["text"]
+        debug("Transcription: %s...", transcription[:50])
+        return transcription
     except requests.exceptions.RequestException as e:
-        print(f"HTTP error occurred while transcribing audio: {e}")
+        error("HTTP error occurred while transcribing audio: %s", e)
         return None
     except KeyError:
-        print("Unexpected response format from OpenAI.")
+        error("Unexpected response format from OpenAI.")
         return None
 
+@timed("category_name")
 def generate_category_name(transcription):
+    """Two-word category name from the chat API, or None when the request failed after its retries."""
     try:
-        url = "https://api.openai.com/v1/chat/completions"
+        url = f"{OPENAI_BASE_URL}/chat/completions"
 
         headers = {
             "Authorization": f"Bearer {OPENAI_API_KEY}",
@@ -155,156 +385,352 @@ def generate_category_name(transcription):
             "temperature": 0.7
         }
 
-        response = requests.post(url, headers=headers, json=data)
+        prompt_tokens = sum(estimate_tokens(message["content"]) for message in data["messages"])
+        response = post(url, limit="chat", tokens=prompt_tokens + data["max_tokens"], headers=headers, json=data)
         response.raise_for_status()  
 
         category_name = response.json()["choices"][0]["message"]["content"].strip()
-        print(f"Generated category name: {category_name}")
+        info("Generated category name: %s", category_name)
         return category_name
 
     except requests.exceptions.RequestException as e:
-        print(f"HTTP error occurred while generating category name: {e}")
-        return "Unnamed Category"
-    except KeyError:
-        print("Unexpected response format from OpenAI.")
-        return "Unnamed Category"
+        error("HTTP error occurred while generating category name: %s", e)
+        return None
+    except (KeyError, IndexError):
+        error("Unexpected response format from OpenAI.")
+        return None
 
-def create_new_category(db_path, embedding, transcription):
+def name_new_category(transcription):
+    """
+    (name, cached name clip or None, its metadata or None) for a category about to be
+    created. This makes the chat request, so call it before opening a write transaction.
+    """
     category_name = generate_category_name(transcription)
+    if not category_name:
+        # A placeholder name would attract unrelated recordings for good; fail so the file is retried.
+        raise RuntimeError("Could not generate a category name.")
+    audio_file_path = get_tts_cache().lookup(category_name, VOICE_ID, MODEL_ID)
+    name_audio_metadata = safe_probe_audio(audio_file_path) if audio_file_path else None
+    return category_name, audio_file_path, name_audio_metadata
+
+@timed("category_create")
+def create_new_category(db_path, embedding, category_name, audio_file_path=None, name_audio_metadata=None):
+    """
+    Insert a category for this embedding; name it first with name_new_category. Its name
+    clip comes from the TTS cache when the same name has been spoken before; otherwise the
+    row is stored without one, and once the insert has committed the caller starts the
+    clip with schedule_category_audio. Scheduling it here could attach the clip to an id a
+    rolled-back transaction gave up, which SQLite then hands to the next category.
+    """
+    cursor = get_connection(db_path).cursor()
+    version_before = category_version(db_path)
 
-    sanitized_name = category_name.replace(" ", "_").lower()
-    base_dir = r"C:\Users\relle\OneDrive\Desktop\Agora\CategoryAudio"
-
-    audio_file_path = os.path.join(base_dir, f"{sanitized_name}.mp3")
-
-    os.makedirs(os.path.dirname(audio_file_path), exist_ok=True)
-
-    generate_category_audio(category_name, audio_file_path)
-
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    serialized_embedding = embedding.tobytes()
+    serialized_embedding, storage_format, full_embedding = serialize_category_embedding(embedding)
     cursor.execute('''
-        INSERT INTO categories (name, embedding, name_audio_path)
-        VALUES (?, ?, ?)
-    ''', (category_name, sqlite3.Binary(serialized_embedding), audio_file_path))
-    conn.commit()
+        INSERT INTO categories (name, embedding, embedding_format, embedding_full, name_audio_path)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (category_name, serialized_embedding, storage_format, full_embedding, audio_file_path))
     new_category_id = cursor.lastrowid
-    conn.close()
-
-    print(f"Created new category: {category_name} (ID {new_category_id}) with audio path '{audio_file_path}'")
+    if name_audio_metadata is not None:
+        update_category_metadata(db_path, new_category_id, name_audio_metadata)
+
+    index = _category_indexes.get(db_path)
+    if index is not None:
+        # Index what was stored, so matching behaves the same before and after a restart.
+        index.add(new_category_id, category_name, decode_embedding(serialized_embedding, storage_format),
+                  embedding if full_embedding is not None else None)
+        # The insert bumped category_version; if the index was current, it still is.
+        if index.version == version_before:
+            index.version = category_version(db_path)
+
+    if audio_file_path:
+        info("Created new category: %s (ID %d) reusing audio '%s'", category_name, new_category_id, audio_file_path)
+    else:
+        info("Created new category: %s (ID %d); name audio will follow", category_name, new_category_id)
     return new_category_id
 
-def assign_or_create_category(db_path, embedding, transcription, threshold=0.50):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    cursor.execute('SELECT id, name, embedding FROM categories')
-    categories = cursor.fetchall()
-
-    for category in categories:
-        category_id = category[0]
-        category_name = category[1]
-        category_embedding = np.frombuffer(category[2], dtype=np.float32)
-
-        similarity = cosine_similarity(embedding, category_embedding)
-        print(f"Similarity with category '{category_name}' (ID {category_id}): {similarity}")
-
-        if similarity >= threshold:
-            conn.close()
-            print(f"Matched existing category: {category_name} (ID {category_id})")
-            return category_id
-
-    conn.close()
-    return create_new_category(db_path, embedding, transcription)
-
-def save_to_recordings(db_path, transcription, embedding, category_id, file_path):
-    conn = sqlite3.connect(db_path)
+def match_or_name_category(db_path, embedding, transcription, threshold=0.50, top_k=5):
+    """
+    (category_id, None) when an existing category matches, else (None, name_new_category(...)).
+    Nothing is written, so this runs before the write transaction; hold _category_lock
+    until the category is created so concurrent workers cannot both create it.
+    """
+    with span("category_match"):
+        index = get_category_index(db_path)
+        category_id, similarity, top = index.match(embedding, top_k=top_k, rerank=CATEGORY_RERANK)
+
+    if log_enabled("DEBUG"):
+        for candidate_id, candidate_name, score in top:
+            debug("Similarity with category '%s' (ID %d): %.4f", candidate_name, candidate_id, score)
+
+    if category_id is not None and similarity >= threshold:
+        debug("Matched existing category: %s (ID %d)", top[0][1], category_id)
+        return category_id, None
+    return None, name_new_category(transcription)
+
+def assign_or_create_category(db_path, embedding, transcription, threshold=0.50, top_k=5):
+    # Matching and creation happen under one lock so concurrent ingest workers
+    # cannot both miss and create the same category.
+    with _category_lock:
+        category_id, new_category = match_or_name_category(db_path, embedding, transcription, threshold, top_k)
+        if category_id is None:
+            category_id = create_new_category(db_path, embedding, *new_category)
+            if new_category[1] is None:
+                schedule_category_audio(db_path, category_id, new_category[0])
+        return category_id
+
+def save_to_recordings(db_path, transcription, embedding, category_id, file_path, metadata=None):
+    conn = get_connection(db_path)
     cursor = conn.cursor()
 
     creation_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    serialized_embedding = embedding.tobytes()
+    serialized_embedding, storage_format = serialize_embedding(embedding)
 
     cursor.execute('''
-        INSERT INTO recordings (transcription, embedding, creation_date, category_id, file_path)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (transcription, sqlite3.Binary(serialized_embedding), creation_date, category_id, file_path))
+        INSERT INTO recordings (transcription, embedding, embedding_format, creation_date, category_id, file_path)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (transcription, serialized_embedding, storage_format, creation_date, category_id, file_path))
 
-    conn.commit()
-    conn.close()
-    print(f"Recording metadata with file_path '{file_path}' successfully inserted into the database.")
+    recording_id = cursor.lastrowid
+    if metadata is not None:
+        update_recording_metadata(db_path, recording_id, metadata)
+    debug("Recording metadata with file_path '%s' successfully inserted into the database.", file_path)
+
+    # Inside a transaction the row may still be rolled back; the caller syncs after commit.
+    if not conn.in_transaction:
+        get_recording_index(db_path).sync(db_path)
+    return recording_id
+
+def find_similar_recordings(db_path, text=None, recording_id=None, top_k=10, exact=False):
+    """
+    Find recordings whose embeddings are closest to the given text or to an existing recording.
+    Returns a list of (recording_id, score, file_path, transcription).
+    """
+    index = get_recording_index(db_path)
+    if recording_id is not None:
+        query = index.vector_for(recording_id)
+        if query is None:
+            warning("Recording ID %d is not in the recording index.", recording_id)
+            return []
+    elif text:
+        query = generate_embedding(text)
+        if query is None:
+            return []
+    else:
+        raise ValueError("Either text or recording_id is required.")
+
+    matches = index.search(query, top_k=top_k + (1 if recording_id is not None else 0), exact=exact)
+    matches = [(match_id, score) for match_id, score in matches if match_id != recording_id][:top_k]
+    if not matches:
+        return []
+
+    cursor = get_connection(db_path).cursor()
+    placeholders = ",".join("?" * len(matches))
+    cursor.execute(f"SELECT id, file_path, transcription FROM recordings WHERE id IN ({placeholders})",
+                   [match_id for match_id, _ in matches])
+    details = {row[0]: row[1:] for row in cursor.fetchall()}
+
+    return [(match_id, score) + details[match_id] for match_id, score in matches if match_id in details]
+
+def reembed_recordings(db_path, batch_size=256):
+    """
+    Re-embed every stored transcription through an EmbeddingBatcher and rewrite the
+    embeddings, then rebuild the recording index from the new vectors.
+    """
+    batcher = EmbeddingBatcher(generate_embeddings, max_batch_size=batch_size)
+    conn = get_connection(db_path)
+    rows = conn.execute("SELECT id, transcription FROM recordings WHERE transcription IS NOT NULL ORDER BY id").fetchall()
+
+    updated = 0
+    for start in range(0, len(rows), batch_size):
+        chunk = rows[start:start + batch_size]
+        vectors = batcher.embed_many([transcription for _, transcription in chunk])
+        with transaction(db_path):
+            for (recording_id, _), vector in zip(chunk, vectors):
+                if vector is None:
+                    continue
+                conn.execute("UPDATE recordings SET embedding = ?, embedding_format = ? WHERE id = ?",
+                             serialize_embedding(vector) + (recording_id,))
+                updated += 1
+    batcher.close()
+    info("Re-embedded %d of %d recordings in %d requests.", updated, len(rows), batcher.requests_sent)
+
+    index = get_recording_index(db_path)
+    index.reset()
+    index.sync(db_path)
+    return updated
 
 def update_recording_category(db_path, recording_id, category_id):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    cursor = get_connection(db_path).cursor()
 
     cursor.execute('''
         UPDATE recordings
         SET category_id = ?
         WHERE id = ?
     ''', (category_id, recording_id))
-    conn.commit()
-    conn.close()
-    print(f"Recording ID {recording_id} updated with Category ID {category_id}.")
-
-def generate_category_audio(category_name, output_file):
+    debug("Recording ID %d updated with Category ID %d.", recording_id, category_id)
+
+def get_elevenlabs_client():
+    global _elevenlabs_client
+    with _tts_lock:
+        if _elevenlabs_client is None:
+            if not ELEVENLABS_API_KEY:
+                raise ValueError("ElevenLabs API key is missing.")
+            if ELEVENLABS_BASE_URL:
+                _elevenlabs_client = ElevenLabs(api_key=ELEVENLABS_API_KEY, base_url=ELEVENLABS_BASE_URL)
+            else:
+                _elevenlabs_client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
+    return _elevenlabs_client
+
+def get_tts_cache():
+    global _tts_cache
+    with _tts_lock:
+        if _tts_cache is None:
+            _tts_cache = TTSCache(CATEGORY_AUDIO_DIR)
+    return _tts_cache
+
+def _synthesize_speech(text, voice_id, model_id):
+    return get_elevenlabs_client().text_to_speech.convert(
+        voice_id=voice_id,
+        model_id=model_id,
+        text=text,
+    )
+
+def generate_category_audio(category_name):
     """
-    Generate audio for the category name using the ElevenLabs SDK and save to a file.
+    Return the path of the spoken category name, synthesizing it with ElevenLabs only if
+    this name has not been spoken with the current voice and model before.
     """
     try:
-        if not ELEVENLABS_API_KEY:
-            raise ValueError("ElevenLabs API key is missing.")
-
-        print(f"Generating audio for category '{category_name}' with output to '{output_file}'.")
-
-        client = ElevenLabs(api_key=ELEVENLABS_API_KEY)  
-        audio_generator = client.text_to_speech.convert(
-            voice_id=VOICE_ID,
-            model_id=MODEL_ID,
-            text=category_name,
-        )
-
-        with open(output_file, "wb") as f:
-            for chunk in audio_generator:
-                f.write(chunk)  
-        print(f"Audio for category '{category_name}' saved to {output_file}")
+        audio_file_path = get_tts_cache().synthesize(category_name, VOICE_ID, MODEL_ID, _synthesize_speech)
+        info("Audio for category '%s' saved to %s", category_name, audio_file_path)
+        return audio_file_path
     except Exception as e:
-        print(f"Error generating audio for category '{category_name}': {e}")
+        error("Error generating audio for category '%s': %s", category_name, e)
         raise
 
-def process_audio_and_store_with_category(file_path, db_path):
+def attach_category_audio(db_path, category_id, audio_file_path):
+    get_connection(db_path).execute("UPDATE categories SET name_audio_path = ? WHERE id = ?",
+                                    (audio_file_path, category_id))
+    metadata = safe_probe_audio(audio_file_path)
+    if metadata is not None:
+        update_category_metadata(db_path, category_id, metadata)
+
+def schedule_category_audio(db_path, category_id, category_name):
+    """Synthesize a category's name clip off the ingest path and store it on the row when done."""
+    def attach(future):
+        try:
+            attach_category_audio(db_path, category_id, future.result())
+            info("Attached name audio to category %d: %s", category_id, future.result())
+        except Exception as e:
+            error("Error generating audio for category '%s': %s", category_name, e)
+
+    get_tts_cache().submit(category_name, VOICE_ID, MODEL_ID, _synthesize_speech).add_done_callback(attach)
+
+def resume_pending_category_audio(db_path):
+    """Queue name clips for categories left without one, e.g. when a previous run exited early."""
+    rows = get_connection(db_path).execute(
+        "SELECT id, name FROM categories WHERE name_audio_path IS NULL AND name IS NOT NULL").fetchall()
+    for category_id, category_name in rows:
+        schedule_category_audio(db_path, category_id, category_name)
+    if rows:
+        info("Queued name audio for %d categories.", len(rows))
+
+def process_audio_and_store_with_category(file_path, db_path, processed_name=None, fingerprint=None):
+    """
+    Transcribe, embed and categorize one file, then write the category, the recording and
+    (when processed_name is given) the processed_files entry in a single transaction.
+    fingerprint is the (content_hash, file_size, file_mtime_ns) recorded in the ledger.
+    Returns True when the recording was stored.
+    """
     transcription = transcribe_audio(file_path)
     if not transcription:
-        print("Error: Could not transcribe audio.")
-        return
+        error("Error: Could not transcribe audio.")
+        return False
 
-    print(f"Transcription: {transcription}")
+    debug("Transcription: %s", transcription)
 
     embedding = generate_embedding(transcription)
     if embedding is None:
-        print("Error: Could not generate embedding.")
-        return
+        error("Error: Could not generate embedding.")
+        return False
 
-    category_id = assign_or_create_category(db_path, embedding, transcription)
+    try:
+        store_processed_audio(db_path, file_path, transcription, embedding, processed_name, fingerprint)
+    except Exception as e:
+        error("Error storing %s: %s", file_path, e)
+        return False
+    return True
+
+def _stored_recording_id(db_path, file_path):
+    row = get_connection(db_path).execute("SELECT id FROM recordings WHERE file_path = ?", (file_path,)).fetchone()
+    return row[0] if row else None
 
-    save_to_recordings(db_path, transcription, embedding, category_id, file_path)
+def store_processed_audio(db_path, file_path, transcription, embedding, processed_name=None, fingerprint=None,
+                          metadata=_NOT_PROBED, seek_table=_NOT_PROBED):
+    """
+    Categorize an already transcribed and embedded file and write it in one transaction.
+    metadata is the probe_audio result for the file and seek_table its build_seek_table
+    result; each is computed here when not given. A given None means that step already
+    failed: the column is left NULL for the backfills to fill in rather than probed again.
+    Returns the new recording id, or the existing one when file_path was already stored by
+    another ingest run.
+    """
+    if metadata is _NOT_PROBED:
+        metadata = safe_probe_audio(file_path)
+    if seek_table is _NOT_PROBED:
+        seek_table = safe_build_seek_table(file_path)
+    # Match and name before the transaction: naming is a chat request with retries and
+    # backoff, and must not run while the database write lock is held. _category_lock stays
+    # held through the insert so concurrent ingest threads cannot create the same category.
+    with _category_lock:
+        existing_id = _stored_recording_id(db_path, file_path)
+        if existing_id is None:
+            category_id, new_category = match_or_name_category(db_path, embedding, transcription)
+        try:
+            with span("db_write"), transaction(db_path):
+                existing_id = existing_id or _stored_recording_id(db_path, file_path)
+                if existing_id is not None:
+                    # Stored by another worker or process (e.g. a retry run); record it as done
+                    # here too rather than adding a duplicate.
+                    if processed_name is not None:
+                        mark_file_as_processed(db_path, processed_name, fingerprint)
+                    clear_retry(db_path, file_path)
+                    return existing_id
+                created_category = category_id is None
+                if created_category:
+                    category_id = create_new_category(db_path, embedding, *new_category)
+                recording_id = save_to_recordings(db_path, transcription, embedding, category_id, file_path, metadata)
+                if seek_table is not None:
+                    store_seek_table(db_path, recording_id, seek_table)
+                if processed_name is not None:
+                    mark_file_as_processed(db_path, processed_name, fingerprint)
+                clear_retry(db_path, file_path)
+        except Exception:
+            # A category added to the in-memory index may have been rolled back with the transaction.
+            _category_indexes.pop(db_path, None)
+            raise
+
+    if created_category and new_category[1] is None:
+        # Only now is the category id certain to be ours.
+        schedule_category_audio(db_path, category_id, new_category[0])
+    get_recording_index(db_path).sync(db_path)
+    return recording_id
 
 def check_processed_files_table(db_path):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    cursor = get_connection(db_path).cursor()
     cursor.execute("SELECT * FROM processed_files")
     rows = cursor.fetchall()
-    conn.close()
     for row in rows:
         print(f"Processed file: {row[0]}")
     return rows
 
-check_processed_files_table(DB_PATH)
+if __name__ == "__main__":
+    check_processed_files_table(DB_PATH)
 
-print(f"Database Path: {DB_PATH}")
-print(f"Audio Folder Path: {AUDIO_FOLDER_PATH}")
-process_audio_folder(AUDIO_FOLDER_PATH, DB_PATH)
+    print(f"Database Path: {DB_PATH}")
+    print(f"Audio Folder Path: {AUDIO_FOLDER_PATH}")
+    process_audio_folder(AUDIO_FOLDER_PATH, DB_PATH)
 
 
 
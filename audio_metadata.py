@@ -0,0 +1,159 @@
+import os
+import sys
+import json
+import math
+import subprocess
+import threading
+import numpy as np
+from db import get_connection, close_thread_connections
+from metrics import timed, warning
+
+DECODE_CHUNK_BYTES = 1024 * 1024
+
+RECORDING_COLUMNS = {
+    "duration": "REAL",
+    "sample_rate": "INTEGER",
+    "channels": "INTEGER",
+    "rms_dbfs": "REAL",
+    "peak_dbfs": "REAL",
+    "file_size": "INTEGER",
+}
+
+# The categories table describes its spoken name clip, so its columns carry a prefix.
+CATEGORY_COLUMNS = {f"name_audio_{column}": column_type for column, column_type in RECORDING_COLUMNS.items()}
+
+
+def _stream_format(file_path):
+    command = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "a:0",
+        "-show_entries", "stream=sample_rate,channels",
+        "-of", "json",
+        file_path
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe error for file {file_path}: {result.stderr.strip()}")
+    stream = json.loads(result.stdout)["streams"][0]
+    return int(stream["sample_rate"]), int(stream["channels"])
+
+
+def _to_dbfs(value):
+    return 20 * math.log10(value) if value > 0 else -math.inf
+
+
+@timed("audio_probe")
+def probe_audio(file_path):
+    """
+    Decode the file once and return its duration, sample rate, channels, RMS and peak
+    loudness (dBFS) and size in bytes. Samples are streamed from ffmpeg in chunks, so
+    memory use does not depend on the length of the recording.
+    """
+    sample_rate, channels = _stream_format(file_path)
+    command = [
+        "ffmpeg", "-nostdin", "-v", "error",
+        "-i", file_path,
+        "-vn", "-f", "s16le", "-acodec", "pcm_s16le",
+        "pipe:1"
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    sample_count = 0
+    sum_squares = 0.0
+    peak = 0
+    leftover = b""
+    try:
+        while True:
+            chunk = process.stdout.read(DECODE_CHUNK_BYTES)
+            if not chunk:
+                break
+            chunk = leftover + chunk
+            usable = len(chunk) - len(chunk) % 2
+            leftover = chunk[usable:]
+            samples = np.frombuffer(chunk[:usable], dtype=np.int16).astype(np.float64)
+            if len(samples):
+                sample_count += len(samples)
+                sum_squares += float(np.dot(samples, samples))
+                peak = max(peak, int(np.abs(samples).max()))
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg could not decode {file_path}")
+
+    rms = math.sqrt(sum_squares / sample_count) / 32768.0 if sample_count else 0.0
+    return {
+        "duration": sample_count / channels / sample_rate,
+        "sample_rate": sample_rate,
+        "channels": channels,
+        "rms_dbfs": _to_dbfs(rms),
+        "peak_dbfs": _to_dbfs(peak / 32768.0),
+        "file_size": os.path.getsize(file_path),
+    }
+
+
+def safe_probe_audio(file_path):
+    try:
+        return probe_audio(file_path)
+    except Exception as e:
+        warning("Could not read audio metadata for %s: %s", file_path, e)
+        return None
+
+
+def update_recording_metadata(db_path, recording_id, metadata):
+    columns = list(RECORDING_COLUMNS)
+    assignments = ", ".join(f"{column} = ?" for column in columns)
+    get_connection(db_path).execute(f"UPDATE recordings SET {assignments} WHERE id = ?",
+                                    [metadata[column] for column in columns] + [recording_id])
+
+
+def update_category_metadata(db_path, category_id, metadata):
+    columns = list(RECORDING_COLUMNS)
+    assignments = ", ".join(f"name_audio_{column} = ?" for column in columns)
+    get_connection(db_path).execute(f"UPDATE categories SET {assignments} WHERE id = ?",
+                                    [metadata[column] for column in columns] + [category_id])
+
+
+def backfill_in_background(db_path, table, row_id, file_path):
+    """Probe a legacy row off the playback thread and store what was found."""
+    def run():
+        metadata = safe_probe_audio(file_path)
+        if metadata is None:
+            return
+        try:
+            if table == "recordings":
+                update_recording_metadata(db_path, row_id, metadata)
+            else:
+                update_category_metadata(db_path, row_id, metadata)
+        finally:
+            close_thread_connections()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def backfill_all(db_path):
+    """Fill metadata for every recording and category name clip that does not have it yet."""
+    # Imported here: schema takes the column lists from this module.
+    from schema import migrate
+    migrate(db_path)
+    conn = get_connection(db_path)
+    recordings = conn.execute("SELECT id, file_path FROM recordings WHERE duration IS NULL").fetchall()
+    categories = conn.execute("SELECT id, name_audio_path FROM categories "
+                              "WHERE name_audio_duration IS NULL AND name_audio_path IS NOT NULL").fetchall()
+    filled = 0
+    for rows, update in ((recordings, update_recording_metadata), (categories, update_category_metadata)):
+        for row_id, file_path in rows:
+            if not file_path or not os.path.exists(file_path):
+                continue
+            metadata = safe_probe_audio(file_path)
+            if metadata is not None:
+                update(db_path, row_id, metadata)
+                filled += 1
+    print(f"Backfilled audio metadata for {filled} of {len(recordings) + len(categories)} rows.")
+    return filled
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python audio_metadata.py <db_path>")
+        sys.exit(1)
+    backfill_all(sys.argv[1])
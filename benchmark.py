@@ -0,0 +1,302 @@
+import os
+import sys
+import json
+import time
+import wave
+import random
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from queue import Queue, Empty
+import numpy as np
+import Recording
+import metrics
+import http_client
+from db import transaction
+from schema import migrate
+from stub_api import StubAPIServer
+from category_index import CategoryIndex
+from category_prefetch import CategoryPrefetcher
+from embedding_codec import encode_embedding
+from playback_engine import PlaybackEngine, NullSink
+from ingest_pipeline import IngestJob, run_ingest_pipeline
+
+INGEST_FILES = 40
+RECORDINGS = 5000
+CATEGORIES = 50
+EMBEDDING_DIM = 256
+MATCH_CATEGORY_COUNTS = (10, 100, 1000, 10000)
+MATCH_QUERIES = 200
+DIAL_TRIALS = 10
+DIAL_DETENT_SECONDS = 0.03
+# Same settle window as the Playback Bridge uses before it acts on the last dial position.
+DIAL_SETTLE_SECONDS = 0.25
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    return {f"p{point}": samples[min(len(samples) - 1, int(len(samples) * point / 100))] for point in points}
+
+
+def generate_wav(path, seconds=2.0, sample_rate=16000, seed=0):
+    """A tone with a little noise, so encoders and probes have real work to do."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    signal = 0.3 * np.sin(2 * np.pi * (220 + 20 * (seed % 20)) * t) + 0.02 * rng.normal(size=len(t))
+    with wave.open(path, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes((np.clip(signal, -1, 1) * 32767).astype(np.int16).tobytes())
+    return path
+
+
+def generate_recordings(folder, count, topics, seconds=2.0):
+    """Synthetic recordings named ..._topicN.wav; the stub API transcribes them as topic N."""
+    os.makedirs(folder, exist_ok=True)
+    return [generate_wav(os.path.join(folder, f"synthetic_{i:05d}_topic{i % topics}.wav"), seconds, seed=i)
+            for i in range(count)]
+
+
+def build_synthetic_db(db_path, audio_folder, recordings=RECORDINGS, categories=CATEGORIES, dim=EMBEDDING_DIM,
+                       audio_files=20, seed=0):
+    """
+    Fill db_path with categories and recordings shaped like a real archive: each category
+    has a name clip, recordings cluster around their category's embedding and are spread
+    over several years. Recordings share a small pool of audio files to keep disk use low.
+    """
+    migrate(db_path)
+    rng = np.random.default_rng(seed)
+    os.makedirs(audio_folder, exist_ok=True)
+    clips = [generate_wav(os.path.join(audio_folder, f"clip_{i:03d}.wav"), 1.0, seed=i) for i in range(audio_files)]
+    name_clip = generate_wav(os.path.join(audio_folder, "category_name.wav"), 0.5, seed=audio_files)
+    centres = rng.normal(size=(categories, dim)).astype(np.float32)
+    first_day = datetime(2019, 1, 1)
+
+    with transaction(db_path) as conn:
+        category_ids = []
+        for i, centre in enumerate(centres):
+            blob, storage_format = encode_embedding(centre)
+            cursor = conn.execute("INSERT INTO categories (name, embedding, embedding_format, name_audio_path, "
+                                  "name_audio_duration) VALUES (?, ?, ?, ?, ?)",
+                                  (f"Topic {i}", blob, storage_format, name_clip, 0.5))
+            category_ids.append(cursor.lastrowid)
+        rows = []
+        for i in range(recordings):
+            category = int(rng.integers(categories))
+            blob, storage_format = encode_embedding(centres[category] + 0.5 * rng.normal(size=dim))
+            created = first_day + timedelta(seconds=int(rng.integers(7 * 365 * 86400)))
+            rows.append((f"Synthetic recording {i} about topic {category}.", blob, storage_format,
+                         created.strftime("%Y-%m-%d %H:%M:%S"), category_ids[category], clips[i % len(clips)], 1.0))
+        conn.executemany("INSERT INTO recordings (transcription, embedding, embedding_format, creation_date, "
+                         "category_id, file_path, duration) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    print(f"Built synthetic database: {recordings} recordings in {categories} categories.")
+    return category_ids
+
+
+def point_recording_at(server, workdir, rate_limits=False):
+    """
+    Send Recording.py's API calls to the stub and keep its caches and index inside workdir.
+    The stub has no quota, so the rate limits are lifted unless rate_limits is True.
+    """
+    if not rate_limits:
+        http_client.set_rate_limits({name: None for name in http_client.RATE_LIMITS})
+    Recording.OPENAI_BASE_URL = server.openai_base_url
+    Recording.ELEVENLABS_BASE_URL = server.base_url
+    Recording.CATEGORY_AUDIO_DIR = os.path.join(workdir, "category_audio")
+    Recording.EMBEDDING_CACHE_PATH = os.path.join(workdir, "embedding_cache.db")
+    Recording._elevenlabs_client = None
+    Recording._tts_cache = None
+    Recording._recording_indexes.clear()
+    Recording._embedding_cache = None
+    Recording._category_indexes.clear()
+
+
+def bench_ingest(workdir, server, files=INGEST_FILES, topics=CATEGORIES, rate_limits=False):
+    db_path = os.path.join(workdir, "ingest.db")
+    paths = generate_recordings(os.path.join(workdir, "ingest_audio"), files, topics)
+    point_recording_at(server, workdir, rate_limits)
+    stats = run_ingest_pipeline([IngestJob(path) for path in paths], db_path)
+    spans = metrics.snapshot()[metrics.STAGE_SECONDS.name]["series"]
+    return {
+        "files": files,
+        "stored": stats.stored,
+        "failed": stats.failed,
+        "seconds": stats.elapsed,
+        "files_per_second": (stats.stored + stats.failed) / stats.elapsed if stats.elapsed else 0.0,
+        "stages": {stage: stats.percentiles(stage) for stage in stats.stage_samples},
+        "end_to_end": percentiles(stats.latencies),
+        "api_requests": dict(server.requests),
+        # Time spent waiting on http_client's rate limiters, which the stage timings include.
+        "rate_limit_wait_seconds": sum(series["sum"] for series in spans
+                                       if series["labels"].get("stage") == "rate_limit_wait"),
+        "spans": spans,
+    }
+
+
+def bench_category_match(counts=MATCH_CATEGORY_COUNTS, dim=EMBEDDING_DIM, queries=MATCH_QUERIES, seed=0):
+    rng = np.random.default_rng(seed)
+    results = []
+    for count in counts:
+        index = CategoryIndex(dim=dim, initial_capacity=count)
+        for category_id, vector in enumerate(rng.normal(size=(count, dim)).astype(np.float32)):
+            index.add(category_id, f"Topic {category_id}", vector)
+        timings = []
+        for query in rng.normal(size=(queries, dim)).astype(np.float32):
+            start = time.perf_counter()
+            index.match(query, top_k=5)
+            timings.append(time.perf_counter() - start)
+        row = {"categories": count, "mean_us": float(np.mean(timings)) * 1e6}
+        row.update({key: value * 1e6 for key, value in percentiles(timings).items()})
+        results.append(row)
+        print(f"Category match over {count} categories: {row['mean_us']:.0f} us mean, {row['p95']:.0f} us p95.")
+    return results
+
+
+def _dial_lines():
+    """
+    (send(line), line iterator, close()). With a pseudo-terminal the lines travel through
+    fake_arduino.FakeArduino like they would over USB serial; otherwise through a queue.
+    """
+    try:
+        from fake_arduino import FakeArduino
+        arduino = FakeArduino()
+    except (ImportError, OSError):
+        lines = Queue()
+        return lines.put, iter(lines.get, None), lambda: lines.put(None)
+
+    reader = arduino.open_reader()
+
+    def read_lines():
+        buffer = b""
+        while True:
+            try:
+                byte = reader.read(1)
+            except OSError:
+                return
+            if not byte:
+                return
+            if byte == b"\n":
+                yield buffer.decode("utf-8").strip()
+                buffer = b""
+            else:
+                buffer += byte
+
+    def close():
+        arduino.close()
+        reader.close()
+
+    return arduino.send, read_lines(), close
+
+
+def bench_dial(db_path, category_ids, trials=DIAL_TRIALS, seed=0):
+    """
+    Spin the dial from one category to another and time the last detent to the first
+    audio reaching the sink, through the same prefetch, settle and playback steps as the
+    Playback Bridge.
+    """
+    if shutil.which("ffmpeg") is None:
+        print("ffmpeg not found; skipping the dial-to-first-audio benchmark.")
+        return None
+
+    prefetcher = CategoryPrefetcher(db_path)
+    engine = PlaybackEngine(NullSink(realtime=True))
+    started_audio = threading.Event()
+    engine.on_track_start = lambda file_path: started_audio.set()
+    counts = Queue()
+    send, lines, close = _dial_lines()
+
+    def listen():
+        for line in lines:
+            if line.startswith("Rotation Count:"):
+                count = int(line.split(":")[1])
+                prefetcher.prefetch(count, "topic")
+                counts.put(count)
+
+    threading.Thread(target=listen, daemon=True).start()
+    rng = random.Random(seed)
+    position = category_ids[0]
+    total, after_settle = [], []
+    for _ in range(trials):
+        target = rng.choice([category_id for category_id in category_ids if category_id != position])
+        step = 1 if target >= position else -1
+        for count in range(position + step, target + step, step):
+            send(f"Rotation Count: {count}")
+            time.sleep(DIAL_DETENT_SECONDS)
+        position = target
+        last_detent = time.monotonic()
+
+        try:
+            count = counts.get(timeout=5)
+        except Empty:
+            print("No rotation arrived from the fake Arduino; stopping the dial benchmark.")
+            break
+        while True:
+            try:
+                count = counts.get(timeout=DIAL_SETTLE_SECONDS)
+            except Empty:
+                break
+        settled = time.monotonic()
+        started_audio.clear()
+        plan = prefetcher.get(count, "topic")
+        first = plan.name_audio_path or (plan.playlist[0] if plan.tracks else None)
+        if first is None:
+            continue
+        engine.play(first, then=plan.playlist)
+        if started_audio.wait(5):
+            now = time.monotonic()
+            total.append(now - last_detent)
+            after_settle.append(now - settled)
+        engine.stop()
+
+    close()
+    engine.close()
+    prefetcher.close()
+    result = {"trials": len(total), "total": percentiles(total), "after_settle": percentiles(after_settle)}
+    if total:
+        print(f"Dial to first audio: p50 {result['total']['p50'] * 1000:.0f} ms "
+              f"({result['after_settle']['p50'] * 1000:.1f} ms after the {DIAL_SETTLE_SECONDS * 1000:.0f} ms settle).")
+    return result
+
+
+def run_benchmarks(workdir, files=INGEST_FILES, recordings=RECORDINGS, categories=CATEGORIES, dim=EMBEDDING_DIM,
+                   latency=None, error_rate=0.0, rate_limits=False):
+    server = StubAPIServer(latency=latency, error_rate=error_rate, dim=dim, topics=categories).start()
+    try:
+        results = {"ingest": bench_ingest(workdir, server, files, categories, rate_limits)}
+        db_path = os.path.join(workdir, "archive.db")
+        category_ids = build_synthetic_db(db_path, os.path.join(workdir, "archive_audio"), recordings, categories, dim)
+        results["category_match"] = bench_category_match(dim=dim)
+        results["dial"] = bench_dial(db_path, category_ids)
+    finally:
+        server.stop()
+    return results
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    options = {"--files": INGEST_FILES, "--recordings": RECORDINGS, "--categories": CATEGORIES,
+               "--dim": EMBEDDING_DIM, "--latency-ms": 0, "--error-rate": 0.0, "--json": None}
+    for flag, default in list(options.items()):
+        if flag in args:
+            value = args[args.index(flag) + 1]
+            options[flag] = value if default is None else type(default)(value)
+
+    workdir = tempfile.mkdtemp(prefix="agora_benchmark_")
+    latency = {endpoint: (options["--latency-ms"] / 1000, options["--latency-ms"] / 4000)
+               for endpoint in ("transcriptions", "embeddings", "chat", "tts")}
+    try:
+        results = run_benchmarks(workdir, options["--files"], options["--recordings"], options["--categories"],
+                                 options["--dim"], latency, options["--error-rate"], "--rate-limits" in args)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    results["run_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if options["--json"]:
+        with open(options["--json"], "a") as f:
+            f.write(json.dumps(results) + "\n")
+        print(f"Results appended to {options['--json']}.")
+    else:
+        print(json.dumps(results, indent=2))
@@ -0,0 +1,138 @@
+import threading
+import numpy as np
+from db import get_connection
+from embedding_codec import decode_embedding, truncate
+from metrics import info, warning
+
+
+class CategoryIndex:
+    """
+    In-memory index of category embeddings, kept as one L2-normalized float32 matrix
+    so a lookup is a single matrix-vector product instead of a per-row loop.
+
+    The matrix holds the embeddings as stored, which may be quantized or truncated. When
+    full-precision vectors are also given, match(rerank=True) re-scores the top candidates
+    with them.
+    """
+
+    def __init__(self, dim=None, initial_capacity=64):
+        self.dim = dim
+        self.ids = []
+        self.names = []
+        self._matrix = None
+        self._full = {}
+        self._capacity = initial_capacity
+        self._lock = threading.Lock()
+        # category_version at load time; see Recording.get_category_index.
+        self.version = None
+        if dim is not None:
+            self._matrix = np.zeros((initial_capacity, dim), dtype=np.float32)
+
+    @classmethod
+    def from_db(cls, db_path):
+        """
+        Build the index from the categories table. Done once per process and again when
+        another process changes the categories; in between, new categories are appended with add().
+        """
+        cursor = get_connection(db_path).cursor()
+        cursor.execute("SELECT id, name, embedding, embedding_format, embedding_full FROM categories ORDER BY id")
+        rows = [(category_id, name, decode_embedding(blob, storage_format), full_blob)
+                for category_id, name, blob, storage_format, full_blob in cursor.fetchall() if blob is not None]
+
+        # Categories stored at different dimensions (e.g. before and after a --dims conversion)
+        # are all compared at the shortest, so none has to be left out.
+        dim = min((len(embedding) for _, _, embedding, _ in rows), default=None)
+        index = cls(dim=dim, initial_capacity=max(64, len(rows)))
+        for category_id, name, embedding, full_blob in rows:
+            full = decode_embedding(full_blob) if full_blob is not None else None
+            index.add(category_id, name, embedding, full)
+        info("Loaded %d categories into the category index.", len(index))
+        return index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _normalize(self, vec):
+        vec = np.asarray(vec, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vec)
+        if norm == 0:
+            return vec
+        return vec / norm
+
+    def add(self, category_id, name, embedding, full_embedding=None):
+        """
+        Append a category. A longer embedding is truncated to the index's dimensions; a
+        shorter one (EMBEDDING_STORAGE_DIMENSIONS lowered before the old rows were converted)
+        shrinks the whole index to its dimensions, so every category stays comparable.
+        """
+        vec = self._normalize(embedding)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vec.shape[0]
+                self._matrix = np.zeros((self._capacity, self.dim), dtype=np.float32)
+            if vec.shape[0] < self.dim:
+                warning("Category %d has a %d-dim embedding; re-indexing %d categories at %d dims.",
+                        category_id, vec.shape[0], len(self.ids), vec.shape[0])
+                self._shrink(vec.shape[0])
+            if vec.shape[0] > self.dim:
+                warning("Category %d has a %d-dim embedding; indexing its first %d dims.",
+                        category_id, vec.shape[0], self.dim)
+                vec = truncate(vec, self.dim)
+
+            size = len(self.ids)
+            if size == self._matrix.shape[0]:
+                grown = np.zeros((self._matrix.shape[0] * 2, self.dim), dtype=np.float32)
+                grown[:size] = self._matrix[:size]
+                self._matrix = grown
+
+            self._matrix[size] = vec
+            if full_embedding is not None:
+                self._full[category_id] = self._normalize(full_embedding)
+            self.ids.append(category_id)
+            self.names.append(name)
+            return True
+
+    def _shrink(self, dim):
+        """Truncate every indexed vector to its first dim components. Call with the lock held."""
+        shrunk = np.zeros((self._matrix.shape[0], dim), dtype=np.float32)
+        for row in range(len(self.ids)):
+            shrunk[row] = truncate(self._matrix[row], dim)
+        self._matrix = shrunk
+        self.dim = dim
+
+    def match(self, embedding, top_k=5, rerank=False):
+        """
+        Return (best_id, best_score, top) for the given embedding, where top is a list of
+        (category_id, name, score) sorted by descending cosine similarity.
+        best_id is None when the index is empty.
+        """
+        full_vec = self._normalize(embedding)
+        with self._lock:
+            vec = truncate(full_vec, self.dim)
+            size = len(self.ids)
+            if size == 0:
+                return None, None, []
+            if vec.shape[0] != self.dim:
+                raise ValueError(f"Embedding has {vec.shape[0]} dims, category index has {self.dim}.")
+            scores = self._matrix[:size] @ vec
+            ids = list(self.ids)
+            names = list(self.names)
+
+        k = max(1, min(top_k, size))
+        if k < size:
+            top_rows = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top_rows = np.arange(size)
+        top_rows = top_rows[np.argsort(-scores[top_rows])]
+        top = [(ids[row], names[row], float(scores[row])) for row in top_rows]
+        if rerank and self._full:
+            top = [(category_id, name, self._rescore(category_id, full_vec, score))
+                   for category_id, name, score in top]
+            top.sort(key=lambda item: -item[2])
+        return top[0][0], top[0][2], top
+
+    def _rescore(self, category_id, vec, score):
+        full = self._full.get(category_id)
+        if full is None or full.shape[0] != vec.shape[0]:
+            return score
+        return float(full @ vec)
@@ -0,0 +1,161 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from db import get_read_connection
+from schema import PLAYBACK_ORDER
+
+PREFETCH_RADIUS = 2
+PREFETCH_WORKERS = 2
+MAX_PLANS = 32
+PLAN_TTL_SECONDS = 30.0
+WARM_BYTES = 512 * 1024
+
+
+class CategoryPlan:
+    """What playing one dial position needs: the spoken name clip and the track list."""
+
+    def __init__(self, category_id, mode, name_audio_path, name_audio_duration, tracks, missing):
+        self.category_id = category_id
+        self.mode = mode
+        self.name_audio_path = name_audio_path
+        self.name_audio_duration = name_audio_duration
+        # (recording id, file path, duration) for every track whose file exists.
+        self.tracks = tracks
+        self.missing = missing
+        self.loaded_at = time.monotonic()
+
+    @property
+    def playlist(self):
+        return [file_path for _, file_path, _ in self.tracks]
+
+
+def load_category_plan(db_path, category_id, mode):
+    cursor = get_read_connection(db_path).cursor()
+
+    name_audio_path, name_audio_duration = None, None
+    if mode == "topic":
+        cursor.execute("SELECT name_audio_path, name_audio_duration FROM categories WHERE id = ?", (category_id,))
+        row = cursor.fetchone()
+        if row and row[0] and os.path.exists(row[0]):
+            name_audio_path, name_audio_duration = row
+        cursor.execute(f"SELECT id, file_path, duration FROM recordings WHERE category_id = ? ORDER BY {PLAYBACK_ORDER}",
+                       (category_id,))
+    elif mode == "time":
+        cursor.execute(f"SELECT id, file_path, duration FROM recordings WHERE creation_year = ? ORDER BY {PLAYBACK_ORDER}",
+                       (int(category_id),))
+    else:
+        raise ValueError(f"Invalid mode {mode!r}. Please select 'topic' or 'time'.")
+
+    tracks, missing = [], []
+    for track_id, file_path, duration in cursor.fetchall():
+        if file_path and os.path.exists(file_path):
+            tracks.append((track_id, file_path, duration))
+        else:
+            missing.append(file_path)
+    return CategoryPlan(category_id, mode, name_audio_path, name_audio_duration, tracks, missing)
+
+
+def warm_file(file_path, max_bytes=WARM_BYTES):
+    """Read the start of a file so the decoder's first reads come from the OS page cache."""
+    try:
+        with open(file_path, "rb") as f:
+            f.read(max_bytes)
+    except OSError:
+        pass
+
+
+class CategoryPrefetcher:
+    """
+    Loads category plans ahead of time while the dial is still moving.
+
+    prefetch(N) loads N and its neighbours N±1..N±PREFETCH_RADIUS on a small background
+    pool and reads the start of each name clip and first track, so when the dial settles
+    the DB query and the first disk reads have already happened. get() for a position that
+    is still loading waits for that load instead of starting another. Plans expire after
+    PLAN_TTL_SECONDS so newly ingested recordings show up.
+    """
+
+    def __init__(self, db_path, radius=PREFETCH_RADIUS, max_plans=MAX_PLANS, workers=PREFETCH_WORKERS):
+        self.db_path = db_path
+        self.radius = radius
+        self.max_plans = max_plans
+        self.hits = 0
+        self.misses = 0
+        self._plans = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="category-prefetch")
+
+    def _fresh(self, key):
+        plan = self._plans.get(key)
+        if plan is None:
+            return None
+        if time.monotonic() - plan.loaded_at > PLAN_TTL_SECONDS:
+            del self._plans[key]
+            return None
+        self._plans.move_to_end(key)
+        return plan
+
+    def get(self, category_id, mode):
+        key = (mode, category_id)
+        with self._lock:
+            plan = self._fresh(key)
+            if plan is not None:
+                self.hits += 1
+                return plan
+            future = self._in_flight.get(key)
+            if future is None:
+                self.misses += 1
+                future = Future()
+                self._in_flight[key] = future
+                owner = True
+            else:
+                self.hits += 1
+                owner = False
+
+        if owner:
+            self._load_into(key, future, warm=False)
+        return future.result()
+
+    def prefetch(self, category_id, mode):
+        """Start loading category_id and its neighbours in the background."""
+        offsets = [0] + [sign * step for step in range(1, self.radius + 1) for sign in (1, -1)]
+        for offset in offsets:
+            neighbour = category_id + offset
+            if neighbour < 0:
+                continue
+            key = (mode, neighbour)
+            with self._lock:
+                if self._fresh(key) is not None or key in self._in_flight:
+                    continue
+                future = Future()
+                self._in_flight[key] = future
+            self._executor.submit(self._load_into, key, future, True)
+
+    def _load_into(self, key, future, warm):
+        mode, category_id = key
+        try:
+            plan = load_category_plan(self.db_path, category_id, mode)
+            if warm:
+                if plan.name_audio_path:
+                    warm_file(plan.name_audio_path)
+                if plan.tracks:
+                    warm_file(plan.tracks[0][1])
+        except Exception as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            future.set_exception(e)
+            return
+
+        with self._lock:
+            self._in_flight.pop(key, None)
+            self._plans[key] = plan
+            self._plans.move_to_end(key)
+            while len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+        future.set_result(plan)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,87 @@
+import sqlite3
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+
+BUSY_TIMEOUT_MS = 30000
+CACHED_STATEMENTS = 256
+
+_local = threading.local()
+
+
+def _thread_connections():
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = {}
+        _local.connections = connections
+    return connections
+
+
+def get_connection(db_path):
+    """
+    Return this thread's long-lived read/write connection to db_path.
+
+    Connections are opened once per thread in WAL mode with autocommit
+    (isolation_level=None), so statements outside transaction() commit immediately and
+    sqlite3's per-connection statement cache keeps every query prepared across calls.
+    """
+    connections = _thread_connections()
+    key = ("rw", db_path)
+    conn = connections.get(key)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000,
+                               isolation_level=None, cached_statements=CACHED_STATEMENTS)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        connections[key] = conn
+    return conn
+
+
+def get_read_connection(db_path):
+    """
+    Return this thread's long-lived read-only connection to db_path.
+
+    Under WAL a reader sees the last committed snapshot and never waits on the ingest
+    writer, so the playback bridge can query while a folder scan is in progress.
+    """
+    connections = _thread_connections()
+    key = ("ro", db_path)
+    conn = connections.get(key)
+    if conn is None:
+        uri = Path(db_path).absolute().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT_MS / 1000,
+                               isolation_level=None, cached_statements=CACHED_STATEMENTS)
+        conn.execute("PRAGMA query_only=ON")
+        connections[key] = conn
+    return conn
+
+
+@contextmanager
+def transaction(db_path):
+    """
+    Run the enclosed writes as one IMMEDIATE transaction on this thread's connection.
+    Nested use joins the outer transaction, so helpers can be composed into a single
+    commit per processed file.
+    """
+    conn = get_connection(db_path)
+    if conn.in_transaction:
+        yield conn
+        return
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
+
+
+def close_thread_connections():
+    """Close the connections opened by the calling thread, e.g. when a worker exits."""
+    connections = _thread_connections()
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
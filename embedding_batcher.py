@@ -0,0 +1,114 @@
+import time
+import threading
+from queue import Queue, Empty
+from concurrent.futures import Future
+from metrics import error
+
+MAX_BATCH_SIZE = 256
+MAX_BATCH_TOKENS = 100000
+MAX_WAIT_SECONDS = 0.05
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English; only used to keep requests under the limit.
+    return len(text) // 4 + 1
+
+
+class EmbeddingBatcher:
+    """
+    Collects embedding requests from many callers and sends them as one request.
+
+    A batch is sent when it reaches max_batch_size texts, would exceed max_batch_tokens,
+    or max_wait seconds after its first text arrived. embed_batch is called with a list of
+    texts and must return a list of vectors in the same order, or None on failure; every
+    caller in a failed batch gets None, just like generate_embedding.
+    """
+
+    def __init__(self, embed_batch, max_batch_size=MAX_BATCH_SIZE, max_batch_tokens=MAX_BATCH_TOKENS,
+                 max_wait=MAX_WAIT_SECONDS):
+        self.embed_batch = embed_batch
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait
+        self.requests_sent = 0
+        self.texts_embedded = 0
+        self._queue = Queue()
+        self._pending = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, text):
+        """Queue a text and return a Future resolving to its vector (or None)."""
+        if self._closed:
+            raise RuntimeError("EmbeddingBatcher is closed.")
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text):
+        return self.submit(text).result()
+
+    def embed_many(self, texts):
+        futures = [self.submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    def close(self):
+        """Send whatever is queued and stop the batching thread."""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+
+    def _next_item(self, timeout):
+        if self._pending is not None:
+            item, self._pending = self._pending, None
+            return item
+        return self._queue.get(timeout=timeout)
+
+    def _run(self):
+        while True:
+            first = self._next_item(None)
+            if first is None:
+                return
+            batch = [first]
+            tokens = estimate_tokens(first[0])
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._next_item(remaining)
+                except Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                item_tokens = estimate_tokens(item[0])
+                if tokens + item_tokens > self.max_batch_tokens:
+                    self._pending = item
+                    break
+                batch.append(item)
+                tokens += item_tokens
+
+            self._send(batch)
+            if stop:
+                return
+
+    def _send(self, batch):
+        texts = [text for text, _ in batch]
+        try:
+            vectors = self.embed_batch(texts)
+        except Exception as e:
+            error("Error generating embeddings for a batch of %d: %s", len(texts), e)
+            vectors = None
+        self.requests_sent += 1
+        if vectors is None or len(vectors) != len(batch):
+            vectors = [None] * len(batch)
+        else:
+            self.texts_embedded += len(batch)
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
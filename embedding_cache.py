@@ -0,0 +1,111 @@
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+import numpy as np
+from db import get_connection, transaction
+from metrics import info
+
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+EVICT_TO_FRACTION = 0.9
+
+
+def normalize_text(text):
+    """Fold case, Unicode forms and whitespace so trivially different transcriptions share an entry."""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def text_hash(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Disk-backed embedding cache keyed by (normalized text hash, model, dimensions).
+
+    Entries live in their own SQLite file. When the stored vectors exceed max_bytes the
+    least recently used entries are evicted down to EVICT_TO_FRACTION of the budget.
+    hits and misses count lookups since the cache was opened.
+    """
+
+    def __init__(self, cache_path, max_bytes=MAX_CACHE_BYTES):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        conn = get_connection(cache_path)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                text_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                dimensions INTEGER NOT NULL,
+                embedding BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (text_hash, model, dimensions)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache (last_used)")
+        self.total_bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM embedding_cache").fetchone()[0]
+
+    def get(self, text, model, dimensions=None):
+        key = (text_hash(text), model, dimensions or 0)
+        conn = get_connection(self.cache_path)
+        row = conn.execute("SELECT embedding FROM embedding_cache WHERE text_hash = ? AND model = ? AND dimensions = ?",
+                           key).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        conn.execute("UPDATE embedding_cache SET last_used = ? WHERE text_hash = ? AND model = ? AND dimensions = ?",
+                     (time.time(),) + key)
+        return np.frombuffer(row[0], dtype=np.float32).copy()
+
+    def put(self, text, model, dimensions, embedding):
+        blob = np.asarray(embedding, dtype=np.float32).tobytes()
+        key = (text_hash(text), model, dimensions or 0)
+        with transaction(self.cache_path) as conn:
+            previous = conn.execute("SELECT size FROM embedding_cache WHERE text_hash = ? AND model = ? AND dimensions = ?",
+                                    key).fetchone()
+            conn.execute("INSERT OR REPLACE INTO embedding_cache (text_hash, model, dimensions, embedding, size, last_used) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", key + (sqlite3.Binary(blob), len(blob), time.time()))
+        with self._lock:
+            self.total_bytes += len(blob) - (previous[0] if previous else 0)
+            over_budget = self.total_bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        target = int(self.max_bytes * EVICT_TO_FRACTION)
+        with transaction(self.cache_path) as conn:
+            cursor = conn.execute("SELECT text_hash, model, dimensions, size FROM embedding_cache ORDER BY last_used")
+            freed = 0
+            removed = []
+            for text_hash_value, model, dimensions, size in cursor:
+                if self.total_bytes - freed <= target:
+                    break
+                removed.append((text_hash_value, model, dimensions))
+                freed += size
+            cursor.close()
+            conn.executemany("DELETE FROM embedding_cache WHERE text_hash = ? AND model = ? AND dimensions = ?", removed)
+        with self._lock:
+            self.total_bytes -= freed
+            self.evictions += len(removed)
+        info("Embedding cache evicted %d entries (%d bytes).", len(removed), freed)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "bytes": self.total_bytes,
+            }
@@ -0,0 +1,155 @@
+import sys
+import time
+import sqlite3
+import numpy as np
+from db import get_connection, get_read_connection, transaction
+
+FORMATS = ("float32", "float16", "int8")
+CONVERT_BATCH_ROWS = 1000
+REPORT_SAMPLE = 2000
+REPORT_QUERIES = 200
+REPORT_TOP_K = 10
+
+
+def truncate(vector, dims):
+    """First dims components, re-normalized; vectors shorter than dims are returned unchanged."""
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    if dims is None or vector.shape[0] <= dims:
+        return vector
+    vector = vector[:dims]
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def encode_embedding(vector, storage_format="float32", dims=None):
+    """
+    Serialize an embedding for the database. Returns (blob, format tag).
+
+    dims keeps only the first dims components, which text-embedding-3 vectors tolerate.
+    float16 halves the size; int8 stores one float32 scale followed by one signed byte per
+    dimension (about a quarter of the size). Compact formats are L2-normalized first, which
+    does not change cosine scores.
+    """
+    vector = truncate(vector, dims)
+    if storage_format == "float32":
+        return vector.astype(np.float32).tobytes(), "float32"
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector = vector / norm
+    if storage_format == "float16":
+        return vector.astype(np.float16).tobytes(), "float16"
+    if storage_format == "int8":
+        peak = float(np.abs(vector).max()) if len(vector) else 0.0
+        scale = peak / 127.0 if peak else 1.0
+        codes = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+        return np.float32(scale).tobytes() + codes.tobytes(), "int8"
+    raise ValueError(f"Unknown embedding format {storage_format!r}; expected one of {FORMATS}.")
+
+
+def decode_embedding(blob, storage_format=None):
+    """Inverse of encode_embedding; rows without a format tag are legacy float32."""
+    if storage_format in (None, "float32"):
+        return np.frombuffer(blob, dtype=np.float32)
+    if storage_format == "float16":
+        return np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+    if storage_format == "int8":
+        scale = np.frombuffer(blob[:4], dtype=np.float32)[0]
+        return np.frombuffer(blob[4:], dtype=np.int8).astype(np.float32) * scale
+    raise ValueError(f"Unknown embedding format {storage_format!r}; expected one of {FORMATS}.")
+
+
+def convert_embeddings(db_path, storage_format, dims=None):
+    """
+    Rewrite every recording and category embedding in the given format, in batches of one
+    transaction each. Before a category is converted, its float32 vector is kept in
+    embedding_full for full-precision re-ranking. Returns the number of rows rewritten.
+    """
+    conn = get_connection(db_path)
+    converted = 0
+    for table in ("recordings", "categories"):
+        full_column = ", embedding_full = COALESCE(embedding_full, ?)" if table == "categories" else ""
+        last_id = 0
+        while True:
+            rows = conn.execute(f"SELECT id, embedding, embedding_format FROM {table} "
+                                "WHERE id > ? AND embedding IS NOT NULL ORDER BY id LIMIT ?",
+                                (last_id, CONVERT_BATCH_ROWS)).fetchall()
+            if not rows:
+                break
+            updates = []
+            for row_id, blob, current_format in rows:
+                vector = decode_embedding(blob, current_format)
+                new_blob, tag = encode_embedding(vector, storage_format, dims)
+                full = [sqlite3.Binary(blob) if current_format in (None, "float32") else None] if full_column else []
+                updates.append([sqlite3.Binary(new_blob), tag] + full + [row_id])
+            with transaction(db_path):
+                conn.executemany(f"UPDATE {table} SET embedding = ?, embedding_format = ?{full_column} WHERE id = ?",
+                                 updates)
+            converted += len(rows)
+            last_id = rows[-1][0]
+    print(f"Converted {converted} embeddings to {storage_format}"
+          + (f", {dims} dimensions." if dims else "."))
+    return converted
+
+
+def _neighbours(matrix, queries, top_k):
+    scores = queries @ matrix.T
+    return np.argsort(-scores, axis=1)[:, 1:top_k + 1]
+
+
+def recall_report(db_path, sample_size=REPORT_SAMPLE, queries=REPORT_QUERIES, top_k=REPORT_TOP_K,
+                  dimension_options=(None, 1024, 512, 256), seed=0):
+    """
+    Print recall@top_k against float32 nearest neighbours and bytes per vector for every
+    format and truncation, measured on a sample of full-precision recordings.
+    """
+    rows = get_read_connection(db_path).execute(
+        "SELECT embedding FROM recordings WHERE embedding IS NOT NULL "
+        "AND (embedding_format IS NULL OR embedding_format = 'float32') ORDER BY RANDOM() LIMIT ?",
+        (sample_size,)).fetchall()
+    if len(rows) <= top_k:
+        print("Not enough full-precision recordings for a recall report.")
+        return []
+    vectors = [np.frombuffer(row[0], dtype=np.float32) for row in rows]
+    dim = len(vectors[0])
+    full = np.stack([vector for vector in vectors if len(vector) == dim])
+    full /= np.maximum(np.linalg.norm(full, axis=1, keepdims=True), 1e-12)
+    rng = np.random.default_rng(seed)
+    query_rows = rng.choice(len(full), size=min(queries, len(full)), replace=False)
+    truth = _neighbours(full, full[query_rows], top_k)
+
+    results = []
+    print(f"Recall@{top_k} on {len(full)} recordings, {len(query_rows)} queries:")
+    print(f"{'format':>8} {'dims':>6} {'bytes':>7} {'recall':>7}")
+    for dims in dimension_options:
+        if dims is not None and dims >= dim:
+            continue
+        for storage_format in FORMATS:
+            blobs = [encode_embedding(vector, storage_format, dims)[0] for vector in full]
+            decoded = np.stack([decode_embedding(blob, storage_format) for blob in blobs])
+            decoded /= np.maximum(np.linalg.norm(decoded, axis=1, keepdims=True), 1e-12)
+            found = _neighbours(decoded, decoded[query_rows], top_k)
+            recall = np.mean([len(np.intersect1d(a, b)) / top_k for a, b in zip(truth, found)])
+            results.append((storage_format, dims or dim, len(blobs[0]), float(recall)))
+            print(f"{storage_format:>8} {dims or dim:>6} {len(blobs[0]):>7} {recall:>7.3f}")
+    return results
+
+
+if __name__ == "__main__":
+    usage = "Usage: python embedding_codec.py (report | convert <float32|float16|int8> [dims]) <db_path>"
+    if len(sys.argv) < 3 or sys.argv[1] not in ("report", "convert"):
+        print(usage)
+        sys.exit(1)
+    import Recording
+    from schema import migrate
+    from recording_index import RecordingIndex
+    database = sys.argv[-1]
+    migrate(database)
+    if sys.argv[1] == "report":
+        recall_report(database)
+    else:
+        started = time.monotonic()
+        convert_embeddings(database, sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 4 else None)
+        recording_index = RecordingIndex(Recording.recording_index_path(database))
+        recording_index.reset()
+        recording_index.sync(database)
+        print(f"Done in {time.monotonic() - started:.1f}s. Set EMBEDDING_STORAGE_FORMAT in Recording.py to match.")
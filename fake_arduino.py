@@ -0,0 +1,72 @@
+import os
+import sys
+import pty
+import time
+import tty
+
+# Lines exactly as mainBody.ino prints them.
+DEMO_SCRIPT = [
+    (0.5, "Arduino with Switch, Rotary Encoder, and Buttons Ready!"),
+    (0.5, "topic"),
+    (1.0, "Rotation Count: 1"),
+    (5.0, "next"),
+    (3.0, "previous"),
+    (0.2, "Rotation Count: 2"),
+    (0.1, "Rotation Count: 3"),
+    (0.1, "Rotation Count: 4"),
+    (5.0, "time"),
+    (1.0, "Rotation Count: 2024"),
+]
+
+
+class FakeArduino:
+    """
+    Pseudo-terminal that talks like the Arduino, so the Playback Bridge can be run
+    without the board. Point the bridge at the printed port:
+
+        python fake_arduino.py            # plays DEMO_SCRIPT
+        python fake_arduino.py --stdin    # sends each line typed on stdin
+    """
+
+    def __init__(self):
+        self.master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self._slave = slave
+
+    def send(self, line):
+        os.write(self.master, (line + "\r\n").encode("utf-8"))
+
+    def play(self, script):
+        for delay, line in script:
+            time.sleep(delay)
+            print(f"-> {line}")
+            self.send(line)
+
+    def open_reader(self):
+        """Unbuffered binary file reading what the bridge would read from port. The caller closes it."""
+        return os.fdopen(os.dup(self._slave), "rb", buffering=0)
+
+    def close(self):
+        os.close(self.master)
+        os.close(self._slave)
+
+
+if __name__ == "__main__":
+    arduino = FakeArduino()
+    print(f"Fake Arduino on {arduino.port}")
+    print(f'Run: python "Playback Bridge 2.0.py" {arduino.port}')
+    try:
+        if "--stdin" in sys.argv:
+            for line in sys.stdin:
+                arduino.send(line.strip())
+        else:
+            input("Press Enter once the bridge is connected...")
+            arduino.play(DEMO_SCRIPT)
+            print("Script finished; press Ctrl+C to exit.")
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        arduino.close()
@@ -0,0 +1,217 @@
+import os
+import time
+import random
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 16
+MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+RETRY_STATUSES = (408, 409, 429, 500, 502, 503, 504)
+# (connect, read) seconds for every post() that does not pass its own timeout. The read
+# timeout leaves room for transcribing a long recording; a stalled socket is retried.
+REQUEST_TIMEOUT = (10, 300)
+# Requests and tokens per minute for each API; None means no budget. Set them to the
+# account's quota so calls are spaced out instead of bursting into 429s, either here or with
+# AGORA_RATE_LIMITS, e.g. "transcriptions=500,chat=3500/90000" ("none" lifts a budget).
+RATE_LIMITS = {
+    "transcriptions": {"requests": 50, "tokens": None},
+    "embeddings": {"requests": 3000, "tokens": 1000000},
+    "chat": {"requests": 3500, "tokens": 90000},
+}
+# A full bucket allows this many seconds' worth of budget at once.
+BURST_SECONDS = 1.0
+
+_local = threading.local()
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _parse_rate_limits(text):
+    """{name: {"requests": ..., "tokens": ...}} from the AGORA_RATE_LIMITS format."""
+    limits = {}
+    for entry in filter(None, (part.strip() for part in text.split(","))):
+        name, _, values = entry.partition("=")
+        requests_per_minute, _, tokens_per_minute = values.partition("/")
+        limits[name.strip()] = {"requests": _parse_budget(requests_per_minute),
+                                "tokens": _parse_budget(tokens_per_minute)}
+    return limits
+
+
+def _parse_budget(text):
+    text = text.strip().lower()
+    return None if text in ("", "none", "0") else float(text)
+
+
+RATE_LIMITS.update(_parse_rate_limits(os.getenv("AGORA_RATE_LIMITS", "")))
+HTTP_RETRIES = metrics.counter("agora_http_retries_total", "Requests retried after an error status or connection failure.")
+
+
+def get_session():
+    """
+    Return this thread's keep-alive requests.Session.
+
+    One session per thread keeps TCP/TLS connections to the API open between calls
+    instead of paying a fresh handshake on every requests.post.
+    """
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _local.session = session
+    return session
+
+
+def close_session():
+    session = getattr(_local, "session", None)
+    if session is not None:
+        session.close()
+        _local.session = None
+
+
+class TokenBucket:
+    """
+    Refills at rate_per_minute / 60 per second up to capacity. take() reserves its amount
+    immediately, even into debt, and returns how long the caller must wait before using
+    it, so concurrent callers are spaced evenly instead of all retrying at once.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or max(1.0, self.rate * BURST_SECONDS)
+        self._level = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def take(self, amount=1):
+        with self._lock:
+            now = time.monotonic()
+            self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+            self._updated = now
+            self._level -= amount
+            deficit_wait = -self._level / self.rate if self._level < 0 else 0.0
+            return max(deficit_wait, self._paused_until - now)
+
+    def pause(self, seconds):
+        """Hold every caller for seconds, e.g. after a 429, and drop any saved-up burst."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._level = min(self._level, 0.0)
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def acquire(self, tokens=1):
+        """Block until one request of this many tokens fits both budgets. Returns the seconds waited."""
+        wait = 0.0
+        if self.requests is not None:
+            wait = self.requests.take(1)
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.take(tokens))
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def pause(self, seconds):
+        for bucket in (self.requests, self.tokens):
+            if bucket is not None:
+                bucket.pause(seconds)
+
+
+def get_limiter(name):
+    """The process-wide RateLimiter for an entry in RATE_LIMITS, shared by every thread."""
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limits = RATE_LIMITS.get(name, {})
+            limiter = _limiters[name] = RateLimiter(limits.get("requests"), limits.get("tokens"))
+        return limiter
+
+
+def set_rate_limits(limits):
+    """
+    Update RATE_LIMITS from {name: {"requests": ..., "tokens": ...}} (None in place of the
+    dict lifts every budget for that API) and start every limiter with a fresh bucket.
+    """
+    with _limiters_lock:
+        for name, budget in limits.items():
+            RATE_LIMITS[name] = dict(budget) if budget else {"requests": None, "tokens": None}
+        _limiters.clear()
+
+
+def retry_after_seconds(response):
+    """Retry-After as seconds, from either a number or an HTTP date; None when absent or unreadable."""
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter: uniform in [0, min(max, base * 2**attempt)]."""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def _rewind(files):
+    for value in (files or {}).values():
+        handle = value[1] if isinstance(value, tuple) else value
+        if hasattr(handle, "seek"):
+            handle.seek(0)
+
+
+def post(url, limit=None, tokens=1, max_retries=MAX_RETRIES, **kwargs):
+    """
+    POST through this thread's session, paced by the RATE_LIMITS entry named limit.
+
+    Requests time out after REQUEST_TIMEOUT unless timeout is given. Connection errors,
+    timeouts and RETRY_STATUSES are retried up to max_retries times, waiting for
+    Retry-After when the server sends it and exponential backoff with jitter otherwise; a
+    429 also pauses every other caller sharing the limiter. Returns the last response, so
+    callers still use raise_for_status(); raises the connection error if every attempt failed.
+    """
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+    limiter = get_limiter(limit) if limit else None
+    files = kwargs.get("files")
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            waited = limiter.acquire(tokens)
+            if waited:
+                metrics.record("rate_limit_wait", waited)
+        _rewind(files)
+        try:
+            response = get_session().post(url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if attempt == max_retries:
+                raise
+            status, delay = type(e).__name__, backoff_delay(attempt)
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == max_retries:
+                return response
+            status = response.status_code
+            delay = retry_after_seconds(response)
+            if delay is None:
+                delay = backoff_delay(attempt)
+            if status == 429 and limiter is not None:
+                limiter.pause(delay)
+        HTTP_RETRIES.inc(endpoint=limit or "other", status=status)
+        metrics.warning("%s from %s; retrying in %.1fs (attempt %d of %d).", status, url, delay, attempt + 1, max_retries)
+        time.sleep(delay)
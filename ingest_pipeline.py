@@ -0,0 +1,288 @@
+import os
+import sys
+import time
+import itertools
+import threading
+from queue import Queue
+import Recording
+from db import close_thread_connections
+from http_client import close_session
+from processed_ledger import ProcessedLedger
+from embedding_batcher import EmbeddingBatcher
+from audio_metadata import safe_probe_audio
+from seek_table import safe_build_seek_table
+from metrics import start_exporters, error
+from retry_queue import due_retries, pending_paths, clear_retry
+
+TRANSCRIBE_WORKERS = 4
+EMBED_WORKERS = 4
+QUEUE_SIZE = 16
+
+_STOP = object()
+
+
+class IngestJob:
+    def __init__(self, file_path, processed_name=None, fingerprint=None):
+        self.file_path = file_path
+        self.processed_name = processed_name
+        self.fingerprint = fingerprint
+        self.transcription = None
+        self.embedding = None
+        self.metadata = None
+        self.seek_table = None
+        self.error = None
+        self.started = time.monotonic()
+
+
+class IngestStats:
+    """Per-stage wall time and counts for one pipeline run."""
+
+    def __init__(self):
+        self.stage_seconds = {}
+        self.stage_counts = {}
+        self.stage_samples = {}
+        self.stored = 0
+        self.failed = 0
+        self.elapsed = 0.0
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+            self.stage_counts[stage] = self.stage_counts.get(stage, 0) + 1
+            self.stage_samples.setdefault(stage, []).append(seconds)
+
+    def percentiles(self, stage, points=(50, 95, 99)):
+        """Latency percentiles in seconds for one stage, e.g. {50: 0.12, 95: 0.31, 99: 0.40}."""
+        with self._lock:
+            samples = sorted(self.stage_samples.get(stage, ()))
+        if not samples:
+            return {}
+        return {point: samples[min(len(samples) - 1, int(len(samples) * point / 100))] for point in points}
+
+    def report(self, elapsed):
+        total = self.stored + self.failed
+        rate = total / elapsed if elapsed > 0 else 0.0
+        print(f"Ingested {self.stored} files ({self.failed} failed) in {elapsed:.2f}s: {rate:.2f} files/sec.")
+        for stage, seconds in self.stage_seconds.items():
+            count = self.stage_counts[stage]
+            p50, p95, p99 = (value * 1000 for value in self.percentiles(stage).values())
+            print(f"  {stage}: {count} calls, {seconds / count * 1000:.1f} ms average, "
+                  f"p50 {p50:.1f} / p95 {p95:.1f} / p99 {p99:.1f} ms")
+        if self.latencies:
+            latencies = sorted(self.latencies)
+            p50 = latencies[len(latencies) // 2]
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            print(f"  end-to-end latency: p50 {p50:.2f}s, p95 {p95:.2f}s")
+
+
+def _timed(stats, stage, fn, *args):
+    start = time.monotonic()
+    try:
+        return fn(*args)
+    finally:
+        stats.record(stage, time.monotonic() - start)
+
+
+def _transcribe_worker(in_queue, out_queue, stats):
+    while True:
+        job = in_queue.get()
+        if job is _STOP:
+            break
+        try:
+            job.transcription = _timed(stats, "transcribe", Recording.transcribe_audio, job.file_path)
+            if not job.transcription:
+                job.error = "Could not transcribe audio."
+            else:
+                job.metadata = _timed(stats, "probe", safe_probe_audio, job.file_path)
+                job.seek_table = _timed(stats, "seek table", safe_build_seek_table, job.file_path)
+        except Exception as e:
+            job.error = f"Transcription failed: {e}"
+        out_queue.put(job)
+    close_session()
+
+
+def _embed_worker(in_queue, out_queue, stats):
+    while True:
+        job = in_queue.get()
+        if job is _STOP:
+            break
+        if job.error is None:
+            try:
+                job.embedding = _timed(stats, "embed", Recording.generate_embedding, job.transcription)
+                if job.embedding is None:
+                    job.error = "Could not generate embedding."
+            except Exception as e:
+                job.error = f"Embedding failed: {e}"
+        out_queue.put(job)
+    close_session()
+
+
+def _batched_embed_worker(in_queue, out_queue, batcher):
+    """
+    Hand every transcription to the batcher; each job moves on when its batch returns.
+    Returns only once every job has been put on out_queue. Future.result() is not enough
+    for that, because done-callbacks run after the result is set.
+    """
+    outstanding = 0
+    forwarded = threading.Condition()
+
+    def forward(job, future):
+        nonlocal outstanding
+        try:
+            job.embedding = future.result()
+            if job.embedding is None:
+                job.error = "Could not generate embedding."
+        except Exception as e:
+            job.error = f"Embedding failed: {e}"
+        out_queue.put(job)
+        with forwarded:
+            outstanding -= 1
+            forwarded.notify_all()
+
+    while True:
+        job = in_queue.get()
+        if job is _STOP:
+            break
+        if job.error is not None:
+            out_queue.put(job)
+            continue
+        with forwarded:
+            outstanding += 1
+        batcher.submit(job.transcription).add_done_callback(lambda done, job=job: forward(job, done))
+
+    with forwarded:
+        forwarded.wait_for(lambda: outstanding == 0)
+
+
+def _store_worker(in_queue, db_path, stats):
+    """
+    Single writer: categorization and the SQLite writes run here one file at a time,
+    so category creation stays serialized and ingest holds one write transaction at once.
+    """
+    while True:
+        job = in_queue.get()
+        if job is _STOP:
+            break
+        try:
+            if job.error is None:
+                _timed(stats, "categorize+store", Recording.store_processed_audio, db_path, job.file_path,
+                       job.transcription, job.embedding, job.processed_name, job.fingerprint, job.metadata,
+                       job.seek_table)
+                stats.stored += 1
+            else:
+                error("Error: %s (%s)", job.error, job.file_path)
+                Recording.defer_failed_file(db_path, job.file_path, job.processed_name, job.fingerprint, job.error)
+                stats.failed += 1
+        except Exception as e:
+            error("Error storing %s: %s", job.file_path, e)
+            Recording.defer_failed_file(db_path, job.file_path, job.processed_name, job.fingerprint, e)
+            stats.failed += 1
+        stats.latencies.append(time.monotonic() - job.started)
+    close_thread_connections()
+    close_session()
+
+
+def run_ingest_pipeline(jobs, db_path, transcribe_workers=TRANSCRIBE_WORKERS, embed_workers=EMBED_WORKERS,
+                        queue_size=QUEUE_SIZE, batch_embeddings=True):
+    """
+    Push IngestJobs through transcribe -> embed -> categorize/store.
+
+    Transcription and embedding run on bounded thread pools with keep-alive HTTP sessions;
+    the bounded queues between stages keep memory flat when the API is slower than
+    discovery. With batch_embeddings, transcriptions are embedded through an
+    EmbeddingBatcher instead of one request per file. Returns the IngestStats for the run.
+    """
+    Recording.init_db(db_path)
+    stats = IngestStats()
+    transcribe_queue = Queue(maxsize=queue_size)
+    embed_queue = Queue(maxsize=queue_size)
+    store_queue = Queue(maxsize=queue_size)
+
+    transcribers = [threading.Thread(target=_transcribe_worker, args=(transcribe_queue, embed_queue, stats), daemon=True)
+                    for _ in range(transcribe_workers)]
+    batcher = None
+    if batch_embeddings:
+        batcher = EmbeddingBatcher(lambda texts: _timed(stats, "embed batch", Recording.generate_embeddings, texts))
+        embedders = [threading.Thread(target=_batched_embed_worker, args=(embed_queue, store_queue, batcher),
+                                      daemon=True)]
+    else:
+        embedders = [threading.Thread(target=_embed_worker, args=(embed_queue, store_queue, stats), daemon=True)
+                     for _ in range(embed_workers)]
+    writer = threading.Thread(target=_store_worker, args=(store_queue, db_path, stats), daemon=True)
+    for thread in transcribers + embedders + [writer]:
+        thread.start()
+
+    start = time.monotonic()
+    for job in jobs:
+        job.started = time.monotonic()
+        transcribe_queue.put(job)
+
+    for _ in transcribers:
+        transcribe_queue.put(_STOP)
+    for thread in transcribers:
+        thread.join()
+    for _ in embedders:
+        embed_queue.put(_STOP)
+    for thread in embedders:
+        thread.join()
+    store_queue.put(_STOP)
+    writer.join()
+    if batcher is not None:
+        batcher.close()
+        print(f"Embedded {batcher.texts_embedded} texts in {batcher.requests_sent} requests.")
+
+    stats.elapsed = time.monotonic() - start
+    stats.report(stats.elapsed)
+    cache_stats = Recording.get_embedding_cache().stats()
+    print(f"Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+          f"({cache_stats['hit_rate']:.0%} hit rate).")
+    upload = Recording.upload_stats
+    print(f"Uploads: {upload['uploaded_bytes']} of {upload['original_bytes']} bytes sent for {upload['files']} files "
+          f"({upload['fallbacks']} sent as the original file).")
+    return stats
+
+
+def find_due_retries(db_path):
+    """Yield an IngestJob for every failed file whose retry is due."""
+    for file_path, processed_name, fingerprint in due_retries(db_path):
+        if os.path.exists(file_path):
+            yield IngestJob(file_path, processed_name, fingerprint)
+        else:
+            clear_retry(db_path, file_path)
+
+
+def find_new_files(folder_path, db_path):
+    """
+    Yield an IngestJob for every .m4a in folder_path that the ledger has not seen and that
+    is not waiting on the retry queue.
+    """
+    ledger = ProcessedLedger.load(db_path)
+    waiting = pending_paths(db_path)
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".m4a") or not entry.is_file() or entry.path in waiting:
+                continue
+            normalized_name = Recording.normalize_file_name(entry.name)
+            is_processed, fingerprint = ledger.check(normalized_name, entry.path, entry.stat())
+            if is_processed:
+                continue
+            ledger.add(normalized_name, fingerprint)
+            yield IngestJob(entry.path, normalized_name, fingerprint)
+
+
+def process_audio_folder_pipelined(folder_path, db_path, **pipeline_options):
+    if not os.path.isdir(folder_path):
+        error("Path is not a directory: %s", folder_path)
+        return None
+    # Both generators run lazily, after run_ingest_pipeline has migrated the schema.
+    jobs = itertools.chain(find_due_retries(db_path), find_new_files(folder_path, db_path))
+    return run_ingest_pipeline(jobs, db_path, **pipeline_options)
+
+
+if __name__ == "__main__":
+    start_exporters()
+    folder = sys.argv[1] if len(sys.argv) > 1 else Recording.AUDIO_FOLDER_PATH
+    database = sys.argv[2] if len(sys.argv) > 2 else Recording.DB_PATH
+    process_audio_folder_pipelined(folder, database)
@@ -0,0 +1,337 @@
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+from functools import wraps
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+LOG_LEVEL = LEVELS.get(os.getenv("AGORA_LOG_LEVEL", "INFO").upper(), LEVELS["INFO"])
+METRICS_ENABLED = os.getenv("AGORA_METRICS", "1") != "0"
+# Exporters started by start_exporters(): a JSON lines file written every METRICS_JSONL_INTERVAL
+# seconds and/or a Prometheus text endpoint on METRICS_PORT.
+METRICS_JSONL_PATH = os.getenv("AGORA_METRICS_JSONL")
+METRICS_JSONL_INTERVAL = 60.0
+METRICS_PORT = int(os.getenv("AGORA_METRICS_PORT", "0")) or None
+# Loopback only by default; set AGORA_METRICS_HOST=0.0.0.0 to let another machine scrape it.
+METRICS_HOST = os.getenv("AGORA_METRICS_HOST", "127.0.0.1")
+# Upper bounds in seconds; wide enough for a 1 ms index lookup and a 60 s transcription.
+HISTOGRAM_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+_exporters_started = False
+
+
+# Logging
+
+def set_log_level(level):
+    global LOG_LEVEL
+    LOG_LEVEL = LEVELS[level.upper()] if isinstance(level, str) else level
+
+
+def log_enabled(level):
+    return LOG_LEVEL <= LEVELS[level]
+
+
+def _emit(message, args):
+    print(message % args if args else message)
+
+
+# The level check comes before any formatting, so a disabled call costs one comparison.
+# Pass values as %-style args rather than an f-string to keep it that way.
+
+def debug(message, *args):
+    if LOG_LEVEL <= 10:
+        _emit(message, args)
+
+
+def info(message, *args):
+    if LOG_LEVEL <= 20:
+        _emit(message, args)
+
+
+def warning(message, *args):
+    if LOG_LEVEL <= 30:
+        _emit(message, args)
+
+
+def error(message, *args):
+    if LOG_LEVEL <= 40:
+        _emit(message, args)
+
+
+# Metrics
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def snapshot(self):
+        with self._lock:
+            return [{"labels": dict(key), "value": value} for key, value in self._values.items()]
+
+    def prometheus(self):
+        with self._lock:
+            return [f"{self.name}{_format_labels(key)} {value}" for key, value in self._values.items()]
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label set, as Prometheus expects them."""
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=HISTOGRAM_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def _quantile(self, series, q):
+        if not series["count"]:
+            return None
+        wanted = q * series["count"]
+        for bound, count in zip(self.buckets, series["buckets"]):
+            if count >= wanted:
+                return bound
+        return float("inf")
+
+    def quantile(self, q, **labels):
+        """Upper bound of the bucket holding the q-th quantile; inf when it is above every bucket."""
+        with self._lock:
+            series = self._series.get(_label_key(labels))
+            return self._quantile(series, q) if series else None
+
+    def snapshot(self):
+        with self._lock:
+            return [{"labels": dict(key), "count": series["count"], "sum": series["sum"],
+                     "buckets": dict(zip(map(str, self.buckets), series["buckets"])),
+                     "p50": self._quantile(series, 0.5), "p95": self._quantile(series, 0.95),
+                     "p99": self._quantile(series, 0.99)}
+                    for key, series in self._series.items()]
+
+    def prometheus(self):
+        lines = []
+        with self._lock:
+            for key, series in self._series.items():
+                for bound, count in zip(self.buckets, series["buckets"]):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+
+def _get_or_create(cls, name, help_text):
+    with _metrics_lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = cls(name, help_text)
+        return metric
+
+
+def counter(name, help_text=""):
+    return _get_or_create(Counter, name, help_text)
+
+
+def histogram(name, help_text=""):
+    return _get_or_create(Histogram, name, help_text)
+
+
+STAGE_SECONDS = histogram("agora_stage_seconds", "Wall time of each pipeline stage call.")
+STAGE_ERRORS = counter("agora_stage_errors_total", "Stage calls that raised an exception.")
+
+
+def record(stage, seconds):
+    """Add one timing for stage, for durations measured outside a span."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+class _Span:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        elapsed = time.perf_counter() - self.started
+        STAGE_SECONDS.observe(elapsed, stage=self.stage)
+        if exc_type is not None:
+            STAGE_ERRORS.inc(stage=self.stage)
+        if LOG_LEVEL <= 10:
+            _emit("%s took %.1f ms", (self.stage, elapsed * 1000))
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(stage):
+    """with span("transcribe"): ... records the block's wall time under stage."""
+    return _Span(stage) if METRICS_ENABLED else _NULL_SPAN
+
+
+def timed(stage):
+    """Decorator form of span()."""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# Export
+
+def snapshot():
+    with _metrics_lock:
+        metrics = list(_metrics.values())
+    return {metric.name: {"type": metric.kind, "series": metric.snapshot()} for metric in metrics}
+
+
+def render_prometheus():
+    with _metrics_lock:
+        metrics = list(_metrics.values())
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.prometheus())
+    return "\n".join(lines) + "\n"
+
+
+def write_jsonl(path):
+    """Append the current value of every metric to path as one JSON line."""
+    line = json.dumps({"time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "metrics": snapshot()})
+    with open(path, "a") as f:
+        f.write(line + "\n")
+
+
+def start_jsonl_exporter(path, interval=METRICS_JSONL_INTERVAL):
+    """Write a snapshot to path every interval seconds and once more when the process exits."""
+    def loop():
+        while True:
+            time.sleep(interval)
+            write_jsonl(path)
+
+    threading.Thread(target=loop, daemon=True).start()
+    atexit.register(write_jsonl, path)
+
+
+def start_metrics_server(port, host=METRICS_HOST):
+    """Serve render_prometheus() at /metrics on a background thread. Returns the server."""
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_exporters():
+    """Start the exporters configured by METRICS_JSONL_PATH and METRICS_PORT, once per process."""
+    global _exporters_started
+    if _exporters_started or not METRICS_ENABLED:
+        return
+    _exporters_started = True
+    if METRICS_JSONL_PATH:
+        start_jsonl_exporter(METRICS_JSONL_PATH)
+        info("Writing metrics to %s every %.0fs.", METRICS_JSONL_PATH, METRICS_JSONL_INTERVAL)
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+        info("Serving metrics at http://%s:%d/metrics.", METRICS_HOST, METRICS_PORT)
+
+
+def summarize(path):
+    """Print per-stage call counts and latencies from the last snapshot in a JSON lines file."""
+    with open(path) as f:
+        lines = [line for line in f if line.strip()]
+    if not lines:
+        print(f"No metrics in {path}.")
+        return
+    last = json.loads(lines[-1])
+    print(f"Metrics at {last['time']}:")
+    for series in last["metrics"].get(STAGE_SECONDS.name, {}).get("series", []):
+        count = series["count"]
+        print(f"  {series['labels'].get('stage')}: {count} calls, {series['sum'] / count * 1000:.1f} ms average, "
+              f"p50 <= {series['p50']}s, p95 <= {series['p95']}s, p99 <= {series['p99']}s")
+    for series in last["metrics"].get(STAGE_ERRORS.name, {}).get("series", []):
+        print(f"  {series['labels'].get('stage')}: {series['value']} errors")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python metrics.py <metrics.jsonl>")
+        sys.exit(1)
+    summarize(sys.argv[1])
@@ -0,0 +1,141 @@
+import os
+import uuid
+import wave
+import threading
+from datetime import datetime
+from queue import Queue, Full
+
+SAMPLE_RATES = (44100, 48000, 16000, 8000)
+CHANNELS = 1
+SAMPLE_WIDTH = 2
+CHUNK_FRAMES = 1024
+RING_CHUNKS = 256
+
+
+def unique_recording_path(folder, extension=".wav"):
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return os.path.join(folder, f"recording_{stamp}_{uuid.uuid4().hex[:8]}{extension}")
+
+
+class MicrophoneCapture:
+    """
+    Records the microphone straight to disk.
+
+    PyAudio delivers chunks on its own callback thread into a bounded ring buffer, and a
+    writer thread appends them to the WAV file as they arrive, so memory stays at a few
+    seconds of audio however long the recording runs. Each recording gets its own file,
+    written as .wav.part and renamed to .wav only when it is complete; the watch daemon
+    ignores the .part file and picks up the renamed one. on_finished(path) is called with
+    the final path.
+    """
+
+    def __init__(self, pyaudio_instance, output_folder, sample_rates=SAMPLE_RATES, channels=CHANNELS,
+                 chunk_frames=CHUNK_FRAMES, ring_chunks=RING_CHUNKS, on_finished=None):
+        import pyaudio
+        self._pyaudio = pyaudio
+        self._instance = pyaudio_instance
+        self.output_folder = output_folder
+        self.sample_rates = sample_rates
+        self.channels = channels
+        self.chunk_frames = chunk_frames
+        self.on_finished = on_finished
+        self.sample_rate = None
+        self.file_path = None
+        self.dropped_chunks = 0
+        self.frames_written = 0
+        self._ring = Queue(maxsize=ring_chunks)
+        self._stream = None
+        self._writer = None
+        self._wave = None
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self._stream is not None
+
+    def _pick_sample_rate(self):
+        """Highest preferred rate the default input device accepts."""
+        for rate in self.sample_rates:
+            try:
+                device = self._instance.get_default_input_device_info()["index"]
+                if self._instance.is_format_supported(rate, input_device=device, input_channels=self.channels,
+                                                      input_format=self._pyaudio.paInt16):
+                    return rate
+            except (ValueError, OSError):
+                continue
+        return self.sample_rates[-1]
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        try:
+            self._ring.put_nowait(in_data)
+        except Full:
+            self.dropped_chunks += 1
+        return (None, self._pyaudio.paContinue)
+
+    def _write_loop(self):
+        while True:
+            chunk = self._ring.get()
+            if chunk is None:
+                return
+            # writeframesraw skips rewriting the header per chunk; close() fixes it up.
+            self._wave.writeframesraw(chunk)
+            self.frames_written += len(chunk) // (self.channels * SAMPLE_WIDTH)
+
+    def start(self):
+        with self._lock:
+            if self._stream is not None:
+                return self.file_path
+            os.makedirs(self.output_folder, exist_ok=True)
+            self.sample_rate = self._pick_sample_rate()
+            self.file_path = unique_recording_path(self.output_folder)
+            self.dropped_chunks = 0
+            self.frames_written = 0
+
+            self._wave = wave.open(self.file_path + ".part", "wb")
+            self._wave.setnchannels(self.channels)
+            self._wave.setsampwidth(SAMPLE_WIDTH)
+            self._wave.setframerate(self.sample_rate)
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+            try:
+                self._stream = self._instance.open(format=self._pyaudio.paInt16, channels=self.channels,
+                                                   rate=self.sample_rate, input=True,
+                                                   frames_per_buffer=self.chunk_frames,
+                                                   stream_callback=self._callback)
+            except Exception:
+                self._finish_writer()
+                os.remove(self.file_path + ".part")
+                raise
+            print(f"Recording to {self.file_path} at {self.sample_rate} Hz.")
+            return self.file_path
+
+    def _finish_writer(self):
+        self._ring.put(None)
+        self._writer.join()
+        self._wave.close()
+        self._wave = None
+
+    def stop(self):
+        """Stop recording and return the finished file, or None if nothing was captured."""
+        with self._lock:
+            if self._stream is None:
+                return None
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+            self._finish_writer()
+
+            part_path = self.file_path + ".part"
+            if self.frames_written == 0:
+                os.remove(part_path)
+                print("No frames were captured. Recording was empty.")
+                return None
+            os.replace(part_path, self.file_path)
+            seconds = self.frames_written / self.sample_rate
+            print(f"Recording saved to {self.file_path} ({seconds:.1f}s"
+                  + (f", {self.dropped_chunks} chunks dropped)." if self.dropped_chunks else")."))
+            file_path = self.file_path
+
+        if self.on_finished:
+            self.on_finished(file_path)
+        return file_path
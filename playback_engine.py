@@ -0,0 +1,381 @@
+import time
+import wave
+import threading
+import subprocess
+from collections import deque
+from queue import Queue, Empty, Full
+import metrics
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+SAMPLE_WIDTH = 2
+CHUNK_FRAMES = 2048
+BUFFER_SECONDS = 0.5
+
+PREOPENS = metrics.counter("agora_playback_preopen_total",
+                           "Queued tracks whose decoder was already running (hit) or had to be started (miss).")
+
+
+class NullSink:
+    """Discards audio. With realtime=True it consumes it at playback speed, like a sound card."""
+
+    def __init__(self, realtime=True):
+        self.realtime = realtime
+        self.bytes_written = 0
+        self._bytes_per_second = None
+        self._clock_start = None
+
+    def open(self, sample_rate, channels, sample_width):
+        self._bytes_per_second = sample_rate * channels * sample_width
+        self._clock_start = None
+
+    def write(self, data):
+        if self.realtime:
+            if self._clock_start is None:
+                self._clock_start = time.monotonic() - self.bytes_written / self._bytes_per_second
+            due = self._clock_start + (self.bytes_written + len(data)) / self._bytes_per_second
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self.bytes_written += len(data)
+
+    def flush(self):
+        # After a stop or pause the clock restarts from the next write.
+        self._clock_start = None
+
+    def close(self):
+        pass
+
+
+class WavFileSink(NullSink):
+    """Writes everything played to a WAV file; useful for headless tests."""
+
+    def __init__(self, path, realtime=False):
+        super().__init__(realtime=realtime)
+        self.path = path
+        self._wave = None
+
+    def open(self, sample_rate, channels, sample_width):
+        super().open(sample_rate, channels, sample_width)
+        self._wave = wave.open(self.path, "wb")
+        self._wave.setnchannels(channels)
+        self._wave.setsampwidth(sample_width)
+        self._wave.setframerate(sample_rate)
+
+    def write(self, data):
+        self._wave.writeframes(data)
+        super().write(data)
+
+    def close(self):
+        if self._wave is not None:
+            self._wave.close()
+            self._wave = None
+
+
+class PyAudioSink:
+    """Plays through the default output device with a blocking PyAudio stream."""
+
+    def __init__(self, pyaudio_instance=None):
+        import pyaudio
+        self._pyaudio = pyaudio
+        self._instance = pyaudio_instance or pyaudio.PyAudio()
+        self._stream = None
+
+    def open(self, sample_rate, channels, sample_width):
+        self._stream = self._instance.open(format=self._instance.get_format_from_width(sample_width),
+                                           channels=channels, rate=sample_rate, output=True,
+                                           frames_per_buffer=CHUNK_FRAMES)
+
+    def write(self, data):
+        self._stream.write(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+
+
+class PlaybackEngine:
+    """
+    In-process audio player.
+
+    A decode thread runs ffmpeg for the current track and streams PCM into a small bounded
+    buffer; an output thread drains it into the sink. Stop, pause and seek act on the next
+    chunk (about 50 ms) instead of waiting on an external player. While one track decodes,
+    the next queued track's ffmpeg is already started, so consecutive tracks play without
+    a gap. That pre-opening and ffmpeg's input seeking are what make track switches fast;
+    stats() reports how fast.
+    """
+
+    def __init__(self, sink=None, sample_rate=SAMPLE_RATE, channels=CHANNELS, buffer_seconds=BUFFER_SECONDS):
+        self.sink = sink or NullSink()
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frame_bytes = channels * SAMPLE_WIDTH
+        self.on_track_start = None
+        self.on_track_end = None
+        self.current_track = None
+        self._position_frames = 0
+        self._generation = 0
+        self._request = None
+        # When the current play() or seek() was asked for; cleared when its first audio reaches the sink.
+        self._requested_at = None
+        self._requested_stage = "playback_start"
+        self._stats_lock = threading.Lock()
+        self._stats = {"opens": 0, "open_seconds": 0.0, "seeks": 0, "seek_seconds": 0.0,
+                       "preopen_hits": 0, "preopen_misses": 0}
+        self._tracks = deque()
+        self._process = None
+        self._closed = False
+        self._unpaused = threading.Event()
+        self._unpaused.set()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._cond = threading.Condition()
+        self._buffer = Queue(maxsize=max(2, int(buffer_seconds * sample_rate / CHUNK_FRAMES)))
+        self.sink.open(sample_rate, channels, SAMPLE_WIDTH)
+        self._decode_thread = threading.Thread(target=self._decode_loop, daemon=True)
+        self._output_thread = threading.Thread(target=self._output_loop, daemon=True)
+        self._decode_thread.start()
+        self._output_thread.start()
+
+    # Commands
+
+    def play(self, file_path, start=0.0, then=()):
+        """Replace whatever is playing with file_path, followed by the tracks in then."""
+        with self._cond:
+            self._restart(file_path, start)
+            self._tracks.extend(then)
+
+    def enqueue(self, file_path):
+        with self._cond:
+            if self._idle.is_set() and self._request is None:
+                self._restart(file_path, 0.0)
+            else:
+                self._tracks.append(file_path)
+
+    def stop(self):
+        with self._cond:
+            self._generation += 1
+            self._request = None
+            self._tracks.clear()
+            self._kill_process()
+            self._drain()
+            self.current_track = None
+            self._unpaused.set()
+            self._idle.set()
+            self.sink.flush()
+
+    def pause(self):
+        self._unpaused.clear()
+
+    def resume(self):
+        self.sink.flush()
+        self._unpaused.set()
+
+    def seek(self, seconds):
+        """Jump within the current track; ffmpeg seeks the input instead of decoding from the start."""
+        with self._cond:
+            if self.current_track is None:
+                return
+            remaining = list(self._tracks)
+            self._restart(self.current_track, max(0.0, seconds), stage="playback_seek")
+            self._tracks.extend(remaining)
+
+    def position(self):
+        return self._position_frames / self.sample_rate
+
+    def stats(self):
+        """
+        Latency from play() or seek() to the first audio reaching the sink, and how often the
+        next queued track's decoder was already open when the previous track ended.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        preopens = stats["preopen_hits"] + stats["preopen_misses"]
+        return {
+            "opens": stats["opens"],
+            "mean_open_seconds": stats["open_seconds"] / stats["opens"] if stats["opens"] else 0.0,
+            "seeks": stats["seeks"],
+            "mean_seek_seconds": stats["seek_seconds"] / stats["seeks"] if stats["seeks"] else 0.0,
+            "preopen_hits": stats["preopen_hits"],
+            "preopen_misses": stats["preopen_misses"],
+            "preopen_hit_rate": stats["preopen_hits"] / preopens if preopens else 0.0,
+        }
+
+    def is_paused(self):
+        return not self._unpaused.is_set()
+
+    def is_active(self):
+        return not self._idle.is_set()
+
+    def wait(self, timeout=None):
+        """Block until everything queued has played or stop() is called. Returns False on timeout."""
+        return self._idle.wait(timeout)
+
+    def close(self):
+        self.stop()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._buffer.put(None)
+        self._decode_thread.join(timeout=1)
+        self._output_thread.join(timeout=1)
+        self.sink.close()
+
+    # Internals
+
+    def _restart(self, file_path, start, stage="playback_start"):
+        self._generation += 1
+        self._tracks.clear()
+        self._kill_process()
+        self._drain()
+        self._request = (self._generation, file_path, start)
+        self._requested_at = time.perf_counter()
+        self._requested_stage = stage
+        self._idle.clear()
+        self.sink.flush()
+        self._cond.notify_all()
+
+    def _drain(self):
+        while True:
+            try:
+                self._buffer.get_nowait()
+            except Empty:
+                return
+
+    def _kill_process(self):
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+
+    def _spawn(self, file_path, start):
+        """Start ffmpeg decoding file_path from start seconds; None if ffmpeg cannot be run."""
+        command = ["ffmpeg", "-nostdin", "-v", "error"]
+        if start > 0:
+            command += ["-ss", f"{start:.3f}"]
+        command += ["-i", file_path, "-vn", "-f", "s16le", "-acodec", "pcm_s16le",
+                    "-ac", str(self.channels), "-ar", str(self.sample_rate), "pipe:1"]
+        try:
+            return subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        except OSError as e:
+            metrics.error("Could not start decoder for %s: %s", file_path, e)
+            return None
+
+    def _count_preopen(self, hit):
+        PREOPENS.inc(result="hit" if hit else "miss")
+        with self._stats_lock:
+            self._stats["preopen_hits" if hit else "preopen_misses"] += 1
+
+    def _record_latency(self, stage, seconds):
+        metrics.record(stage, seconds)
+        kind = "seek" if stage == "playback_seek" else "open"
+        with self._stats_lock:
+            self._stats[kind + "s"] += 1
+            self._stats[kind + "_seconds"] += seconds
+
+    def _put(self, generation, item):
+        while generation == self._generation:
+            try:
+                self._buffer.put((generation,) + item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _decode_loop(self):
+        chunk_bytes = CHUNK_FRAMES * self.frame_bytes
+        while True:
+            with self._cond:
+                while self._request is None and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                generation, file_path, start = self._request
+                self._request = None
+
+            prefetched = None
+            queued = False
+            while file_path is not None and generation == self._generation:
+                if prefetched is not None and prefetched[0] == file_path:
+                    process = prefetched[1]
+                else:
+                    if prefetched is not None and prefetched[1] is not None:
+                        prefetched[1].kill()
+                        prefetched[1].wait()
+                    process = self._spawn(file_path, start)
+                if queued:
+                    hit = prefetched is not None and prefetched[0] == file_path and process is not None
+                    self._count_preopen(hit)
+                prefetched = None
+                queued = True
+                if process is None:
+                    with self._cond:
+                        if generation != self._generation or not self._tracks:
+                            break
+                        file_path, start = self._tracks.popleft(), 0.0
+                    continue
+                with self._cond:
+                    if generation != self._generation:
+                        process.kill()
+                        break
+                    self._process = process
+                    next_path = self._tracks[0] if self._tracks else None
+                if next_path is not None:
+                    prefetched = (next_path, self._spawn(next_path, 0.0))
+
+                self._put(generation, ("start", file_path, start))
+                while generation == self._generation:
+                    chunk = process.stdout.read(chunk_bytes)
+                    if not chunk:
+                        break
+                    if not self._put(generation, ("data", chunk)):
+                        break
+                process.stdout.close()
+                process.wait()
+                self._put(generation, ("end", file_path))
+
+                with self._cond:
+                    if generation != self._generation or not self._tracks:
+                        break
+                    file_path, start = self._tracks.popleft(), 0.0
+
+            if prefetched is not None and prefetched[1] is not None:
+                prefetched[1].kill()
+                prefetched[1].wait()
+            self._put(generation, ("idle",))
+
+    def _output_loop(self):
+        while True:
+            item = self._buffer.get()
+            if item is None:
+                return
+            generation, kind = item[0], item[1]
+            if generation != self._generation:
+                continue
+            if kind == "start":
+                self.current_track = item[2]
+                self._position_frames = int(item[3] * self.sample_rate)
+                if self.on_track_start:
+                    self.on_track_start(item[2])
+            elif kind == "data":
+                while not self._unpaused.wait(0.1) and generation == self._generation:
+                    pass
+                if generation != self._generation:
+                    continue
+                self.sink.write(item[2])
+                if self._requested_at is not None:
+                    self._record_latency(self._requested_stage, time.perf_counter() - self._requested_at)
+                    self._requested_at = None
+                self._position_frames += len(item[2]) // self.frame_bytes
+            elif kind == "end":
+                if self.on_track_end:
+                    self.on_track_end(item[2])
+            elif kind == "idle":
+                with self._cond:
+                    if generation == self._generation and self._request is None:
+                        self.current_track = None
+                        self._idle.set()
@@ -0,0 +1,104 @@
+import os
+import hashlib
+from db import get_connection
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+LEDGER_COLUMNS = {
+    "content_hash": "TEXT",
+    "file_size": "INTEGER",
+    "file_mtime_ns": "INTEGER",
+}
+
+
+def hash_file(file_path, chunk_size=HASH_CHUNK_SIZE):
+    """Streaming SHA-256 of the file contents; never holds more than one chunk in memory."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ProcessedLedger:
+    """
+    Set-based view of processed_files, loaded once per scan.
+
+    A file is known when its (name, size, mtime) matches a ledger row, which needs only a
+    stat call, or when its content hash matches, which catches re-exports and copies under
+    a new name. Rows written before content hashes were recorded are matched by name.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.stat_keys = set()
+        self.hashes = set()
+        self.legacy_names = set()
+        self.hashed_files = 0
+
+    @classmethod
+    def load(cls, db_path):
+        # Imported here: schema takes LEDGER_COLUMNS from this module.
+        from schema import migrate
+        migrate(db_path)
+        ledger = cls(db_path)
+        cursor = get_connection(db_path).cursor()
+        cursor.execute("SELECT file_name, content_hash, file_size, file_mtime_ns FROM processed_files")
+        for file_name, content_hash, file_size, file_mtime_ns in cursor:
+            if content_hash is None:
+                ledger.legacy_names.add(file_name)
+                continue
+            ledger.hashes.add(content_hash)
+            if file_size is not None and file_mtime_ns is not None:
+                ledger.stat_keys.add((file_name, file_size, file_mtime_ns))
+        return ledger
+
+    def check(self, normalized_name, file_path, stat_result=None):
+        """
+        Return (is_processed, fingerprint) where fingerprint is
+        (content_hash, file_size, file_mtime_ns), or None when the stat fast path matched.
+        """
+        stat_result = stat_result or os.stat(file_path)
+        stat_key = (normalized_name, stat_result.st_size, stat_result.st_mtime_ns)
+        if stat_key in self.stat_keys:
+            return True, None
+
+        content_hash = hash_file(file_path)
+        self.hashed_files += 1
+        fingerprint = (content_hash, stat_result.st_size, stat_result.st_mtime_ns)
+
+        if content_hash in self.hashes:
+            # Same audio under a new name or timestamp: remember the alias so the next
+            # scan takes the stat fast path.
+            self.record(normalized_name, fingerprint)
+            return True, fingerprint
+
+        if normalized_name in self.legacy_names:
+            self.record(normalized_name, fingerprint)
+            return True, fingerprint
+
+        return False, fingerprint
+
+    def record(self, normalized_name, fingerprint):
+        mark_fingerprint(self.db_path, normalized_name, fingerprint)
+        self.add(normalized_name, fingerprint)
+
+    def add(self, normalized_name, fingerprint):
+        content_hash, file_size, file_mtime_ns = fingerprint
+        self.hashes.add(content_hash)
+        self.stat_keys.add((normalized_name, file_size, file_mtime_ns))
+        self.legacy_names.discard(normalized_name)
+
+
+def mark_fingerprint(db_path, normalized_name, fingerprint):
+    content_hash, file_size, file_mtime_ns = fingerprint
+    cursor = get_connection(db_path).cursor()
+    cursor.execute("UPDATE processed_files SET content_hash = ?, file_size = ?, file_mtime_ns = ? "
+                   "WHERE file_name = ?",
+                   (content_hash, file_size, file_mtime_ns, normalized_name))
+    if cursor.rowcount == 0:
+        cursor.execute("INSERT INTO processed_files (file_name, content_hash, file_size, file_mtime_ns) "
+                       "VALUES (?, ?, ?, ?)", (normalized_name, content_hash, file_size, file_mtime_ns))
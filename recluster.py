@@ -0,0 +1,206 @@
+import sys
+import time
+import numpy as np
+import Recording
+from db import get_connection, transaction
+from recording_index import RecordingIndex
+
+CHUNK_ROWS = 16384
+BATCH_SIZE = 4096
+ITERATIONS = 100
+# A cluster keeps an old category's id and name when at least this share of its members came from it.
+MIN_OVERLAP = 0.5
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def _cluster_sums(vectors, labels, k):
+    """Per-cluster sums and member counts, accumulated in chunks with one reduceat per chunk."""
+    sums = np.zeros((k, vectors.shape[1]), dtype=np.float64)
+    counts = np.bincount(labels[labels >= 0], minlength=k)
+    for start in range(0, len(labels), CHUNK_ROWS):
+        chunk_labels = labels[start:start + CHUNK_ROWS]
+        keep = np.flatnonzero(chunk_labels >= 0)
+        if not len(keep):
+            continue
+        order = keep[np.argsort(chunk_labels[keep], kind="stable")]
+        sorted_labels = chunk_labels[order]
+        starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+        chunk = np.asarray(vectors[start:start + CHUNK_ROWS])[order]
+        sums[sorted_labels[starts]] += np.add.reduceat(chunk, starts, axis=0)
+    return sums, counts
+
+
+def assign(vectors, centroids):
+    """Nearest centroid (by cosine) and its score for every row, in chunks."""
+    labels = np.empty(len(vectors), dtype=np.int64)
+    scores = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), CHUNK_ROWS):
+        similarities = np.asarray(vectors[start:start + CHUNK_ROWS]) @ centroids.T
+        labels[start:start + CHUNK_ROWS] = np.argmax(similarities, axis=1)
+        scores[start:start + CHUNK_ROWS] = similarities[np.arange(len(similarities)), labels[start:start + CHUNK_ROWS]]
+    return labels, scores
+
+
+def minibatch_kmeans(vectors, centroids, iterations=ITERATIONS, batch_size=BATCH_SIZE, seed=0):
+    """
+    Spherical mini-batch k-means. Each step assigns one random batch with a single matrix
+    product and moves every centroid towards its batch members by a per-centroid learning
+    rate of 1 / (members seen so far), then re-normalizes.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = centroids.astype(np.float32, copy=True)
+    seen = np.zeros(len(centroids), dtype=np.float64)
+    for _ in range(iterations):
+        rows = np.sort(rng.choice(len(vectors), size=min(batch_size, len(vectors)), replace=False))
+        batch = np.asarray(vectors[rows])
+        labels = np.argmax(batch @ centroids.T, axis=1)
+        sums, counts = _cluster_sums(batch, labels, len(centroids))
+        moved = counts > 0
+        seen[moved] += counts[moved]
+        step = (sums[moved] - counts[moved, None] * centroids[moved]) / seen[moved, None]
+        centroids[moved] = _normalize_rows(centroids[moved] + step)
+    return centroids
+
+
+def initial_centroids(vectors, old_labels, k, seed=0):
+    """Start from the current categories' mean vectors, topped up with random recordings."""
+    sums, counts = _cluster_sums(vectors, old_labels, old_labels.max() + 1 if len(old_labels) else 0)
+    centroids = _normalize_rows(sums[counts > 0]).astype(np.float32)[:k]
+    if len(centroids) < k:
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(len(vectors), size=k - len(centroids), replace=False))
+        centroids = np.vstack([centroids.reshape(-1, vectors.shape[1]), np.asarray(vectors[rows])])
+    return centroids
+
+
+def map_clusters(new_labels, old_labels, k, old_count):
+    """
+    Greedily pair each new cluster with the old category that contributed most of its
+    members, largest overlaps first, each old category used at most once. Returns an array
+    of old label per cluster, -1 where no old category holds MIN_OVERLAP of it.
+    """
+    sizes = np.bincount(new_labels, minlength=k)
+    known = old_labels >= 0
+    pairs, overlap = np.unique(new_labels[known] * old_count + old_labels[known], return_counts=True)
+    mapping = np.full(k, -1, dtype=np.int64)
+    taken = set()
+    for index in np.argsort(-overlap, kind="stable"):
+        cluster, old = divmod(int(pairs[index]), old_count)
+        if mapping[cluster] != -1 or old in taken or overlap[index] < MIN_OVERLAP * sizes[cluster]:
+            continue
+        mapping[cluster] = old
+        taken.add(old)
+    return mapping
+
+
+def recluster(db_path, index_path=None, k=None, iterations=ITERATIONS, batch_size=BATCH_SIZE,
+              dry_run=False, drop_empty=False, seed=0):
+    """
+    Re-cluster every recording embedding and apply the result in one transaction.
+    Clusters that map cleanly onto an existing category keep its id and name and get the
+    new centroid as its embedding; the rest become new categories named from the
+    recording closest to their centroid.
+    """
+    started = time.monotonic()
+    index = RecordingIndex(index_path or Recording.recording_index_path(db_path))
+    index.sync(db_path)
+    ids, vectors = index.matrix()
+    if len(ids) == 0:
+        print("No recordings to cluster.")
+        return None
+
+    conn = get_connection(db_path)
+    category_ids = np.array([row[0] for row in conn.execute("SELECT id FROM categories ORDER BY id")], dtype=np.int64)
+    rows = np.array(conn.execute("SELECT id, COALESCE(category_id, -1) FROM recordings ORDER BY id").fetchall(),
+                    dtype=np.int64).reshape(-1, 2)
+    current = np.full(len(ids), -1, dtype=np.int64)
+    positions = np.searchsorted(rows[:, 0], ids)
+    found = (positions < len(rows)) & (rows[np.minimum(positions, len(rows) - 1), 0] == ids)
+    current[found] = rows[positions[found], 1]
+    old_labels = np.full(len(ids), -1, dtype=np.int64)
+    category_positions = np.searchsorted(category_ids, current)
+    known = (current >= 0) & (category_positions < len(category_ids))
+    known[known] = category_ids[category_positions[known]] == current[known]
+    old_labels[known] = category_positions[known]
+    print(f"Loaded {len(ids)} embeddings ({vectors.shape[1]} dims) and {len(category_ids)} categories "
+          f"in {time.monotonic() - started:.1f}s.")
+
+    if k is None:
+        k = len(np.unique(old_labels[old_labels >= 0])) or max(1, int(np.sqrt(len(ids) / 2)))
+    k = max(1, min(k, len(ids)))
+    centroids = minibatch_kmeans(vectors, initial_centroids(vectors, old_labels, k, seed),
+                                 iterations, batch_size, seed)
+    new_labels, scores = assign(vectors, centroids)
+    sums, sizes = _cluster_sums(vectors, new_labels, k)
+    centroids = _normalize_rows(sums).astype(np.float32)
+    print(f"Clustered into {int((sizes > 0).sum())} non-empty clusters in {time.monotonic() - started:.1f}s.")
+
+    mapping = map_clusters(new_labels, old_labels, k, max(len(category_ids), 1))
+    new_clusters = [c for c in range(k) if sizes[c] and mapping[c] == -1]
+    target = np.where(mapping >= 0, category_ids[np.maximum(mapping, 0)] if len(category_ids) else -1, -1)
+
+    # Name new clusters before the transaction so the write lock is not held during API calls.
+    names = {}
+    for c in ([] if dry_run else new_clusters):
+        members = np.flatnonzero(new_labels == c)
+        medoid = int(ids[members[np.argmax(scores[members])]])
+        transcription = conn.execute("SELECT transcription FROM recordings WHERE id = ?", (medoid,)).fetchone()[0]
+        names[c] = Recording.generate_category_name(transcription or "")
+        if not names[c]:
+            print("Could not name a new cluster; nothing was changed. Try again later.")
+            return None
+
+    moved = int(((current != target[new_labels]) | (target[new_labels] == -1)).sum())
+    print(f"{int((sizes > 0).sum()) - len(new_clusters)} clusters keep their category, {len(new_clusters)} are new; "
+          f"{moved} recordings change category.")
+    if dry_run:
+        return {"clusters": k, "new_categories": len(new_clusters), "moved": moved}
+
+    created = []
+    with transaction(db_path):
+        for c in new_clusters:
+            audio_path = Recording.get_tts_cache().lookup(names[c], Recording.VOICE_ID, Recording.MODEL_ID)
+            cursor = conn.execute("INSERT INTO categories (name, embedding, embedding_format, embedding_full, "
+                                  "name_audio_path) VALUES (?, ?, ?, ?, ?)",
+                                  (names[c],) + Recording.serialize_category_embedding(centroids[c]) + (audio_path,))
+            target[c] = cursor.lastrowid
+            if audio_path is None:
+                created.append((cursor.lastrowid, names[c]))
+        conn.executemany("UPDATE categories SET embedding = ?, embedding_format = ?, embedding_full = ? WHERE id = ?",
+                         [Recording.serialize_category_embedding(centroids[c]) + (int(target[c]),)
+                          for c in range(k) if sizes[c] and mapping[c] >= 0])
+        assigned = target[new_labels]
+        changed = np.flatnonzero(current != assigned)
+        conn.executemany("UPDATE recordings SET category_id = ? WHERE id = ?",
+                         zip(assigned[changed].tolist(), ids[changed].tolist()))
+        dropped = 0
+        if drop_empty:
+            dropped = conn.execute("DELETE FROM categories WHERE id NOT IN "
+                                   "(SELECT DISTINCT category_id FROM recordings WHERE category_id IS NOT NULL)").rowcount
+
+    for category_id, name in created:
+        Recording.schedule_category_audio(db_path, category_id, name)
+    print(f"Reassigned {len(changed)} recordings, created {len(new_clusters)} categories"
+          + (f", dropped {dropped} empty ones" if drop_empty else "")
+          + f" in {time.monotonic() - started:.1f}s.")
+    return {"clusters": k, "new_categories": len(new_clusters), "moved": len(changed)}
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    options = {"--clusters": None, "--iterations": ITERATIONS}
+    for flag in options:
+        if flag in args:
+            position = args.index(flag)
+            options[flag] = int(args[position + 1])
+            del args[position:position + 2]
+    flags = {arg for arg in args if arg.startswith("--")}
+    args = [arg for arg in args if not arg.startswith("--")]
+    database = args[0] if args else Recording.DB_PATH
+    recluster(database, k=options["--clusters"], iterations=options["--iterations"],
+              dry_run="--dry-run" in flags, drop_empty="--drop-empty" in flags)
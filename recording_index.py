@@ -0,0 +1,323 @@
+import os
+import json
+import threading
+from contextlib import contextmanager
+import numpy as np
+from db import get_read_connection
+from embedding_codec import decode_embedding, truncate
+from metrics import debug, info, warning
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def _locked_file(path):
+    """Hold an exclusive lock on path (created if missing) across processes."""
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    # Retries for about ten seconds before raising; keep waiting.
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class RecordingIndex:
+    """
+    Persistent embedding index over the recordings table.
+
+    Vectors are stored L2-normalized in a flat float32 file (<base>.f32) that is opened with
+    mmap, next to an int64 id map (<base>.ids) and a small header (<base>.json) holding the
+    dimension and committed row count. Only rows newer than the last indexed id are read
+    from SQLite, so opening the index never loads every embedding blob.
+
+    Writers (append, sync, reset) hold <base>.lock, so the watch daemon and an ingest run
+    in another process can sync into the same files without interleaving their writes.
+
+    Search is exact brute force by default. build_ivf() adds an optional inverted-file
+    index (k-means coarse quantizer) for large archives; rows appended after it was built
+    are scanned exactly until it is rebuilt.
+    """
+
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self.vectors_path = base_path + ".f32"
+        self.ids_path = base_path + ".ids"
+        self.header_path = base_path + ".json"
+        self.ivf_path = base_path + ".ivf.npz"
+        self.lock_path = base_path + ".lock"
+        self.dim = None
+        self.count = 0
+        self._vectors = None
+        self._ids = None
+        self._mapped_count = -1
+        self._ivf = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+        self._load_header()
+
+    def _load_header(self):
+        if not os.path.exists(self.header_path):
+            return
+        with open(self.header_path, "r") as f:
+            header = json.load(f)
+        self.dim = header["dim"]
+        self.count = header["count"]
+
+    def _write_header(self):
+        tmp_path = self.header_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"dim": self.dim, "count": self.count}, f)
+        os.replace(tmp_path, self.header_path)
+
+    @contextmanager
+    def _writing(self):
+        """Exclusive against other threads and processes while the files change; reentrant."""
+        with self._write_lock:
+            self._write_depth += 1
+            try:
+                if self._write_depth == 1:
+                    with _locked_file(self.lock_path):
+                        yield
+                else:
+                    yield
+            finally:
+                self._write_depth -= 1
+
+    def _map(self):
+        """Map the committed rows; remaps only when another writer grew the files."""
+        self._load_header()
+        if self._mapped_count == self.count:
+            return
+        # Another process may also have rebuilt the IVF lists.
+        self._ivf = None
+        if self.count == 0:
+            self._vectors = np.zeros((0, self.dim or 0), dtype=np.float32)
+            self._ids = np.zeros(0, dtype=np.int64)
+        else:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.count, self.dim))
+            self._ids = np.memmap(self.ids_path, dtype=np.int64, mode="r", shape=(self.count,))
+        self._mapped_count = self.count
+
+    def __len__(self):
+        return self.count
+
+    def last_indexed_id(self):
+        with self._lock:
+            self._map()
+            if self.count == 0:
+                return 0
+            return int(self._ids[self.count - 1])
+
+    def append(self, recording_ids, embeddings):
+        """Append rows; ids must be increasing and larger than anything already indexed."""
+        matrix = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        if len(matrix) == 0:
+            return
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix = matrix / norms
+        ids = np.asarray(recording_ids, dtype=np.int64)
+
+        with self._writing(), self._lock:
+            self._load_header()
+            if self.dim is None:
+                self.dim = matrix.shape[1]
+            if matrix.shape[1] != self.dim:
+                raise ValueError(f"Embedding has {matrix.shape[1]} dims, recording index has {self.dim}.")
+
+            # Truncate any rows left behind by a writer that died before updating the header.
+            for path, item_size in ((self.vectors_path, 4 * self.dim), (self.ids_path, 8)):
+                with open(path, "ab") as f:
+                    f.truncate(self.count * item_size)
+                    f.write((matrix if path == self.vectors_path else ids).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+
+            self.count += len(ids)
+            self._write_header()
+            self._ivf = None
+
+    def reset(self):
+        """Drop all indexed rows, e.g. before re-syncing after embeddings were rewritten."""
+        with self._writing(), self._lock:
+            # Release the maps first; Windows refuses to delete a mapped file.
+            self._vectors = None
+            self._ids = None
+            self._ivf = None
+            self._mapped_count = -1
+            self.dim = None
+            self.count = 0
+            for path in (self.vectors_path, self.ids_path, self.header_path, self.ivf_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def sync(self, db_path, batch_size=1000):
+        """Index recordings added to the database since the last sync."""
+        with self._writing():
+            return self._sync(db_path, batch_size)
+
+    def _sync(self, db_path, batch_size):
+        # Read under the write lock, so a concurrent sync cannot append the same rows.
+        last_id = self.last_indexed_id()
+        cursor = get_read_connection(db_path).cursor()
+        cursor.execute("SELECT id, embedding, embedding_format FROM recordings "
+                       "WHERE id > ? AND embedding IS NOT NULL ORDER BY id", (last_id,))
+        added = 0
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            vectors = [decode_embedding(row[1], row[2]) for row in rows]
+            dim = self.dim or len(vectors[0])
+            keep = [i for i, vec in enumerate(vectors) if len(vec) == dim]
+            if len(keep) < len(rows):
+                warning("Skipping %d recordings whose embeddings are not %d-dimensional.", len(rows) - len(keep), dim)
+            if keep:
+                self.append([rows[i][0] for i in keep], np.stack([vectors[i] for i in keep]))
+                added += len(keep)
+        if added:
+            debug("Recording index synced: %d new recordings, %d total.", added, self.count)
+        return added
+
+    def _normalize_query(self, query):
+        # Full-size query embeddings are cut to match an index of truncated vectors.
+        query = truncate(query, self.dim)
+        if self.dim is not None and query.shape[0] != self.dim:
+            raise ValueError(f"Query has {query.shape[0]} dims, recording index has {self.dim}.")
+        norm = np.linalg.norm(query)
+        return query / norm if norm else query
+
+    def _top_k(self, scores, rows, top_k):
+        if len(scores) == 0:
+            return [], []
+        k = min(top_k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        best = best[np.argsort(-scores[best])]
+        return rows[best], scores[best]
+
+    def search(self, query, top_k=10, nprobe=8, exact=False, block_rows=65536):
+        """
+        Return a list of (recording_id, score) sorted by descending cosine similarity.
+        Uses the IVF index when one is built and exact is False.
+        """
+        with self._lock:
+            self._map()
+            if self.count == 0:
+                return []
+            query = self._normalize_query(query)
+            vectors, ids, count = self._vectors, self._ids, self.count
+
+        ivf = None if exact else self._load_ivf()
+        if ivf is not None:
+            candidate_rows = self._ivf_candidates(ivf, query, nprobe, count)
+            scores = vectors[candidate_rows] @ query
+            rows, scores = self._top_k(scores, candidate_rows, top_k)
+        else:
+            best_rows = np.zeros(0, dtype=np.int64)
+            best_scores = np.zeros(0, dtype=np.float32)
+            for start in range(0, count, block_rows):
+                stop = min(start + block_rows, count)
+                block_scores = np.asarray(vectors[start:stop]) @ query
+                rows = np.concatenate([best_rows, np.arange(start, stop, dtype=np.int64)])
+                scores = np.concatenate([best_scores, block_scores])
+                best_rows, best_scores = self._top_k(scores, rows, top_k)
+            rows, scores = best_rows, best_scores
+
+        return [(int(ids[row]), float(score)) for row, score in zip(rows, scores)]
+
+    def matrix(self):
+        """(ids, vectors) for every indexed recording, as read-only memory maps sorted by id."""
+        with self._lock:
+            self._map()
+            return self._ids, self._vectors
+
+    def vector_for(self, recording_id):
+        with self._lock:
+            self._map()
+            position = np.searchsorted(self._ids, recording_id)
+            if position < self.count and self._ids[position] == recording_id:
+                return np.array(self._vectors[position])
+        return None
+
+    def build_ivf(self, nlist=None, iterations=10, sample_size=100000, seed=0):
+        """Train a k-means coarse quantizer and store the inverted lists next to the index."""
+        with self._lock:
+            self._map()
+            vectors, count = self._vectors, self.count
+        if count == 0:
+            return
+        nlist = nlist or max(1, int(np.sqrt(count)))
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(count, size=min(sample_size, count), replace=False))
+        sample = np.asarray(vectors[sample_rows])
+        centroids = sample[rng.choice(len(sample), size=min(nlist, len(sample)), replace=False)].copy()
+
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(len(centroids)):
+                members = sample[assignment == c]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    norm = np.linalg.norm(centroid)
+                    centroids[c] = centroid / norm if norm else centroid
+
+        assignment = np.empty(count, dtype=np.int32)
+        for start in range(0, count, 65536):
+            stop = min(start + 65536, count)
+            assignment[start:stop] = np.argmax(np.asarray(vectors[start:stop]) @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable").astype(np.int64)
+        offsets = np.searchsorted(assignment[order], np.arange(len(centroids) + 1)).astype(np.int64)
+
+        tmp_path = self.ivf_path + ".tmp.npz"
+        np.savez(tmp_path, centroids=centroids, order=order, offsets=offsets, count=np.int64(count))
+        os.replace(tmp_path, self.ivf_path)
+        self._ivf = None
+        info("Built IVF index with %d lists over %d recordings.", len(centroids), count)
+
+    def _load_ivf(self):
+        if self._ivf is None and os.path.exists(self.ivf_path):
+            with np.load(self.ivf_path) as data:
+                self._ivf = {key: data[key] for key in data.files}
+        return self._ivf
+
+    def _ivf_candidates(self, ivf, query, nprobe, count):
+        centroids = ivf["centroids"]
+        nprobe = min(nprobe, len(centroids))
+        probe = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+        parts = [ivf["order"][ivf["offsets"][c]:ivf["offsets"][c + 1]] for c in probe]
+        indexed_count = int(ivf["count"])
+        if count > indexed_count:
+            parts.append(np.arange(indexed_count, count, dtype=np.int64))
+        return np.sort(np.concatenate(parts))
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 3:
+        print("Usage: python recording_index.py <db_path> <index_base_path> [--ivf]")
+        sys.exit(1)
+
+    recording_index = RecordingIndex(sys.argv[2])
+    recording_index.sync(sys.argv[1])
+    if "--ivf" in sys.argv[3:]:
+        recording_index.build_ivf()
@@ -0,0 +1,334 @@
+import os
+import sys
+import time
+import uuid
+import threading
+import subprocess
+from datetime import datetime
+import numpy as np
+from db import get_connection, transaction, close_thread_connections
+from http_client import close_session
+from processed_ledger import hash_file
+from retry_queue import schedule_retry
+from audio_metadata import safe_probe_audio
+from metrics import timed, info, error
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+# About 1.5 s of stereo float32 per chunk (~520 KB); memory use does not grow with track length.
+CHUNK_FRAMES = 65536
+CROSSFADE_SECONDS = 0.05
+# The original drops by this much while an overlaid remix plays over it.
+OVERLAY_DUCK_DB = -9.0
+# Limits on the gain that brings the remix to the original's loudness.
+MAX_GAIN_DB = 12.0
+MIN_GAIN_DB = -12.0
+# Samples above this level are soft-limited instead of clipped.
+LIMITER_THRESHOLD = 0.9
+AAC_BITRATE = "64k"
+MODES = ("insert", "overlay")
+
+
+class _FrameReader:
+    """Reads exact frame counts from an iterator of (frames, channels) chunks."""
+
+    def __init__(self, chunks, channels=CHANNELS):
+        self._chunks = iter(chunks)
+        self._buffer = np.empty((0, channels), dtype=np.float32)
+
+    def read(self, frames):
+        """Up to frames frames; fewer only at the end of the stream."""
+        parts, have = [self._buffer], len(self._buffer)
+        while have < frames:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            parts.append(chunk)
+            have += len(chunk)
+        data = np.concatenate(parts) if len(parts) > 1 else parts[0]
+        self._buffer = data[frames:]
+        return data[:frames]
+
+    def read_chunks(self, frames, chunk_frames=CHUNK_FRAMES):
+        """Yield the next frames frames in chunks."""
+        while frames > 0:
+            chunk = self.read(min(frames, chunk_frames))
+            if not len(chunk):
+                return
+            frames -= len(chunk)
+            yield chunk
+
+    def __iter__(self):
+        if len(self._buffer):
+            yield self._buffer
+            self._buffer = self._buffer[:0]
+        yield from self._chunks
+
+
+def decode_chunks(file_path, sample_rate=SAMPLE_RATE, channels=CHANNELS, chunk_frames=CHUNK_FRAMES):
+    """Yield float32 (frames, channels) chunks of file_path, decoded and resampled by ffmpeg."""
+    command = [
+        "ffmpeg", "-nostdin", "-v", "error",
+        "-i", file_path,
+        "-vn", "-f", "s16le", "-acodec", "pcm_s16le",
+        "-ac", str(channels), "-ar", str(sample_rate),
+        "pipe:1"
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    frame_bytes = channels * 2
+    leftover = b""
+    finished = False
+    try:
+        while True:
+            data = process.stdout.read(chunk_frames * frame_bytes)
+            if not data:
+                finished = True
+                break
+            data = leftover + data
+            usable = len(data) - len(data) % frame_bytes
+            leftover = data[usable:]
+            if usable:
+                yield np.frombuffer(data[:usable], dtype=np.int16).reshape(-1, channels).astype(np.float32) / 32768.0
+    finally:
+        process.stdout.close()
+        if not finished:
+            process.kill()
+        returncode = process.wait()
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg could not decode {file_path}")
+
+
+def _equal_power(frames):
+    """(fade_out, fade_in) column vectors whose squares sum to one, so loudness holds through the fade."""
+    angle = np.linspace(0.0, np.pi / 2, frames, dtype=np.float32)[:, None]
+    return np.cos(angle), np.sin(angle)
+
+
+def crossfade_join(segments, crossfade_frames, channels=CHANNELS):
+    """
+    Concatenate chunk iterators, overlapping each join by crossfade_frames with an
+    equal-power crossfade. Only the last crossfade_frames of a segment are held back.
+    """
+    held = None
+    for segment in segments:
+        reader = _FrameReader(segment, channels)
+        if held is not None and len(held):
+            head = reader.read(len(held))
+            fade_out, fade_in = _equal_power(len(held))
+            mixed = held * fade_out
+            mixed[:len(head)] += head * fade_in[:len(head)]
+            yield mixed
+        buffer = np.empty((0, channels), dtype=np.float32)
+        for chunk in reader:
+            buffer = np.concatenate([buffer, chunk])
+            if len(buffer) > crossfade_frames:
+                # Not buffer[:-crossfade_frames], which is empty when crossfade_frames is 0.
+                cut = len(buffer) - crossfade_frames
+                yield buffer[:cut]
+                buffer = buffer[cut:]
+        held = buffer
+    if held is not None and len(held):
+        yield held
+
+
+def _duck_envelope(positions, length, duck, ramp_frames):
+    """
+    Gain for the original at each overlay position: ramps to duck, holds, ramps back over
+    the remix's last frames. length may be inf while the end of the remix is not yet known.
+    """
+    ramp = max(1, ramp_frames)
+    into = np.clip(positions / ramp, 0.0, 1.0)
+    out_of = np.clip((length - positions) / ramp, 0.0, 1.0)
+    return (1.0 - (1.0 - duck) * np.minimum(into, out_of)).astype(np.float32)[:, None]
+
+
+def soft_limit(chunk, threshold=LIMITER_THRESHOLD):
+    """Leave samples below threshold alone and bend the rest smoothly towards full scale."""
+    magnitude = np.abs(chunk)
+    over = magnitude > threshold
+    if not over.any():
+        return chunk
+    headroom = 1.0 - threshold
+    limited = chunk.copy()
+    limited[over] = np.sign(chunk[over]) * (threshold + headroom * np.tanh((magnitude[over] - threshold) / headroom))
+    return limited
+
+
+def mix_streams(original_chunks, remix_chunks, offset_frames, mode="insert", remix_gain=1.0,
+                sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    """
+    Yield the remixed audio in chunks.
+
+    insert plays the original up to offset_frames, then the remix, then the rest of the
+    original, crossfading at both joins. overlay mixes the remix over the original from
+    offset_frames on, ducking the original underneath it until the remix ends.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown remix mode {mode!r}; expected one of {MODES}.")
+    crossfade_frames = int(CROSSFADE_SECONDS * sample_rate)
+    original = _FrameReader(original_chunks, channels)
+    remix = (chunk * remix_gain for chunk in remix_chunks)
+
+    if mode == "insert":
+        segments = [original.read_chunks(offset_frames), remix, original]
+        for chunk in crossfade_join(segments, crossfade_frames, channels):
+            yield soft_limit(chunk)
+        return
+
+    yield from original.read_chunks(offset_frames)
+    duck = 10 ** (OVERLAY_DUCK_DB / 20)
+    # The remix is read one chunk ahead: a short read marks its end, and a full chunk still to
+    # come means the release ramp cannot start yet, so the duck holds until the real end.
+    chunk_frames = max(CHUNK_FRAMES, crossfade_frames)
+    remix = _FrameReader(remix, channels)
+    position = 0
+    chunk = remix.read(chunk_frames)
+    while len(chunk):
+        following = remix.read(chunk_frames)
+        end = position + len(chunk) + len(following) if len(following) < chunk_frames else np.inf
+        underneath = original.read(len(chunk))
+        if len(underneath) < len(chunk):
+            underneath = np.concatenate([underneath, np.zeros((len(chunk) - len(underneath), channels),
+                                                              dtype=np.float32)])
+        envelope = _duck_envelope(np.arange(position, position + len(chunk)), end, duck, crossfade_frames)
+        yield soft_limit(underneath * envelope + chunk)
+        position += len(chunk)
+        chunk = following
+    yield from original
+
+
+def loudness_gain(original_rms_dbfs, remix_rms_dbfs):
+    """Linear gain that brings the remix to the original's RMS level, within MIN_GAIN_DB..MAX_GAIN_DB."""
+    if original_rms_dbfs is None or remix_rms_dbfs is None or not np.isfinite([original_rms_dbfs, remix_rms_dbfs]).all():
+        return 1.0
+    gain_db = float(np.clip(original_rms_dbfs - remix_rms_dbfs, MIN_GAIN_DB, MAX_GAIN_DB))
+    return 10 ** (gain_db / 20)
+
+
+def encode_chunks(chunks, output_path, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    """
+    Encode float chunks to AAC in an M4A, written to a .part file and renamed when ffmpeg
+    has finished, so watchers never see a half-written remix.
+    """
+    temp_path = output_path + ".part"
+    command = [
+        "ffmpeg", "-nostdin", "-v", "error", "-y",
+        "-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels), "-i", "pipe:0",
+        "-c:a", "aac", "-b:a", AAC_BITRATE,
+        "-f", "mp4", temp_path
+    ]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        for chunk in chunks:
+            process.stdin.write((np.clip(chunk, -1.0, 1.0) * 32767).astype(np.int16).tobytes())
+        process.stdin.close()
+        stderr = process.stderr.read().decode(errors="replace").strip()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed: {stderr}")
+        os.replace(temp_path, output_path)
+    except BaseException:
+        process.kill()
+        process.wait()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return output_path
+
+
+@timed("remix")
+def render_remix(original_file, remix_file, offset_seconds, output_path, mode="insert", original_rms_dbfs=None):
+    """Mix remix_file into original_file at offset_seconds and write output_path. Returns output_path."""
+    remix_metadata = safe_probe_audio(remix_file)
+    if original_rms_dbfs is None:
+        original_metadata = safe_probe_audio(original_file)
+        original_rms_dbfs = original_metadata["rms_dbfs"] if original_metadata else None
+    gain = loudness_gain(original_rms_dbfs, remix_metadata["rms_dbfs"] if remix_metadata else None)
+    chunks = mix_streams(decode_chunks(original_file), decode_chunks(remix_file), int(offset_seconds * SAMPLE_RATE),
+                         mode, gain)
+    return encode_chunks(chunks, output_path)
+
+
+def record_lineage(db_path, remix_path, original_id, offset_seconds, mode, source_path):
+    get_connection(db_path).execute(
+        "INSERT INTO remixes (file_path, original_id, offset_seconds, mode, source_path, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (remix_path, original_id, offset_seconds, mode, source_path, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+
+def remixes_of(db_path, original_id):
+    """[(remix recording id or None until ingested, file_path, offset_seconds, mode)] for a recording."""
+    return get_connection(db_path).execute(
+        "SELECT r.id, x.file_path, x.offset_seconds, x.mode FROM remixes x "
+        "LEFT JOIN recordings r ON r.file_path = x.file_path WHERE x.original_id = ? ORDER BY x.created_at",
+        (original_id,)).fetchall()
+
+
+def _ingest_remix(db_path, output_path, processed_name, fingerprint):
+    import Recording
+    try:
+        if not Recording.process_audio_and_store_with_category(output_path, db_path, processed_name, fingerprint):
+            Recording.defer_failed_file(db_path, output_path, processed_name, fingerprint, "Remix ingest failed.")
+    except Exception as e:
+        # The retry queue entry written by create_remix still covers the file.
+        error("Error ingesting remix %s: %s", output_path, e)
+
+
+def _ingest_remix_in_background(*args):
+    try:
+        _ingest_remix(*args)
+    finally:
+        close_session()
+        close_thread_connections()
+
+
+def create_remix(db_path, original_id, remix_file, offset_seconds, mode="insert", output_folder=None, wait=False):
+    """
+    Render a remix of recording original_id and ingest it like any other recording, so it
+    is transcribed, categorized and searchable. Returns the remix file path once it is
+    rendered; the ingest (transcription, naming, rate-limited API calls) runs on a
+    background thread unless wait is True.
+
+    The lineage, the ledger entry and a retry queue entry are committed before the file
+    appears under its .m4a name, so folder scans never ingest it a second time, and an
+    ingest that fails or is cut short is picked up by the retry queue.
+    """
+    import Recording
+    row = get_connection(db_path).execute("SELECT file_path, rms_dbfs FROM recordings WHERE id = ?",
+                                          (original_id,)).fetchone()
+    if row is None:
+        raise ValueError(f"Recording ID {original_id} does not exist.")
+    original_file, original_rms_dbfs = row
+    output_folder = output_folder or os.path.dirname(original_file)
+    # The random suffix keeps two remixes of one recording made in the same second apart.
+    output_path = os.path.join(output_folder, f"remix_{original_id}_{int(time.time())}_{uuid.uuid4().hex[:8]}.m4a")
+
+    # Rendered under a name folder scans ignore; the rename keeps the mtime the fingerprint records.
+    staged_path = output_path + ".part"
+    render_remix(original_file, remix_file, offset_seconds, staged_path, mode, original_rms_dbfs)
+    processed_name = Recording.normalize_file_name(os.path.basename(output_path))
+    stat_result = os.stat(staged_path)
+    fingerprint = (hash_file(staged_path), stat_result.st_size, stat_result.st_mtime_ns)
+    with transaction(db_path):
+        record_lineage(db_path, output_path, original_id, offset_seconds, mode, remix_file)
+        Recording.mark_file_as_processed(db_path, processed_name, fingerprint)
+        schedule_retry(db_path, output_path, processed_name, fingerprint, "Remix ingest not finished.")
+    os.replace(staged_path, output_path)
+    info("Remix of recording %d (%s at %.2fs) saved to %s", original_id, mode, offset_seconds, output_path)
+
+    if wait:
+        _ingest_remix(db_path, output_path, processed_name, fingerprint)
+    else:
+        threading.Thread(target=_ingest_remix_in_background, args=(db_path, output_path, processed_name, fingerprint),
+                         daemon=True).start()
+    return output_path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 5:
+        print("Usage: python remix_engine.py <db_path> <original_id> <remix_file> <offset_seconds> [insert|overlay]")
+        sys.exit(1)
+    import Recording
+    database = sys.argv[1]
+    Recording.init_db(database)
+    create_remix(database, int(sys.argv[2]), sys.argv[3], float(sys.argv[4]), sys.argv[5] if len(sys.argv) > 5 else "insert",
+                 wait=True)
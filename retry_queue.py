@@ -0,0 +1,88 @@
+import sys
+import time
+import random
+from datetime import datetime
+from db import get_connection
+
+RETRY_BASE_SECONDS = 60.0
+RETRY_MAX_SECONDS = 6 * 3600.0
+# After this many failed attempts a file is given up on and left in the table for inspection.
+MAX_ATTEMPTS = 8
+
+
+def retry_delay(attempts):
+    """Seconds before attempt number attempts + 1: doubling from RETRY_BASE_SECONDS, +/-20% jitter."""
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def schedule_retry(db_path, file_path, processed_name=None, fingerprint=None, error=None):
+    """
+    Record a failed ingest of file_path and when to try it again. Returns False when the
+    file has now failed MAX_ATTEMPTS times and will not be retried.
+    """
+    conn = get_connection(db_path)
+    row = conn.execute("SELECT attempts FROM ingest_retry WHERE file_path = ?", (file_path,)).fetchone()
+    attempts = (row[0] if row else 0) + 1
+    next_attempt_at = time.time() + retry_delay(attempts) if attempts < MAX_ATTEMPTS else None
+    content_hash, file_size, file_mtime_ns = fingerprint or (None, None, None)
+    conn.execute("INSERT OR REPLACE INTO ingest_retry (file_path, processed_name, content_hash, file_size, "
+                 "file_mtime_ns, attempts, next_attempt_at, last_error, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                 (file_path, processed_name, content_hash, file_size, file_mtime_ns, attempts, next_attempt_at,
+                  str(error) if error is not None else None, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    return next_attempt_at is not None
+
+
+def clear_retry(db_path, file_path):
+    get_connection(db_path).execute("DELETE FROM ingest_retry WHERE file_path = ?", (file_path,))
+
+
+def due_retries(db_path, now=None, extension=".m4a"):
+    """
+    [(file_path, processed_name, fingerprint or None)] for retries whose time has come, oldest
+    first. Only files ending in extension are returned (all of them when it is None): the
+    watch daemon queues failed WAV conversions here too, and those are not ready to ingest.
+    """
+    rows = get_connection(db_path).execute(
+        "SELECT file_path, processed_name, content_hash, file_size, file_mtime_ns FROM ingest_retry "
+        "WHERE next_attempt_at IS NOT NULL AND next_attempt_at <= ? AND file_path LIKE ? ORDER BY next_attempt_at",
+        (time.time() if now is None else now, "%" + (extension or ""))).fetchall()
+    return [(file_path, processed_name, (content_hash, file_size, file_mtime_ns) if content_hash else None)
+            for file_path, processed_name, content_hash, file_size, file_mtime_ns in rows]
+
+
+def pending_paths(db_path, extension=".m4a", include_given_up=False):
+    """Files ending in extension waiting for a retry, which folder scans leave to the retry queue."""
+    rows = get_connection(db_path).execute(
+        "SELECT file_path FROM ingest_retry WHERE (next_attempt_at IS NOT NULL OR ?) AND file_path LIKE ?",
+        (include_given_up, "%" + (extension or ""))).fetchall()
+    return {row[0] for row in rows}
+
+
+def retry_now(db_path):
+    """Make every pending and given-up file due immediately, with a fresh attempt count."""
+    return get_connection(db_path).execute(
+        "UPDATE ingest_retry SET next_attempt_at = ?, attempts = 0", (time.time(),)).rowcount
+
+
+def print_retries(db_path):
+    rows = get_connection(db_path).execute(
+        "SELECT file_path, attempts, next_attempt_at, last_error FROM ingest_retry ORDER BY next_attempt_at").fetchall()
+    if not rows:
+        print("No failed files waiting for a retry.")
+    for file_path, attempts, next_attempt_at, last_error in rows:
+        when = (datetime.fromtimestamp(next_attempt_at).strftime("%Y-%m-%d %H:%M:%S")
+                if next_attempt_at is not None else "given up")
+        print(f"{file_path}: {attempts} attempts, next {when}: {last_error}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python retry_queue.py <db_path> [--retry-now]")
+        sys.exit(1)
+    from schema import migrate
+    migrate(sys.argv[1])
+    if "--retry-now" in sys.argv:
+        print(f"{retry_now(sys.argv[1])} files will be retried on the next ingest run.")
+    else:
+        print_retries(sys.argv[1])
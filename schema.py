@@ -0,0 +1,193 @@
+import sys
+from db import get_connection, transaction
+from processed_ledger import LEDGER_COLUMNS
+from audio_metadata import RECORDING_COLUMNS, CATEGORY_COLUMNS
+
+# Tracks in a category or year play oldest first; id breaks ties between equal timestamps.
+PLAYBACK_ORDER = "creation_date, id"
+
+
+def _add_columns(conn, table, columns):
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for column, column_type in columns.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+
+def _create_base_tables(conn):
+    # IF NOT EXISTS: databases created before this module already have these tables.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            embedding BLOB,
+            name_audio_path TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS recordings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            transcription TEXT,
+            embedding BLOB,
+            creation_date TEXT,
+            category_id INTEGER REFERENCES categories (id),
+            file_path TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS processed_files (
+            file_name TEXT PRIMARY KEY
+        )
+    """)
+
+
+def _add_ingest_columns(conn):
+    _add_columns(conn, "processed_files", LEDGER_COLUMNS)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_processed_files_hash ON processed_files (content_hash)")
+    _add_columns(conn, "recordings", RECORDING_COLUMNS)
+    _add_columns(conn, "categories", CATEGORY_COLUMNS)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_checkpoint (
+            wav_path TEXT PRIMARY KEY,
+            stage TEXT NOT NULL,
+            m4a_path TEXT,
+            updated_at TEXT NOT NULL
+        )
+    """)
+
+
+def _add_playback_indexes(conn):
+    """
+    Store the creation year and month as integer columns, kept in step with creation_date
+    by triggers, so time mode is an index lookup instead of strftime() over every row.
+    """
+    _add_columns(conn, "recordings", {"creation_year": "INTEGER", "creation_month": "INTEGER"})
+    conn.execute("""
+        UPDATE recordings
+        SET creation_year = CAST(strftime('%Y', creation_date) AS INTEGER),
+            creation_month = CAST(strftime('%m', creation_date) AS INTEGER)
+    """)
+    for event in ("INSERT", "UPDATE OF creation_date"):
+        name = "trg_recordings_creation_" + event.split()[0].lower()
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON recordings
+            BEGIN
+                UPDATE recordings
+                SET creation_year = CAST(strftime('%Y', NEW.creation_date) AS INTEGER),
+                    creation_month = CAST(strftime('%m', NEW.creation_date) AS INTEGER)
+                WHERE id = NEW.id;
+            END
+        """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_recordings_category ON recordings (category_id, {PLAYBACK_ORDER})")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_recordings_year ON recordings (creation_year, {PLAYBACK_ORDER})")
+
+
+def _add_embedding_format(conn):
+    """Embeddings may be stored compactly; NULL means the original raw float32 blob."""
+    _add_columns(conn, "recordings", {"embedding_format": "TEXT"})
+    _add_columns(conn, "categories", {"embedding_format": "TEXT", "embedding_full": "BLOB"})
+
+
+def _add_retry_queue(conn):
+    """Files whose ingest failed, with their backoff schedule; see retry_queue.py."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_retry (
+            file_path TEXT PRIMARY KEY,
+            processed_name TEXT,
+            content_hash TEXT,
+            file_size INTEGER,
+            file_mtime_ns INTEGER,
+            attempts INTEGER NOT NULL,
+            next_attempt_at REAL,
+            last_error TEXT,
+            updated_at TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ingest_retry_due ON ingest_retry (next_attempt_at)")
+
+
+def _add_seek_table(conn):
+    """Packet start times for seeking without decoding from the start; see seek_table.py."""
+    _add_columns(conn, "recordings", {"seek_table": "BLOB"})
+
+
+def _add_remixes(conn):
+    """Lineage of remixes: which recording each remix file was made from, and where it was mixed in."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS remixes (
+            file_path TEXT PRIMARY KEY,
+            original_id INTEGER NOT NULL REFERENCES recordings (id),
+            offset_seconds REAL NOT NULL,
+            mode TEXT NOT NULL,
+            source_path TEXT,
+            created_at TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_remixes_original ON remixes (original_id)")
+
+
+def _add_category_version(conn):
+    """
+    A counter bumped by triggers whenever categories are added, removed, renamed or re-embedded,
+    so long-running processes notice changes made elsewhere (e.g. by recluster.py) and reload.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS category_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO category_version (id, version) VALUES (1, 0)")
+    for name, event in (("insert", "INSERT"), ("delete", "DELETE"),
+                        ("update", "UPDATE OF name, embedding, embedding_format, embedding_full")):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS categories_version_{name} AFTER {event} ON categories
+            BEGIN
+                UPDATE category_version SET version = version + 1 WHERE id = 1;
+            END
+        """)
+
+
+def _add_recording_path_index(conn):
+    """Lets a store find an already ingested file (and remixes_of join on file_path) without a scan."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_recordings_file_path ON recordings (file_path)")
+
+
+# Append only: a database at user_version N has had the first N migrations applied.
+MIGRATIONS = [
+    _create_base_tables,
+    _add_ingest_columns,
+    _add_playback_indexes,
+    _add_embedding_format,
+    _add_retry_queue,
+    _add_seek_table,
+    _add_remixes,
+    _add_category_version,
+    _add_recording_path_index,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(db_path):
+    return get_connection(db_path).execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db_path):
+    """Bring db_path up to SCHEMA_VERSION, one transaction per migration. Returns the version."""
+    version = schema_version(db_path)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"{db_path} has schema version {version}; this code only knows up to {SCHEMA_VERSION}.")
+    for number in range(version + 1, SCHEMA_VERSION + 1):
+        with transaction(db_path) as conn:
+            MIGRATIONS[number - 1](conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+        print(f"Applied schema migration {number}: {MIGRATIONS[number - 1].__name__.strip('_')}.")
+    return SCHEMA_VERSION
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python schema.py <db_path>")
+        sys.exit(1)
+    print(f"Schema version: {migrate(sys.argv[1])}")
@@ -0,0 +1,105 @@
+import sys
+import sqlite3
+import subprocess
+import numpy as np
+from db import get_connection, get_read_connection, transaction
+from metrics import timed, warning
+
+# One entry per quarter second: a seek lands on a packet boundary at most this far before the target.
+SEEK_INTERVAL_SECONDS = 0.25
+BACKFILL_BATCH_ROWS = 200
+
+
+@timed("seek_table")
+def build_seek_table(file_path, interval=SEEK_INTERVAL_SECONDS):
+    """
+    Start times in seconds of the first audio packet in every interval, read from the
+    container's packet index with ffprobe; no audio is decoded. For an M4A these are AAC
+    frame boundaries, so ffmpeg can start decoding exactly there.
+    """
+    command = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "a:0",
+        "-show_entries", "packet=pts_time",
+        "-of", "csv=p=0",
+        file_path
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe error for file {file_path}: {result.stderr.strip()}")
+    times = np.array([float(line.split(",")[0]) for line in result.stdout.split()
+                      if line and not line.startswith("N/A")], dtype=np.float64)
+    if not len(times):
+        return times
+    times.sort()
+    slots = np.floor(times / interval).astype(np.int64)
+    return times[np.r_[True, slots[1:] != slots[:-1]]]
+
+
+def safe_build_seek_table(file_path):
+    try:
+        return build_seek_table(file_path)
+    except Exception as e:
+        warning("Could not build a seek table for %s: %s", file_path, e)
+        return None
+
+
+def encode_seek_table(table):
+    return sqlite3.Binary(np.asarray(table, dtype=np.float64).tobytes())
+
+
+def decode_seek_table(blob):
+    return np.frombuffer(blob, dtype=np.float64) if blob else None
+
+
+def seek_point(table, seconds):
+    """The last packet boundary at or before seconds; seconds itself when there is no table."""
+    if table is None or not len(table):
+        return max(0.0, seconds)
+    index = int(np.searchsorted(table, seconds, side="right")) - 1
+    return float(table[index]) if index >= 0 else 0.0
+
+
+def store_seek_table(db_path, recording_id, table):
+    get_connection(db_path).execute("UPDATE recordings SET seek_table = ? WHERE id = ?",
+                                    (encode_seek_table(table), recording_id))
+
+
+def load_seek_tables(db_path, recording_ids):
+    """{recording_id: (seek table or None, duration or None)} for the given recordings."""
+    recording_ids = list(recording_ids)
+    tables = {}
+    conn = get_read_connection(db_path)
+    for start in range(0, len(recording_ids), 500):
+        chunk = recording_ids[start:start + 500]
+        placeholders = ",".join("?" * len(chunk))
+        for recording_id, blob, duration in conn.execute(
+                f"SELECT id, seek_table, duration FROM recordings WHERE id IN ({placeholders})", chunk):
+            tables[recording_id] = (decode_seek_table(blob), duration)
+    return tables
+
+
+def backfill_seek_tables(db_path):
+    """Build seek tables for recordings ingested before they existed. Returns how many were stored."""
+    rows = get_read_connection(db_path).execute(
+        "SELECT id, file_path FROM recordings WHERE seek_table IS NULL AND file_path IS NOT NULL").fetchall()
+    stored = 0
+    for start in range(0, len(rows), BACKFILL_BATCH_ROWS):
+        built = [(recording_id, safe_build_seek_table(file_path))
+                 for recording_id, file_path in rows[start:start + BACKFILL_BATCH_ROWS]]
+        with transaction(db_path):
+            for recording_id, table in built:
+                if table is not None:
+                    store_seek_table(db_path, recording_id, table)
+                    stored += 1
+    print(f"Built seek tables for {stored} of {len(rows)} recordings.")
+    return stored
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python seek_table.py <db_path>")
+        sys.exit(1)
+    from schema import migrate
+    migrate(sys.argv[1])
+    backfill_seek_tables(sys.argv[1])
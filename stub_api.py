@@ -0,0 +1,174 @@
+import io
+import re
+import sys
+import json
+import time
+import wave
+import random
+import hashlib
+import threading
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+EMBEDDING_DIM = 256
+TOPICS = 20
+# Within-topic spread of the synthetic embeddings; at 0.5 most recordings land on their topic's category.
+TOPIC_NOISE = 0.5
+TOPIC_PATTERN = re.compile(r"topic[ _]?(\d+)", re.IGNORECASE)
+
+
+def _topic_of(text, topics):
+    match = TOPIC_PATTERN.search(text or "")
+    if match:
+        return int(match.group(1)) % topics
+    return int(hashlib.sha256((text or "").encode("utf-8")).hexdigest(), 16) % topics
+
+
+def _silent_wav(seconds=0.5, sample_rate=22050):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(b"\0\0" * int(seconds * sample_rate))
+    return buffer.getvalue()
+
+
+class StubAPIServer:
+    """
+    Local stand-in for the OpenAI and ElevenLabs endpoints Recording.py calls, for
+    benchmarks and offline runs.
+
+    Transcriptions are "A story about topic N" where N comes from the uploaded file name
+    (synthetic files are named ..._topicN.wav), embeddings are a fixed centre per topic plus
+    per-text noise so categories form the way they would on real data, chat returns a
+    name for the topic, and text-to-speech returns a short silent clip. latency maps an
+    endpoint ("transcriptions", "embeddings", "chat", "tts") to (mean, jitter) in seconds;
+    error_rate is the share of requests answered with 500 or 429 + Retry-After.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=None, error_rate=0.0, dim=EMBEDDING_DIM, topics=TOPICS,
+                 seed=0):
+        self.latency = latency or {}
+        self.error_rate = error_rate
+        self.dim = dim
+        self.topics = topics
+        self.requests = {}
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._centres = np.random.default_rng(seed).normal(size=(topics, dim)).astype(np.float32)
+        self._lock = threading.Lock()
+        self._tts_audio = _silent_wav()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def openai_base_url(self):
+        return self.base_url + "/v1"
+
+    def embed(self, text):
+        seed = int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+        noise = np.random.default_rng(seed).normal(size=self.dim).astype(np.float32)
+        vector = self._centres[_topic_of(text, self.topics)] + TOPIC_NOISE * noise
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _delay_and_fail(self, endpoint):
+        """Sleep for the configured latency; returns an (status, headers) error or None."""
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            mean, jitter = self.latency.get(endpoint, (0.0, 0.0))
+            delay = max(0.0, self._random.gauss(mean, jitter)) if jitter else mean
+            failed = self._random.random() < self.error_rate
+            rate_limited = self._random.random() < 0.5
+            if failed:
+                self.errors += 1
+        if delay:
+            time.sleep(delay)
+        if not failed:
+            return None
+        return (429, {"Retry-After": "1"}) if rate_limited else (500, {})
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, content_type="application/json", headers=None):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path.endswith("/audio/transcriptions"):
+                    endpoint = "transcriptions"
+                elif self.path.endswith("/embeddings"):
+                    endpoint = "embeddings"
+                elif self.path.endswith("/chat/completions"):
+                    endpoint = "chat"
+                elif "text-to-speech" in self.path:
+                    endpoint = "tts"
+                else:
+                    self._send(404, {"error": {"message": f"Unknown endpoint {self.path}"}})
+                    return
+
+                error = server._delay_and_fail(endpoint)
+                if error is not None:
+                    status, headers = error
+                    self._send(status, {"error": {"message": "Injected failure"}}, headers=headers)
+                    return
+
+                if endpoint == "transcriptions":
+                    match = re.search(rb'filename="([^"]*)"', body)
+                    name = match.group(1).decode("utf-8", "replace") if match else ""
+                    self._send(200, {"text": f"A story about topic {_topic_of(name, server.topics)} from {name}."})
+                elif endpoint == "embeddings":
+                    texts = json.loads(body)["input"]
+                    texts = [texts] if isinstance(texts, str) else texts
+                    self._send(200, {"data": [{"index": i, "embedding": server.embed(text)}
+                                              for i, text in enumerate(texts)]})
+                elif endpoint == "chat":
+                    prompt = json.loads(body)["messages"][-1]["content"]
+                    name = f"Topic {_topic_of(prompt, server.topics)}"
+                    self._send(200, {"choices": [{"message": {"role": "assistant", "content": name}}]})
+                else:
+                    self._send(200, server._tts_audio, content_type="audio/mpeg")
+
+        return Handler
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    stub = StubAPIServer(port=port).start()
+    print(f"Stub API listening on {stub.base_url}.")
+    print(f"Set OPENAI_BASE_URL={stub.openai_base_url} and ELEVENLABS_BASE_URL={stub.base_url}.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stub.stop()
@@ -0,0 +1,46 @@
+import numpy as np
+from category_index import CategoryIndex
+from db import get_connection
+from embedding_codec import encode_embedding, truncate
+from schema import migrate
+
+
+def unit(rng, dim):
+    vec = rng.normal(size=dim).astype(np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+def test_wider_rows_are_truncated_on_load(tmp_path):
+    db_path = str(tmp_path / "categories.db")
+    migrate(db_path)
+    rng = np.random.default_rng(0)
+    wide, narrow = unit(rng, 1536), unit(rng, 1536)
+    conn = get_connection(db_path)
+    conn.execute("INSERT INTO categories (name, embedding, embedding_format) VALUES (?, ?, ?)",
+                 ("wide", *encode_embedding(wide)))
+    conn.execute("INSERT INTO categories (name, embedding, embedding_format) VALUES (?, ?, ?)",
+                 ("narrow", *encode_embedding(narrow, "float32", 256)))
+
+    index = CategoryIndex.from_db(db_path)
+    assert index.dim == 256
+    assert index.ids == [1, 2]
+    assert index.match(wide)[0] == 1
+    assert index.match(narrow)[0] == 2
+
+
+def test_shorter_category_shrinks_the_index():
+    # Stored dimensions lowered before the existing rows were converted.
+    rng = np.random.default_rng(1)
+    old = [unit(rng, 1536) for _ in range(3)]
+    index = CategoryIndex(initial_capacity=2)
+    for category_id, vec in enumerate(old, start=1):
+        index.add(category_id, f"old {category_id}", vec)
+    new = unit(rng, 1536)
+    index.add(4, "new", truncate(new, 256))
+
+    assert index.dim == 256
+    assert len(index) == 4
+    for category_id, vec in enumerate(old + [new], start=1):
+        best_id, score, _ = index.match(vec)
+        assert best_id == category_id
+        assert abs(score - 1.0) < 1e-5
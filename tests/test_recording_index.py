@@ -0,0 +1,41 @@
+import numpy as np
+from db import get_connection
+from embedding_codec import encode_embedding
+from recording_index import RecordingIndex
+from schema import migrate
+
+
+def add_recordings(db_path, count, rng):
+    conn = get_connection(db_path)
+    for _ in range(count):
+        conn.execute("INSERT INTO recordings (embedding, embedding_format) VALUES (?, ?)",
+                     encode_embedding(rng.normal(size=16).astype(np.float32)))
+
+
+def test_two_writers_on_one_index_do_not_duplicate_rows(tmp_path):
+    db_path = str(tmp_path / "recordings.db")
+    migrate(db_path)
+    rng = np.random.default_rng(0)
+    base = str(tmp_path / "recording_index")
+    first, second = RecordingIndex(base), RecordingIndex(base)
+    for _ in range(3):
+        add_recordings(db_path, 5, rng)
+        first.sync(db_path)
+        second.sync(db_path)
+    ids, _ = RecordingIndex(base).matrix()
+    assert ids.tolist() == list(range(1, 16))
+
+
+def test_append_drops_the_cached_ivf(tmp_path):
+    db_path = str(tmp_path / "recordings.db")
+    migrate(db_path)
+    rng = np.random.default_rng(1)
+    add_recordings(db_path, 50, rng)
+    index = RecordingIndex(str(tmp_path / "recording_index"))
+    index.sync(db_path)
+    index.build_ivf(nlist=4)
+    index.search(rng.normal(size=16))
+    assert index._ivf is not None
+    add_recordings(db_path, 1, rng)
+    index.sync(db_path)
+    assert index._ivf is None
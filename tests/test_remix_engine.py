@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+import remix_engine
+from remix_engine import CHANNELS, CROSSFADE_SECONDS, LIMITER_THRESHOLD, SAMPLE_RATE
+from remix_engine import crossfade_join, mix_streams, soft_limit
+
+CROSSFADE_FRAMES = int(CROSSFADE_SECONDS * SAMPLE_RATE)
+
+
+def constant(frames, level, chunk_frames=10000):
+    """Chunks of a stereo signal held at level."""
+    for start in range(0, frames, chunk_frames):
+        yield np.full((min(chunk_frames, frames - start), CHANNELS), level, dtype=np.float32)
+
+
+def tone(frames, freq, amplitude=0.3, chunk_frames=10000):
+    for start in range(0, frames, chunk_frames):
+        t = np.arange(start, min(frames, start + chunk_frames)) / SAMPLE_RATE
+        x = (amplitude * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+        yield np.stack([x, x], axis=1)
+
+
+def collect(chunks):
+    return np.concatenate(list(chunks))
+
+
+def test_crossfade_join_without_overlap_concatenates():
+    a = np.arange(10, dtype=np.float32).repeat(CHANNELS).reshape(-1, CHANNELS)
+    b = -np.arange(7, dtype=np.float32).repeat(CHANNELS).reshape(-1, CHANNELS)
+    out = collect(crossfade_join([iter([a[:4], a[4:]]), iter([b])], 0))
+    np.testing.assert_array_equal(out, np.concatenate([a, b]))
+
+
+def test_crossfade_join_overlaps_each_join():
+    out = collect(crossfade_join([constant(5000, 0.5), constant(3000, 0.5), constant(4000, 0.5)], 100))
+    assert len(out) == 5000 + 3000 + 4000 - 2 * 100
+
+
+def test_crossfade_join_is_equal_power():
+    # Uncorrelated noise keeps its power through an equal-power fade.
+    rng = np.random.default_rng(0)
+    first = rng.normal(0, 0.1, (20000, CHANNELS)).astype(np.float32)
+    second = rng.normal(0, 0.1, (20000, CHANNELS)).astype(np.float32)
+    out = collect(crossfade_join([iter([first]), iter([second])], 10000))
+    fade = out[10000:20000]
+    assert np.sqrt((fade ** 2).mean()) == pytest.approx(0.1, rel=0.05)
+
+
+def test_soft_limit_leaves_quiet_audio_alone():
+    chunk = np.linspace(-LIMITER_THRESHOLD, LIMITER_THRESHOLD, 101, dtype=np.float32).reshape(-1, 1)
+    assert soft_limit(chunk) is chunk
+
+
+def test_soft_limit_bends_peaks_below_full_scale():
+    chunk = np.array([[0.5], [0.95], [1.5], [-3.0], [-0.92]], dtype=np.float32)
+    limited = soft_limit(chunk)
+    assert limited[0, 0] == chunk[0, 0]
+    assert np.all(np.abs(limited) <= 1.0)
+    assert np.all(np.sign(limited) == np.sign(chunk))
+    assert LIMITER_THRESHOLD < limited[1, 0] < limited[2, 0]
+
+
+def test_soft_limit_is_continuous_at_threshold():
+    just_above = soft_limit(np.array([[LIMITER_THRESHOLD + 1e-4]], dtype=np.float32))
+    assert just_above[0, 0] == pytest.approx(LIMITER_THRESHOLD + 1e-4, abs=1e-5)
+
+
+def test_mix_streams_rejects_unknown_mode():
+    with pytest.raises(ValueError):
+        list(mix_streams(constant(100, 0.1), constant(100, 0.1), 10, mode="reverse"))
+
+
+def test_insert_length_and_no_clicks():
+    original, remix, offset = 10 * SAMPLE_RATE, 3 * SAMPLE_RATE, 4 * SAMPLE_RATE
+    out = collect(mix_streams(tone(original, 220), tone(remix, 440), offset, "insert"))
+    assert len(out) == original + remix - 2 * CROSSFADE_FRAMES
+    # The largest sample-to-sample step of a 440 Hz tone at 0.3 is about 0.019.
+    assert np.abs(np.diff(out[:, 0])).max() < 0.05
+
+
+def test_insert_applies_remix_gain():
+    out = collect(mix_streams(constant(SAMPLE_RATE, 0.0), constant(SAMPLE_RATE, 0.1), SAMPLE_RATE // 2,
+                              "insert", remix_gain=2.0))
+    middle = SAMPLE_RATE // 2 + SAMPLE_RATE // 2 - CROSSFADE_FRAMES
+    assert out[middle, 0] == pytest.approx(0.2)
+
+
+def test_overlay_length_covers_both_streams():
+    out = collect(mix_streams(constant(SAMPLE_RATE, 0.1), constant(SAMPLE_RATE, 0.1), SAMPLE_RATE // 2, "overlay"))
+    assert len(out) == SAMPLE_RATE // 2 + SAMPLE_RATE
+
+
+def test_overlay_ducks_until_the_remix_ends():
+    # A silent remix leaves only the original times the duck envelope in the output.
+    original, remix, offset = 8 * SAMPLE_RATE, 3 * SAMPLE_RATE + 1234, SAMPLE_RATE
+    out = collect(mix_streams(constant(original, 0.5), constant(remix, 0.0, chunk_frames=7000), offset, "overlay"))
+    gain = out[:, 0] / 0.5
+    duck = 10 ** (remix_engine.OVERLAY_DUCK_DB / 20)
+    assert gain[:offset] == pytest.approx(1.0)
+    held = gain[offset + CROSSFADE_FRAMES:offset + remix - CROSSFADE_FRAMES]
+    assert held == pytest.approx(duck, abs=1e-6)
+    assert gain[offset + remix:] == pytest.approx(1.0)
+    # Smooth all the way through: no step larger than one ramp increment.
+    assert np.abs(np.diff(gain)).max() <= (1.0 - duck) / CROSSFADE_FRAMES + 1e-6
+
+
+def test_overlay_past_the_end_of_the_original_starts_where_it_ends():
+    out = collect(mix_streams(constant(SAMPLE_RATE, 0.1), constant(SAMPLE_RATE, 0.2), 2 * SAMPLE_RATE, "overlay"))
+    assert len(out) == 2 * SAMPLE_RATE
+    assert out[-SAMPLE_RATE // 2, 0] == pytest.approx(0.2)
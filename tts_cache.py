@@ -0,0 +1,94 @@
+import os
+import re
+import hashlib
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, Future
+from metrics import span
+
+SYNTHESIS_WORKERS = 2
+
+
+def normalize_tts_text(text):
+    """Whitespace and Unicode form do not change what is spoken; case can, so it is kept."""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def tts_key(text, voice_id, model_id):
+    payload = "\0".join((model_id, voice_id, normalize_tts_text(text)))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """
+    Content-addressed store of synthesized speech, keyed by (text, voice_id, model_id).
+
+    Each clip is saved once as <readable name>_<key prefix>.mp3 in cache_dir and shared by
+    every category with the same name, voice and model. synthesize(text, voice_id,
+    model_id) takes a function that yields audio chunks; it is only called on a miss, and
+    concurrent requests for the same clip wait for the first one. submit() runs the same
+    work on a background pool and returns a Future of the path.
+    """
+
+    def __init__(self, cache_dir, workers=SYNTHESIS_WORKERS):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts")
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path_for(self, text, voice_id, model_id):
+        readable = re.sub(r"[^\w]+", "_", normalize_tts_text(text).lower()).strip("_")[:40] or "clip"
+        return os.path.join(self.cache_dir, f"{readable}_{tts_key(text, voice_id, model_id)[:16]}.mp3")
+
+    def lookup(self, text, voice_id, model_id):
+        """Path of the cached clip, or None if it has not been synthesized yet."""
+        path = self.path_for(text, voice_id, model_id)
+        return path if os.path.exists(path) else None
+
+    def synthesize(self, text, voice_id, model_id, synthesize_chunks):
+        path = self.path_for(text, voice_id, model_id)
+        with self._lock:
+            if os.path.exists(path):
+                self.hits += 1
+                return path
+            future = self._in_flight.get(path)
+            if future is None:
+                self.misses += 1
+                future = Future()
+                self._in_flight[path] = future
+                owner = True
+            else:
+                self.hits += 1
+                owner = False
+
+        if owner:
+            temp_path = path + ".part"
+            try:
+                # The synthesizer streams its chunks, so the whole download is the tts stage.
+                with open(temp_path, "wb") as f, span("tts"):
+                    for chunk in synthesize_chunks(text, voice_id, model_id):
+                        f.write(chunk)
+                os.replace(temp_path, path)
+            except Exception as e:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                future.set_exception(e)
+            else:
+                future.set_result(path)
+            finally:
+                with self._lock:
+                    self._in_flight.pop(path, None)
+        return future.result()
+
+    def submit(self, text, voice_id, model_id, synthesize_chunks):
+        return self._executor.submit(self.synthesize, text, voice_id, model_id, synthesize_chunks)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "pending": len(self._in_flight)}
+
+    def close(self, wait=True):
+        self._executor.shutdown(wait=wait)
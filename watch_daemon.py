@@ -0,0 +1,277 @@
+import os
+import sys
+import time
+import threading
+import importlib.util
+from queue import Queue, Empty
+from datetime import datetime
+import Recording
+from db import get_connection
+from processed_ledger import ProcessedLedger
+from metrics import start_exporters, info, warning, error
+from retry_queue import due_retries, pending_paths, schedule_retry, clear_retry
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+POLL_INTERVAL = 1.0
+RETRY_CHECK_SECONDS = 30.0
+STABLE_SECONDS = 2.0
+
+
+def load_recording_bridge():
+    """Import "Recording Bridge1.0.py", whose file name is not a valid module name."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Recording Bridge1.0.py")
+    spec = importlib.util.spec_from_file_location("recording_bridge", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def set_checkpoint(db_path, wav_path, stage, m4a_path=None):
+    get_connection(db_path).execute(
+        "INSERT OR REPLACE INTO ingest_checkpoint (wav_path, stage, m4a_path, updated_at) VALUES (?, ?, ?, ?)",
+        (wav_path, stage, m4a_path, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+
+def clear_checkpoint(db_path, wav_path):
+    get_connection(db_path).execute("DELETE FROM ingest_checkpoint WHERE wav_path = ?", (wav_path,))
+
+
+class _WavEventHandler(FileSystemEventHandler):
+    def __init__(self, daemon):
+        self.daemon = daemon
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.daemon.notice(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.daemon.notice(event.src_path)
+
+    def on_moved(self, event):
+        # A WAV that appears by rename (the microphone capture's .part -> .wav) is already complete.
+        if not event.is_directory:
+            self.daemon.notice(event.dest_path, complete=True)
+
+
+class WatchDaemon:
+    """
+    Watches the raw WAV folder and streams every new recording through
+    convert -> transcribe -> embed -> categorize -> store.
+
+    File events come from watchdog (inotify on Linux) when it is installed, otherwise the
+    folder is polled. A WAV is only picked up once its size and mtime have been unchanged
+    for STABLE_SECONDS and it can be opened for writing, so files still being recorded are
+    left alone. A WAV renamed into the folder, as the microphone capture does, is already
+    complete and is queued at once. Progress is checkpointed in the ingest_checkpoint table
+    so a restart resumes converted-but-not-stored files instead of losing them.
+
+    WAVs that fail to convert and M4As that fail to ingest go to the retry queue, and the
+    folder scans leave them alone until their retry is due, so a broken file is attempted
+    with backoff rather than on every poll.
+    """
+
+    def __init__(self, watch_folder, output_folder, db_path, bridge=None):
+        self.watch_folder = watch_folder
+        self.output_folder = output_folder
+        self.db_path = db_path
+        self.bridge = bridge or load_recording_bridge()
+        self._candidates = {}
+        self._candidates_lock = threading.Lock()
+        self._queued = set()
+        # WAVs waiting on the retry queue, including ones it gave up on; only due_retries re-queues them.
+        self._deferred = set()
+        self._work = Queue()
+        self._stop = threading.Event()
+        self._observer = None
+
+    def notice(self, path, complete=False):
+        if not path.lower().endswith(".wav"):
+            return
+        with self._candidates_lock:
+            if path in self._queued or path in self._deferred:
+                return
+            if complete:
+                self._candidates.pop(path, None)
+                self._queued.add(path)
+            else:
+                self._candidates.setdefault(path, None)
+                return
+        self._work.put(("wav", path, time.monotonic()))
+
+    def _scan_watch_folder(self):
+        with os.scandir(self.watch_folder) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    self.notice(entry.path)
+
+    def _is_writable(self, path):
+        try:
+            with open(path, "rb+"):
+                return True
+        except OSError:
+            return False
+
+    def _check_candidates(self):
+        now = time.monotonic()
+        with self._candidates_lock:
+            candidates = list(self._candidates.items())
+        for path, last_seen in candidates:
+            try:
+                stat_result = os.stat(path)
+            except FileNotFoundError:
+                with self._candidates_lock:
+                    self._candidates.pop(path, None)
+                continue
+            signature = (stat_result.st_size, stat_result.st_mtime_ns)
+            if last_seen is None or last_seen[0] != signature:
+                with self._candidates_lock:
+                    self._candidates[path] = (signature, now)
+                continue
+            if now - last_seen[1] >= STABLE_SECONDS and stat_result.st_size > 0 and self._is_writable(path):
+                with self._candidates_lock:
+                    self._candidates.pop(path, None)
+                    self._queued.add(path)
+                self._work.put(("wav", path, now))
+
+    def _watch_loop(self):
+        while not self._stop.is_set():
+            if self._observer is None:
+                self._scan_watch_folder()
+            self._check_candidates()
+            self._stop.wait(POLL_INTERVAL / 2 if self._candidates else POLL_INTERVAL)
+
+    def _recover(self, ledger):
+        """Queue converted files from an interrupted run and any M4A the ledger has not seen."""
+        rows = get_connection(self.db_path).execute(
+            "SELECT wav_path, m4a_path FROM ingest_checkpoint WHERE stage = 'converted'").fetchall()
+        # Files waiting on the retry queue are left to it, so its backoff holds across restarts.
+        resumed = pending_paths(self.db_path)
+        for wav_path, m4a_path in rows:
+            if m4a_path and os.path.exists(m4a_path) and m4a_path not in resumed:
+                self._work.put(("m4a", m4a_path, time.monotonic(), wav_path))
+                resumed.add(m4a_path)
+        with os.scandir(self.output_folder) as entries:
+            for entry in entries:
+                if entry.name.endswith(".m4a") and entry.path not in resumed:
+                    is_processed, _ = ledger.check(Recording.normalize_file_name(entry.name), entry.path, entry.stat())
+                    if not is_processed:
+                        self._work.put(("m4a", entry.path, time.monotonic(), None))
+        if rows or not self._work.empty():
+            info("Recovered %d files from the previous run.", self._work.qsize())
+
+    def _ingest(self, ledger, m4a_path, wav_path):
+        normalized_name = Recording.normalize_file_name(os.path.basename(m4a_path))
+        is_processed, fingerprint = ledger.check(normalized_name, m4a_path)
+        if not is_processed:
+            if not Recording.process_audio_and_store_with_category(m4a_path, self.db_path, normalized_name, fingerprint):
+                Recording.defer_failed_file(self.db_path, m4a_path, normalized_name, fingerprint, "Ingest failed.")
+                if wav_path is not None:
+                    # The retry queue owns the M4A from here on.
+                    clear_checkpoint(self.db_path, wav_path)
+                return False
+            ledger.add(normalized_name, fingerprint)
+        if wav_path is not None:
+            clear_checkpoint(self.db_path, wav_path)
+        return True
+
+    def _convert_failed(self, wav_path):
+        if os.path.exists(wav_path):
+            if not schedule_retry(self.db_path, wav_path, error="Conversion failed."):
+                warning("Giving up on %s; see python retry_queue.py %s.", wav_path, self.db_path)
+            with self._candidates_lock:
+                self._deferred.add(wav_path)
+        else:
+            clear_retry(self.db_path, wav_path)
+        clear_checkpoint(self.db_path, wav_path)
+
+    def _queue_due_retries(self):
+        for file_path, _, _ in due_retries(self.db_path, extension=None):
+            kind = "wav" if file_path.lower().endswith(".wav") else "m4a"
+            with self._candidates_lock:
+                if file_path in self._queued:
+                    continue
+                self._queued.add(file_path)
+                self._deferred.discard(file_path)
+            self._work.put((kind, file_path, time.monotonic(), None))
+
+    def _worker_loop(self):
+        ledger = ProcessedLedger.load(self.db_path)
+        self._recover(ledger)
+        next_retry_check = time.monotonic()
+        while not self._stop.is_set():
+            if time.monotonic() >= next_retry_check:
+                next_retry_check = time.monotonic() + RETRY_CHECK_SECONDS
+                self._queue_due_retries()
+            try:
+                item = self._work.get(timeout=POLL_INTERVAL)
+            except Empty:
+                continue
+            kind, path, noticed_at = item[:3]
+            try:
+                if kind == "wav":
+                    set_checkpoint(self.db_path, path, "pending")
+                    m4a_path = self.bridge.convert_wav_file(path)
+                    if m4a_path is None:
+                        self._convert_failed(path)
+                        continue
+                    set_checkpoint(self.db_path, path, "converted", m4a_path)
+                    clear_retry(self.db_path, path)
+                    stored = self._ingest(ledger, m4a_path, path)
+                else:
+                    stored = self._ingest(ledger, path, item[3])
+                if stored:
+                    info("%s playable %.1fs after it was ready.", os.path.basename(path), time.monotonic() - noticed_at)
+            except Exception as e:
+                error("Error processing %s: %s", path, e)
+            finally:
+                with self._candidates_lock:
+                    self._queued.discard(path)
+
+    def run(self):
+        os.makedirs(self.output_folder, exist_ok=True)
+        Recording.init_db(self.db_path)
+        self._deferred = pending_paths(self.db_path, extension=".wav", include_given_up=True)
+
+        if Observer is not None:
+            self._observer = Observer()
+            self._observer.schedule(_WavEventHandler(self), self.watch_folder, recursive=False)
+            self._observer.start()
+            info("Watching %s for new recordings.", self.watch_folder)
+        else:
+            warning("watchdog is not installed; polling %s every %ss.", self.watch_folder, POLL_INTERVAL)
+        self._scan_watch_folder()
+
+        watcher = threading.Thread(target=self._watch_loop, daemon=True)
+        worker = threading.Thread(target=self._worker_loop, daemon=True)
+        watcher.start()
+        worker.start()
+        try:
+            while not self._stop.is_set():
+                time.sleep(1)
+        except KeyboardInterrupt:
+            info("Stopping watch daemon.")
+        self.stop()
+        watcher.join()
+        worker.join()
+
+    def stop(self):
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+
+
+if __name__ == "__main__":
+    start_exporters()
+    recording_bridge = load_recording_bridge()
+    database = sys.argv[1] if len(sys.argv) > 1 else Recording.DB_PATH
+    WatchDaemon(recording_bridge.RAW_WAV_FOLDER, recording_bridge.AUDIO_RECORDINGS_FOLDER, database,
+                bridge=recording_bridge).run()